@@ -0,0 +1,53 @@
+"""
+Compares the rows/s of the row by row assignment against the bulk assignment
+used by assign_struct_array.
+
+    python benchmarks/bench_assign_struct_array.py
+"""
+import collections
+import timeit
+import numpy as np
+
+from dama.data.it import row_assign_struct_array, bulk_assign_struct_array
+
+
+BATCH_SIZE = 100000
+REPEAT = 5
+
+
+def bench(name, rows, type_elem, dtype, shape=None):
+    shape = len(rows) if shape is None else shape
+
+    def row_path():
+        stc_arr = np.empty(shape, dtype=dtype)
+        row_assign_struct_array(stc_arr, rows, type_elem)
+
+    def bulk_path():
+        stc_arr = np.empty(shape, dtype=dtype)
+        assert bulk_assign_struct_array(stc_arr, rows, type_elem)
+
+    row_t = min(timeit.repeat(row_path, number=1, repeat=REPEAT))
+    bulk_t = min(timeit.repeat(bulk_path, number=1, repeat=REPEAT))
+    print("{:<12} row: {:>12,.0f} rows/s  bulk: {:>12,.0f} rows/s  x{:.1f}".format(
+        name, len(rows) / row_t, len(rows) / bulk_t, row_t / bulk_t))
+
+
+def main():
+    dtype = np.dtype([("a", int), ("b", float), ("c", object)])
+    tuples = [(i, i * .5, str(i)) for i in range(BATCH_SIZE)]
+    bench("tuple", tuples, tuple, dtype)
+    bench("list", [list(row) for row in tuples], list, dtype)
+
+    Row = collections.namedtuple("Row", "a b c")
+    bench("namedtuple", [Row(*row) for row in tuples], Row, dtype)
+
+    dtype = np.dtype([("a", float), ("b", float), ("c", float)])
+    bench("ndarray", list(np.random.rand(BATCH_SIZE, 3)), np.ndarray, dtype)
+
+    dtype = np.dtype([("g0", float)])
+    bench("scalar", list(np.random.rand(BATCH_SIZE)), float, dtype)
+    bench("ndarray 2d", list(np.random.rand(BATCH_SIZE, 8)), np.ndarray, dtype, shape=[BATCH_SIZE, 8])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Compares the weighted reservoir sampling wsrj (item by item) against
+wsrj_batch (vectorized over batchs).
+
+    python benchmarks/bench_sample.py
+"""
+import time
+import numpy as np
+
+from dama.utils.numeric_functions import wsrj, wsrj_batch
+
+
+LENGTH = 2000000
+BATCH_SIZE = 10000
+K = 1000
+
+
+def items_weights(array, weights):
+    for item, weight in zip(array, weights):
+        yield item, weight
+
+
+def batchs(array, weights):
+    for i in range(0, len(array), BATCH_SIZE):
+        values = array[i:i + BATCH_SIZE]
+        yield (lambda v=values: {"x": v}), len(values), None if weights is None else weights[i:i + BATCH_SIZE]
+
+
+def bench(name, fn):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print("{:<12} {:>8.2f}s {:>14,.0f} items/s".format(name, elapsed, LENGTH / elapsed))
+
+
+def main():
+    array = np.arange(LENGTH)
+    weights = np.random.uniform(1, 10, LENGTH)
+    bench("wsrj", lambda: list(wsrj(items_weights(array, weights), K)))
+    bench("wsrj_batch", lambda: wsrj_batch(batchs(array, weights), K))
+    bench("uniform", lambda: wsrj_batch(batchs(array, None), K))
+
+
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,10 @@ docs_require = [
 
 tests_require = []
 
+parquet_require = [
+    'pyarrow>=1.0.0',
+]
+
 setup(
     name='DaMa ML',
     #use_scm_version=True,
@@ -32,6 +36,7 @@ setup(
     extras_require={
         'docs': docs_require,
         'test': tests_require,
+        'parquet': parquet_require,
     },
     entry_points={
         'console_scripts': [
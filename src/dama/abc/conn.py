@@ -4,7 +4,7 @@ from dama.utils.core import Shape, Chunks
 import numpy as np
 
 
-__all__ = ['AbsConn']
+__all__ = ['AbsConn', 'AbsTable']
 
 
 class AbsConn(ABC):
@@ -71,6 +71,22 @@ class AbsConn(ABC):
         return NotImplemented
 
 
+class AbsTable(AbsConn):
+    """Rows of a table, the projections and the filters of the predicates are run by the table"""
+
+    @abstractmethod
+    def project(self, columns: list) -> 'AbsTable':
+        return NotImplemented
+
+    @abstractmethod
+    def where(self, predicate) -> 'AbsTable':
+        return NotImplemented
+
+    @abstractmethod
+    def same_table(self, other) -> bool:
+        return NotImplemented
+
+
 class Singleton(type):
     _instances = {}
 
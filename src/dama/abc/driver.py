@@ -1,11 +1,15 @@
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from numcodecs.abc import Codec
 import numpy as np
+import json
 import os
 from dama.utils.config import get_settings
 from dama.utils.logger import log_config
 from dama.utils.core import Login, Chunks, Shape
 from dama.utils.files import build_path
+from dama.utils.numeric_functions import CHUNK_BYTES
 from dama.abc.conn import AbsConn
 from dama.fmtypes import Slice
 from numbers import Number
@@ -22,6 +26,7 @@ class AbsDriver(ABC):
     ext = None
     insert_by_rows = None
     data_tag = None
+    staging_tag = "staging"
 
     def __init__(self, compressor: Codec = None, login: Login = None, mode: str = 'a', path: str = None, conn=None):
         self.compressor = compressor
@@ -34,6 +39,7 @@ class AbsDriver(ABC):
 
         self.mode = mode
         self.attrs = None
+        self.written_bytes = 0
         self.path = path
         self.url = None
         self.login = login
@@ -68,7 +74,8 @@ class AbsDriver(ABC):
         build_path(dir_levels[:-1])
 
     @abstractmethod
-    def manager(self, chunks: Chunks) -> AbsConn:
+    def manager(self, chunks: Chunks, groups: list = None) -> AbsConn:
+        """Groups of the data, if groups is not None only these groups are opened"""
         return NotImplemented
 
     @abstractmethod
@@ -129,10 +136,71 @@ class AbsDriver(ABC):
         else:
             manager.store(self)
 
-    def batchs_writer(self, data):
+    def count_bytes(self, array):
+        """Add the bytes of a written block to the total of the writers, Data saves this
+        total as the disk size so the files are not walked"""
+        self.written_bytes += int(getattr(array, "nbytes", 0))
+
+    def drop_schema(self, dtypes: np.dtype):
+        """Remove the saved dtypes and the groups if they are not the dtypes, so a different
+        schema is written from scratch"""
+        old_dtypes = self.dtypes
+        if old_dtypes is not None and old_dtypes != dtypes:
+            del self.conn[self.metadata_tag]["dtypes"]
+            if self.data_tag in self.conn:
+                del self.conn[self.data_tag]
+
+    def resize(self, length: int):
+        """Change the number of rows of every group, the written rows are kept"""
+        raise NotImplementedError("The driver {} can't be resized".format(self.cls_name()))
+
+    def set_virtual(self, sources: list, shape: Shape):
+        """Groups that read the rows of the sources (dicts with url and rows) without copying them"""
+        raise NotImplementedError("The driver {} can't build virtual groups".format(self.cls_name()))
+
+    @property
+    def virtual_sources(self) -> list:
+        if self.attrs is not None and "virtual_sources" in self.attrs:
+            return json.loads(self.attrs["virtual_sources"])
+
+    def source_attrs(self, url: str) -> dict:
+        """The attrs of the data saved by this driver in url"""
+        raise NotImplementedError("The driver {} can't read the attrs of a source".format(self.cls_name()))
+
+    def changed_sources(self) -> list:
+        """The virtual sources removed or with a hash different from the one saved with the virtual groups"""
+        changed = []
+        for source in self.virtual_sources or []:
+            try:
+                source_hash = self.source_attrs(source["url"]).get("hash")
+            except (IOError, KeyError, ValueError):
+                source_hash = None
+            if source_hash != source["hash"]:
+                changed.append(source)
+        return changed
+
+    def materialize(self):
+        """Copy the rows of the virtual groups in the data level, the sources are not read again"""
+        self.require_stage()
+        for group in self.groups:
+            source = self[group]
+            target = self.conn[self.staging_tag][group]
+            row_bytes = max(int(np.prod(source.shape[1:])) * target.dtype.itemsize, 1)
+            step = max(target.chunks[0] * (CHUNK_BYTES // (target.chunks[0] * row_bytes)), target.chunks[0])
+            for init in range(0, source.shape[0], step):
+                block = source[init:init + step]
+                target[init:init + step] = block
+                self.count_bytes(block)
+        self.commit_stage()
+        del self.attrs["virtual_sources"]
+
+    def batchs_writer(self, data, workers: int = 1, ordered: bool = True, atomic: bool = False):
         batch_size = getattr(data, 'batch_size', 0)
         log.info("Writing with chunks {}".format(batch_size))
-        if batch_size > 0:
+        if batch_size > 0 and (workers > 1 or atomic) and self.insert_by_rows is False:
+            self.chunks_writer(tqdm(data, total=data.num_splits()), workers=workers, ordered=ordered,
+                               atomic=atomic)
+        elif batch_size > 0:
             for smx in tqdm(data, total=data.num_splits()):
                 self.setitem(smx.slice, smx)
         else:
@@ -140,16 +208,115 @@ class AbsDriver(ABC):
                 for j, group in enumerate(self.groups):
                     self[group][i] = smx[j]
 
+    def chunks_writer(self, data, workers: int = 1, ordered: bool = True, atomic: bool = False):
+        """
+        Write the batchs re-sliced on the storage chunks, distinct chunks are written
+        concurrently by workers threads. If ordered is False the writes can finish out of
+        order. If atomic is True the data is written in a staging level that replaces the
+        data level only when all the writes are done.
+        """
+        level = self.staging_tag if atomic else self.data_tag
+        if atomic:
+            self.require_stage()
+        try:
+            self.write_chunks(self.chunk_tasks(data), level, workers=workers, ordered=ordered)
+        except Exception:
+            if atomic:
+                self.drop_stage()
+            raise
+        if atomic:
+            self.commit_stage()
+
+    def chunk_tasks(self, data):
+        """Yields (group, slice, array) with the rows of the batchs joined and cut on
+        the storage chunks of each group"""
+        buffers = {}
+        for smx in data:
+            for group in smx.batch.groups:
+                array = smx.batch[group].to_ndarray()
+                start, parts, rows = buffers.get(group, (smx.slice.start, [], 0))
+                if start + rows != smx.slice.start:
+                    if rows > 0:
+                        yield group, slice(start, start + rows), np.concatenate(parts)
+                    start, parts, rows = smx.slice.start, [], 0
+                parts.append(array)
+                rows += len(array)
+                step = self[group].chunks[0]
+                end = ((start + rows) // step) * step
+                if end > start:
+                    array = np.concatenate(parts) if len(parts) > 1 else parts[0]
+                    yield group, slice(start, end), array[:end - start]
+                    parts = [array[end - start:]]
+                    rows = start + rows - end
+                    start = end
+                buffers[group] = (start, parts, rows)
+        for group, (start, parts, rows) in buffers.items():
+            if rows > 0:
+                yield group, slice(start, start + rows), np.concatenate(parts)
+
+    def write_chunks(self, tasks, level: str, workers: int = 1, ordered: bool = True):
+        """Write the (group, slice, array) tasks in a pool of threads, the tasks that share
+        a storage chunk are not written at the same time"""
+        def write(group, item, array):
+            self.conn[level][group][item] = array
+
+        pending = OrderedDict()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for group, item, array in tasks:
+                step = self[group].chunks[0]
+                first, last = item.start // step, (item.stop - 1) // step
+                shared = [future for future, (f_group, f_first, f_last) in pending.items()
+                          if f_group == group and f_first <= last and first <= f_last]
+                if len(shared) > 0:
+                    wait(shared)
+                while len(pending) >= 2 * workers:
+                    self._next_done(pending, ordered)
+                pending[executor.submit(write, group, item, array)] = (group, first, last)
+                self.count_bytes(array)
+            while len(pending) > 0:
+                self._next_done(pending, ordered)
+
+    @staticmethod
+    def _next_done(pending: OrderedDict, ordered: bool):
+        if ordered:
+            future = next(iter(pending))
+        else:
+            done, _ = wait(list(pending.keys()), return_when=FIRST_COMPLETED)
+            future = next(iter(done))
+        del pending[future]
+        future.result()
+
+    def require_stage(self):
+        self.conn.require_group(self.staging_tag)
+        for group, (dtype, _) in self.dtypes.fields.items():
+            self.require_dataset(self.staging_tag, group, self[group].shape, dtype)
+
+    def commit_stage(self):
+        data = self.conn.require_group(self.data_tag)
+        for group in self.groups:
+            if group in data:
+                del data[group]
+            self.conn.move("{}/{}".format(self.staging_tag, group), "{}/{}".format(self.data_tag, group))
+        self.drop_stage()
+
+    def drop_stage(self):
+        if self.staging_tag in self.conn:
+            del self.conn[self.staging_tag]
+
     def setitem(self, item, value):
         if self.insert_by_rows is True:
             self[item] = value
         else:
             if isinstance(value, AbsConn):
                 for group in value.groups:
-                    self[group][item] = value[group].to_ndarray()
+                    array = value[group].to_ndarray()
+                    self[group][item] = array
+                    self.count_bytes(array)
             elif type(value) == Slice:
                 for group in value.batch.groups:
-                    self[group][item] = value.batch[group].to_ndarray()
+                    array = value.batch[group].to_ndarray()
+                    self[group][item] = array
+                    self.count_bytes(array)
             elif isinstance(value, Number):
                 self[item] = value
             elif isinstance(value, np.ndarray):
@@ -3,18 +3,20 @@ from dama.utils.decorators import cache
 from dama.fmtypes import DEFAUL_GROUP_NAME
 from dama.exceptions import NotChunksFound
 from dama.utils.core import Shape, Chunks
-from dama.abc.conn import AbsConn
+from dama.abc.conn import AbsConn, AbsTable
 from dama.abc.driver import AbsDriver
 from collections import OrderedDict
 from numbers import Number
+import operator
 from abc import ABCMeta
 import pandas as pd
 import dask.array as da
 import dask.dataframe as dd
+from dask import delayed
 import numpy as np
 
 
-__all__ = ['GroupManager', 'ListConn', 'DaskDfConn']
+__all__ = ['GroupManager', 'ListConn', 'DaskDfConn', 'Predicate']
 
 
 def to_conn(fn):
@@ -35,10 +37,103 @@ class MetaOperator(ABCMeta):
         return mapping
 
 
+class Predicate(object):
+    """
+    Boolean mask of a comparison between groups and values. The mask is a dask array
+    evaluated by chunks, if all the groups are stored in the same table the comparison is
+    also kept as a WHERE clause and as filters (a list of AND lists of (group, op, value)
+    terms joined by OR) so the table can filter the rows.
+    """
+    sql_ops = {"==": "=", "!=": "<>", "<": "<", "<=": "<=", ">": ">", ">=": ">="}
+    negate_ops = {"==": "!=", "!=": "==", "<": ">=", "<=": ">", ">": "<=", ">=": "<"}
+
+    def __init__(self, mask: da.Array, sql: str = None, params: tuple = (), source=None, filters: list = None):
+        self.mask = mask
+        self.sql = sql
+        self.params = params
+        self.source = source
+        self.filters = filters
+
+    @classmethod
+    def compare(cls, array: da.Array, op: str, value, group: str, source=None) -> 'Predicate':
+        ops = {"==": operator.eq, "!=": operator.ne, "<": operator.lt, "<=": operator.le,
+               ">": operator.gt, ">=": operator.ge}
+        mask = ops[op](array, value)
+        if source is None or not (value is None or isinstance(value, (Number, str, np.generic))):
+            return cls(mask)
+        if isinstance(value, np.generic):
+            value = value.item()
+        filters = [[(group, op, value)]]
+        if value is None and op in ("==", "!="):
+            sql = "{} IS {}NULL".format(group, "" if op == "==" else "NOT ")
+            return cls(mask, sql=sql, params=(), source=source, filters=filters)
+        return cls(mask, sql="{} {} {{p}}".format(group, cls.sql_ops[op]), params=(value, ), source=source,
+                   filters=filters)
+
+    def same_source(self, other: 'Predicate') -> bool:
+        return self.sql is not None and other.sql is not None and self.source is not None and \
+            other.source is not None and self.source.same_table(other.source)
+
+    def __and__(self, other: 'Predicate') -> 'Predicate':
+        return self._join(other, "AND", operator.and_)
+
+    def __or__(self, other: 'Predicate') -> 'Predicate':
+        return self._join(other, "OR", operator.or_)
+
+    def _join(self, other: 'Predicate', sql_op: str, op) -> 'Predicate':
+        if not isinstance(other, Predicate):
+            return Predicate(op(self.mask, other))
+        mask = op(self.mask, other.mask)
+        if self.same_source(other):
+            sql = "({}) {} ({})".format(self.sql, sql_op, other.sql)
+            if sql_op == "AND":
+                filters = self.and_filters(self.filters, other.filters)
+            else:
+                filters = self.filters + other.filters
+            return Predicate(mask, sql=sql, params=self.params + other.params, source=self.source,
+                             filters=filters)
+        return Predicate(mask)
+
+    def __invert__(self) -> 'Predicate':
+        if self.sql is None:
+            return Predicate(~self.mask)
+        # De Morgan, the negated terms of every AND list are joined by OR
+        filters = [[]]
+        for terms in self.filters:
+            filters = self.and_filters(filters, [[(group, self.negate_ops[op], value)]
+                                                 for group, op, value in terms])
+        return Predicate(~self.mask, sql="NOT ({})".format(self.sql), params=self.params, source=self.source,
+                         filters=filters)
+
+    @staticmethod
+    def and_filters(filters: list, other_filters: list) -> list:
+        return [terms + other_terms for terms in filters for other_terms in other_filters]
+
+    def to_sql(self, placeholder: str) -> tuple:
+        return self.sql.format(p=placeholder), self.params
+
+    def compute(self) -> np.ndarray:
+        return self.mask.compute()
+
+    def __array__(self, dtype=None):
+        return np.asarray(self.compute(), dtype=dtype)
+
+    def __bool__(self):
+        return bool(self.compute())
+
+    def __getattr__(self, name):
+        # the comparisons of a GroupManager returned the dask mask, its methods are kept
+        if name == "mask":
+            raise AttributeError(name)
+        return getattr(self.mask, name)
+
+
 class GroupManager(AbsConn):
     def __init__(self):
         super(GroupManager, self).__init__(OrderedDict(), None)
         self.counter = 0
+        self.sources = {}
+        self.views = {}
 
     def __add__(self, other: 'GroupManager') -> 'GroupManager':
         if isinstance(other, Number) and other == 0:
@@ -55,24 +150,22 @@ class GroupManager(AbsConn):
         if isinstance(item, slice):
             return self.manager_from_groups(self.groups, item)
         elif isinstance(item, str):
-            dict_conn = GroupManager()
-            dict_conn[item] = self.conn[item]
-            return dict_conn
+            return self.select_groups([item])
         elif isinstance(item, int):
             return self.manager_from_groups(self.groups, item)
         elif isinstance(item, list):
-            dict_conn = GroupManager()
-            for group in item:
-                dict_conn[group] = self.conn[group]
-            return dict_conn
+            return self.select_groups(item)
         elif isinstance(item, np.ndarray) and item.dtype == np.dtype(int):
             return self.manager_from_groups(self.groups, item)
-        elif isinstance(item, da.Array):
-            index = [i for i, is_true in enumerate(item.compute()) if is_true]  # fixme generalize masked data
-            return self.manager_from_groups(self.groups, index)
+        elif isinstance(item, Predicate):
+            return self.filter(item)
+        elif isinstance(item, (da.Array, np.ndarray)) and item.dtype == np.dtype(bool):
+            return self.compress(item)
 
     def __setitem__(self, key, value):
         self.conn[key] = value
+        self.sources.pop(key, None)
+        self.views.pop(key, None)
 
     def __iter__(self):
         self.counter = 0
@@ -88,13 +181,78 @@ class GroupManager(AbsConn):
             return elem
 
     def __eq__(self, other):
+        return self._compare("==", other)
+
+    def __ne__(self, other):
+        return self._compare("!=", other)
+
+    def __lt__(self, other):
+        return self._compare("<", other)
+
+    def __le__(self, other):
+        return self._compare("<=", other)
+
+    def __gt__(self, other):
+        return self._compare(">", other)
+
+    def __ge__(self, other):
+        return self._compare(">=", other)
+
+    def _compare(self, op: str, other) -> Predicate:
+        """The comparisons return a Predicate (before they returned the dask mask), the mask is
+        in predicate.mask and the attributes of the mask are also read from the predicate"""
         if len(self.groups) == 1:
-            return self.conn[self.groups[0]] == other
+            group = self.groups[0]
+            return Predicate.compare(self.conn[group], op, other, group, source=self.sources.get(group))
         else:
             raise NotImplementedError
 
     def update(self, group_manager: 'GroupManager'):
         self.conn.update(group_manager.conn)
+        self.sources.update(getattr(group_manager, "sources", {}))
+        self.views.update(getattr(group_manager, "views", {}))
+
+    def select_groups(self, groups: list) -> 'GroupManager':
+        dict_conn = GroupManager()
+        for group in groups:
+            dict_conn[group] = self.conn[group]
+            if group in self.sources:
+                dict_conn.sources[group] = self.sources[group]
+            if group in self.views:
+                dict_conn.views[group] = self.views[group]
+        return dict_conn
+
+    def filter(self, predicate: Predicate) -> 'GroupManager':
+        """Rows where the predicate is true. If all the groups come from the table of the
+        predicate the rows are filtered by the table, otherwise the mask is evaluated"""
+        sources = [self.sources.get(group) for group in self.groups]
+        if predicate.sql is not None and all(source is not None and source.same_table(predicate.source)
+                                             for source in sources):
+            table = sources[0].project(self.groups).where(predicate)
+            return GroupManager.convert_table(table, chunks=self.chunksize)
+        return self.compress(predicate.mask)
+
+    def compress(self, mask) -> 'GroupManager':
+        """Select the rows of the mask. Every chunk of a group is filtered with its part of the mask,
+        before the reads only the selected rows of each part are counted, chunk by chunk"""
+        if not isinstance(mask, da.Array):
+            mask = da.from_array(np.asarray(mask).reshape(-1), chunks=(self.conn[self.groups[0]].chunks[0], ))
+        mask = mask.reshape(-1)
+        counts = {}
+        dict_conn = GroupManager()
+        for group in self.groups:
+            array = self.conn[group]
+            row_chunks = array.chunks[0]
+            group_mask = mask.rechunk((row_chunks, ))
+            if row_chunks not in counts:
+                counts[row_chunks] = tuple(int(count) for count in group_mask.map_blocks(
+                    lambda block: np.array([np.count_nonzero(block)]), chunks=((1, ) * len(row_chunks), ),
+                    dtype=int).compute())
+            index = "".join(chr(ord("i") + dim) for dim in range(array.ndim))
+            dict_conn[group] = da.blockwise(lambda block, block_mask: block[block_mask], index,
+                                            array, index, group_mask, index[0],
+                                            adjust_chunks={index[0]: counts[row_chunks]}, dtype=array.dtype)
+        return dict_conn
 
     def _iterator(self, counter):
         elem = self[counter]
@@ -104,6 +262,9 @@ class GroupManager(AbsConn):
         for _ in range(len(self.conn)):
             k, v = self.conn.popitem(False)
             self.conn[new_key if old_key == k else k] = v
+        for attr in (self.sources, self.views):
+            if old_key in attr:
+                attr[new_key] = attr.pop(old_key)
 
     @classmethod
     def convert(cls, groups_items, chunks: Chunks) -> 'GroupManager':
@@ -115,12 +276,43 @@ class GroupManager(AbsConn):
         for group, data in groups_items:
             lock = False
             groups[group] = da.from_array(data, chunks=chunks[group], lock=lock)
+            if isinstance(data, AbsTable):
+                groups.sources[group] = data
+            elif isinstance(data, np.memmap):
+                groups.views[group] = (data, 0, data.shape[0])
+        return groups
+
+    @classmethod
+    def convert_table(cls, table, chunks: Chunks) -> 'GroupManager':
+        """Groups of the columns of a table. Each block of rows is read with one query for
+        all the columns and split by group, the columns not in the table are not read"""
+        if chunks is None:
+            raise NotChunksFound
+        groups = cls()
+        shape = table.shape
+        length = shape.to_tuple()[0]
+        step = max(chunks[table.groups[0]][0], 1)
+        blocks = [(min(step, length - init), delayed(table.read_rows)(slice(init, min(init + step, length))))
+                  for init in range(0, length, step)]
+        for group, (dtype, _) in table.dtypes.fields.items():
+            features = tuple(shape[group][1:])
+            parts = [da.from_delayed(block[group], shape=(rows, ) + features, dtype=dtype) for rows, block in blocks]
+            if len(parts) > 0:
+                groups[group] = da.concatenate(parts)
+            else:
+                empty = np.empty((0, ) + features, dtype=dtype)
+                groups[group] = da.from_array(empty, chunks=empty.shape)
+            groups.sources[group] = table
         return groups
 
     def manager_from_groups(self, groups, item) -> 'GroupManager':
         dict_conn = GroupManager()
         for group in groups:
             dict_conn[group] = self.conn[group][item]
+            if group in self.views and isinstance(item, slice) and item.step in (None, 1):
+                array, start, stop = self.views[group]
+                init, end, _ = item.indices(stop - start)
+                dict_conn.views[group] = (array, start + init, start + max(init, end))
         return dict_conn
 
     def to_dd(self) -> dd.DataFrame:
@@ -168,7 +360,11 @@ class GroupManager(AbsConn):
 
     def to_ndarray(self, dtype: np.dtype = None) -> np.ndarray:
         self.attrs["dtype"] = dtype
-        if len(self.groups) == 1:
+        if len(self.groups) == 1 and self.groups[0] in self.views and (dtype is None or dtype == self.dtype):
+            # the rows of a memory map are returned as a view, without copies
+            array, start, stop = self.views[self.groups[0]]
+            return array[start:stop]
+        elif len(self.groups) == 1:
             computed_array = self.conn[self.groups[0]].compute(dtype=self.dtype)
             if dtype is not None and dtype != self.dtype:
                 return computed_array.astype(dtype)
@@ -179,7 +375,8 @@ class GroupManager(AbsConn):
                 dtype = self.dtype
             data = np.empty(shape, dtype=dtype)
             total_cols = 0
-            for group in self.groups:
+            arrays = da.compute(*[self.conn[group] for group in self.groups])
+            for group, array in zip(self.groups, arrays):
                 try:
                     num_cols = self.shape[group][1]
                     slice_grp = (slice(None, None), slice(total_cols, total_cols + num_cols))
@@ -187,7 +384,7 @@ class GroupManager(AbsConn):
                     num_cols = 1
                     slice_grp = (slice(None, None), total_cols)
                 total_cols += num_cols
-                data[slice_grp] = self.conn[group].compute(dtype=dtype)
+                data[slice_grp] = array
             return data
 
     def to_stc_array(self) -> np.ndarray:
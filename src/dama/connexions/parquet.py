@@ -0,0 +1,232 @@
+from dama.abc.conn import AbsTable
+from dama.utils.core import Shape, Chunks
+from dama.utils.decorators import cache
+from dama.utils.miscellaneous import filter_dtypes, merge_dtype_list
+from collections import OrderedDict
+import operator
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+__all__ = ['Table', 'to_arrow', 'from_arrow', 'arrow_schema']
+
+
+def arrow_type(dtype: np.dtype, shape: tuple) -> pa.DataType:
+    if dtype.hasobject or dtype.kind == "U":
+        arrow_dtype = pa.string()
+    elif dtype.kind == "S":
+        arrow_dtype = pa.binary()
+    else:
+        arrow_dtype = pa.from_numpy_dtype(dtype)
+    if len(shape) > 0:
+        return pa.list_(arrow_dtype, int(np.prod(shape)))
+    return arrow_dtype
+
+
+def arrow_schema(dtypes: np.dtype, shapes: dict) -> pa.Schema:
+    return pa.schema([(group, arrow_type(dtype, tuple(shapes.get(group, ()))))
+                      for group, (dtype, _) in dtypes.fields.items()])
+
+
+def to_arrow(array: np.ndarray) -> pa.Array:
+    """The rows of a group with more than one dimension are fixed size lists of the flat values"""
+    if array.dtype.kind == "U":
+        array = array.astype(object)
+    if array.ndim > 1:
+        values = pa.array(np.ascontiguousarray(array).reshape(-1))
+        return pa.FixedSizeListArray.from_arrays(values, int(np.prod(array.shape[1:])))
+    return pa.array(array)
+
+
+def from_arrow(column, dtype: np.dtype = None, shape: tuple = ()) -> np.ndarray:
+    """Numpy array of an arrow column, the numeric buffers without nulls are not copied"""
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    if len(shape) > 0:
+        array = column.flatten().to_numpy(zero_copy_only=False).reshape((len(column), ) + tuple(shape))
+    else:
+        array = column.to_numpy(zero_copy_only=False)
+    if dtype is not None and array.dtype != dtype:
+        array = array.astype(dtype)
+    return array
+
+
+class Table(AbsTable):
+    """
+    Columns of a parquet file read by row groups. With filters (the filters of a Predicate)
+    the row groups whose min/max/null count statistics can't match are skipped and the rows
+    of the others are selected with a mask computed from the filter columns.
+    """
+    ops = {"==": operator.eq, "!=": operator.ne, "<": operator.lt, "<=": operator.le,
+           ">": operator.gt, ">=": operator.ge}
+
+    def __init__(self, conn: pq.ParquetFile, dtypes: np.dtype, shapes: dict, path: str = None,
+                 filters: list = None):
+        super(Table, self).__init__(conn, dtypes=dtypes)
+        self.shapes = shapes
+        self.path = path
+        self.filters = filters
+
+    def __getitem__(self, item):
+        if isinstance(item, str):
+            return self.project([item])
+        elif isinstance(item, list) and all(isinstance(elem, str) for elem in item):
+            return self.project(item)
+        elif isinstance(item, int):
+            return self.read_table(slice(item, item + 1)).to_ndarray()[0]
+        elif isinstance(item, slice):
+            return self.read_table(item).to_ndarray(dtype=self.attrs.get("dtype", None))
+        raise NotImplementedError
+
+    def __setitem__(self, key, value):
+        raise NotImplementedError("The parquet files are written by row groups with the driver")
+
+    def project(self, columns: list) -> 'Table':
+        """Table with only the columns, the other columns are not read"""
+        dtypes = merge_dtype_list([filter_dtypes(column, self.dtypes) for column in columns])
+        return Table(self.conn, dtypes, self.shapes, path=self.path, filters=self.filters)
+
+    def where(self, predicate) -> 'Table':
+        filters = predicate.filters
+        if self.filters is not None:
+            filters = [terms + other_terms for terms in self.filters for other_terms in filters]
+        return Table(self.conn, self.dtypes, self.shapes, path=self.path, filters=filters)
+
+    def same_table(self, other) -> bool:
+        return isinstance(other, Table) and other.path == self.path and other.filters == self.filters
+
+    @property
+    @cache
+    def statistics(self) -> list:
+        """min, max and null count of the one dimension columns in every row group"""
+        metadata = self.conn.metadata
+        columns = {}
+        for i in range(metadata.num_columns):
+            path = metadata.schema.column(i).path
+            if "." not in path:
+                columns[path] = i
+        row_groups = []
+        for i in range(metadata.num_row_groups):
+            row_group = metadata.row_group(i)
+            stats = {}
+            for group, j in columns.items():
+                column_stats = row_group.column(j).statistics
+                if column_stats is not None and column_stats.has_min_max:
+                    stats[group] = (column_stats.min, column_stats.max, column_stats.null_count)
+                elif column_stats is not None and column_stats.has_null_count:
+                    stats[group] = (None, None, column_stats.null_count)
+            row_groups.append((row_group.num_rows, stats))
+        return row_groups
+
+    @classmethod
+    def can_match(cls, terms: list, rows: int, stats: dict) -> bool:
+        for group, op, value in terms:
+            if group not in stats:
+                continue
+            min_value, max_value, null_count = stats[group]
+            if value is None:
+                if (op == "==" and null_count == 0) or (op == "!=" and null_count == rows):
+                    return False
+                continue
+            if min_value is None:
+                continue
+            try:
+                if (op == "==" and (value < min_value or value > max_value)) or \
+                        (op == "!=" and min_value == max_value == value and null_count == 0) or \
+                        (op == "<" and min_value >= value) or (op == "<=" and min_value > value) or \
+                        (op == ">" and max_value <= value) or (op == ">=" and max_value < value):
+                    return False
+            except TypeError:
+                continue
+        return True
+
+    @property
+    @cache
+    def selection(self) -> list:
+        """(row group, mask) of the row groups with selected rows, the mask is None if
+        all the rows are selected"""
+        if self.filters is None:
+            return [(i, None) for i in range(self.conn.metadata.num_row_groups)]
+        columns = sorted(set(group for terms in self.filters for group, _, _ in terms))
+        selection = []
+        for i, (rows, stats) in enumerate(self.statistics):
+            filters = [terms for terms in self.filters if self.can_match(terms, rows, stats)]
+            if len(filters) == 0:
+                continue
+            table = self.conn.read_row_group(i, columns=columns)
+            arrays = {group: from_arrow(table.column(group)) for group in columns}
+            mask = np.zeros(rows, dtype=bool)
+            for terms in filters:
+                terms_mask = np.ones(rows, dtype=bool)
+                for group, op, value in terms:
+                    if value is None:
+                        nulls = pd.isnull(arrays[group])
+                        terms_mask &= nulls if op == "==" else ~nulls
+                    else:
+                        terms_mask &= self.ops[op](arrays[group], value)
+                mask |= terms_mask
+            if mask.any():
+                selection.append((i, mask))
+        return selection
+
+    @property
+    def length(self) -> int:
+        row_groups = self.statistics
+        return sum(row_groups[i][0] if mask is None else int(mask.sum()) for i, mask in self.selection)
+
+    def read_rows(self, rows: slice) -> OrderedDict:
+        """The columns of a range of the selected rows, only the row groups that have
+        rows in the range are read"""
+        start, stop, _ = rows.indices(self.length)
+        row_groups = self.statistics
+        tables = []
+        offset = 0
+        for i, mask in self.selection:
+            num_rows = row_groups[i][0] if mask is None else int(mask.sum())
+            if offset < stop and start < offset + num_rows:
+                table = self.conn.read_row_group(i, columns=list(self.groups))
+                if mask is not None:
+                    table = table.filter(pa.array(mask))
+                init = max(start - offset, 0)
+                tables.append(table.slice(init, min(stop - offset, num_rows) - init))
+            offset += num_rows
+            if offset >= stop:
+                break
+        values = OrderedDict()
+        for group, (dtype, _) in self.dtypes.fields.items():
+            shape = tuple(self.shapes.get(group, ()))
+            if len(tables) == 0:
+                values[group] = np.empty((0, ) + shape, dtype=dtype)
+            else:
+                column = pa.chunked_array([table.column(group) for table in tables])
+                values[group] = from_arrow(column, dtype, shape)
+        return values
+
+    def read_table(self, rows: slice) -> 'GroupManager':
+        from dama.connexions.core import GroupManager
+        values = self.read_rows(rows)
+        return GroupManager.convert(values, chunks=Chunks({group: array.shape for group, array in values.items()}))
+
+    @property
+    def chunks(self) -> tuple:
+        """The rows of the first row group, the other row groups have the same rows but the last"""
+        rows = self.statistics[0][0] if len(self.statistics) > 0 else 0
+        return (rows, ) + tuple(self.shapes.get(self.groups[0], ()))
+
+    @property
+    @cache
+    def shape(self) -> Shape:
+        length = self.length
+        return Shape(OrderedDict((group, (length, ) + tuple(self.shapes.get(group, ()))) for group in self.groups))
+
+    def to_ndarray(self, dtype: np.dtype = None) -> np.ndarray:
+        return self.read_table(slice(0, self.length)).to_ndarray(dtype=dtype)
+
+    def store(self, driver: 'AbsDriver'):
+        raise NotImplementedError
+
+    @property
+    def chunksize(self) -> Chunks:
+        return Chunks({group: (self.chunks[0], ) + tuple(self.shapes.get(group, ())) for group in self.groups})
@@ -1,22 +1,92 @@
-from dama.abc.conn import AbsConn
+from dama.abc.conn import AbsTable
 from dama.utils.core import Shape, Chunks
 import numpy as np
 from collections import OrderedDict
 from dama.utils.decorators import cache
 from dama.data.it import Iterator, BatchIterator
 from dama.utils.miscellaneous import filter_dtypes, merge_dtype_list
-from psycopg2.extras import execute_values
+import pandas as pd
 import numbers
-import uuid
+import io
 
 
-class Table(AbsConn):
+NULL = "\\N"
+
+
+def csv_rows(columns: OrderedDict) -> str:
+    """Csv text of the rows of the column arrays, NaN, NaT and None are written as the NULL
+    marker so the empty strings are not loaded as NULL"""
+    return pd.DataFrame(columns).to_csv(header=False, index=False, na_rep=NULL)
+
+
+def csv_columns(text: io.StringIO, dtypes: np.dtype) -> OrderedDict:
+    """Column arrays of the csv rows exported by COPY, the fields are parsed in bulk.
+    Only the NULL marker is parsed as a missing value, the empty fields are empty strings.
+    The int columns with NULLs are returned as float with NaN and the bool columns as object"""
+    groups = list(dtypes.names)
+    if len(text.getvalue()) == 0:
+        return OrderedDict((group, np.empty(0, dtype=dtypes[group])) for group in groups)
+    parse_dates = [group for group in groups if dtypes[group].kind == "M"]
+    str_dtypes = {group: object for group in groups if dtypes[group] == np.dtype(object)}
+    df = pd.read_csv(text, header=None, names=groups, dtype=str_dtypes, parse_dates=parse_dates,
+                     true_values=["t"], false_values=["f"], keep_default_na=False, na_values=[NULL],
+                     skip_blank_lines=False)
+    columns = OrderedDict()
+    for group in groups:
+        array = df[group].values
+        if dtypes[group] == np.dtype(object):
+            array[pd.isnull(array)] = None
+        elif dtypes[group].kind in "iu" and pd.isnull(array).any():
+            array = array.astype(float)
+        elif dtypes[group].kind == "b" and pd.isnull(array).any():
+            array = array.astype(object)
+            array[pd.isnull(array)] = None
+        elif array.dtype != dtypes[group]:
+            array = array.astype(dtypes[group])
+        columns[group] = array
+    return columns
+
+
+class CopyStream(object):
+    """
+    File like object with the csv rows of the batchs, COPY reads it by blocks so all the
+    batchs are loaded with one COPY and only one batch is encoded in memory at a time.
+    """
+    def __init__(self, batchs, groups: tuple):
+        self.batchs = iter(batchs)
+        self.groups = groups
+        self.buffer = io.StringIO()
+
+    def read(self, size: int = -1) -> str:
+        parts = []
+        length = 0
+        while size < 0 or length < size:
+            text = self.buffer.read(-1 if size < 0 else size - length)
+            if len(text) == 0:
+                smx = next(self.batchs, None)
+                if smx is None:
+                    break
+                columns = OrderedDict((group, smx.batch[group].to_ndarray()) for group in self.groups)
+                self.buffer = io.StringIO(csv_rows(columns))
+                continue
+            parts.append(text)
+            length += len(text)
+        return "".join(parts)
+
+
+class Table(AbsTable):
+    """
+    The rows are loaded with COPY FROM STDIN from a stream of csv rows encoded batch by batch,
+    and they are read with COPY TO STDOUT and parsed in bulk into column arrays.
+    """
+    placeholder = "%s"
+    copy_size = 1 << 20
 
     def __init__(self, conn, dtypes, name=None, query_parts=None):
         super(Table, self).__init__(conn, dtypes)
         self.name = name
         if query_parts is None:
-            self.query_parts = {"columns": None, "slice": None}
+            self.query_parts = {"columns": None, "slice": None, "where": None}
         else:
             self.query_parts = query_parts
 
@@ -83,23 +153,25 @@ class Table(AbsConn):
     def insert(self, data, chunks=None):
         if not isinstance(data, BatchIterator):
             data = Iterator(data, dtypes=self.dtypes).batchs(chunks=chunks)
+        self.copy_from(data)
 
-        columns = "(" + ", ".join(self.groups) + ")"
-        insert_str = "INSERT INTO {name} {columns} VALUES".format(
-            name=self.name, columns=columns)
-        insert = insert_str + " %s"
+    def copy_from(self, batchs):
+        """Load the rows of the batchs with one COPY"""
+        query = "COPY {name} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '{null}')".format(
+            name=self.name, columns=", ".join(self.groups), null=NULL)
         cur = self.conn.cursor()
-        num_groups = len(data.groups)
-        for row in data:
-            shape = row.batch.shape.to_tuple()
-            if len(shape) == 1 and num_groups > 1:
-                value = row.batch.to_df.values  # .to_ndarray().reshape(1, -1)
-            elif len(shape) == 1 and num_groups == 1:
-                value = row.batch.to_df().values  # .to_ndarray().reshape(-1, 1)
-            else:
-                value = row.batch.to_df().values
-            execute_values(cur, insert, value, page_size=len(data))
+        cur.copy_expert(query, CopyStream(batchs, self.groups), size=self.copy_size)
+        cur.close()
+
+    def copy_to(self, query: str, params: tuple) -> OrderedDict:
+        """Column arrays of the rows of the query, exported with COPY"""
+        cur = self.conn.cursor()
+        text = io.StringIO()
+        cur.copy_expert("COPY ({}) TO STDOUT WITH (FORMAT csv, NULL '{}')".format(
+            cur.mogrify(query, params).decode("utf-8"), NULL), text, size=self.copy_size)
         cur.close()
+        text.seek(0)
+        return csv_columns(text, self.dtypes)
 
     def update(self, value, item):
         if isinstance(item, int):
@@ -117,22 +189,20 @@ class Table(AbsConn):
         if self.dtype is None:
             return np.asarray([])
 
-        slice_item, _ = self.build_limit_info()
         query, one_row = self.build_query()
-        cur = self.conn.cursor(uuid.uuid4().hex, scrollable=False, withhold=False)
-        cur.execute(query)
-        cur.itersize = self.chunksize.static_value
-        if one_row:
-            cur.scroll(0)
-        else:
-            cur.scroll(slice_item.start)
-        array = np.empty(self.shape, dtype=self.dtype)
+        _, params = self.build_where()
+        if not one_row:
+            slice_item, _ = self.build_limit_info()
+            query = self.rows_query(slice_item)
+        columns = self.copy_to(query, params)
         if len(self.groups) == 1:
-            for i, row in enumerate(cur):
-                array[i] = row[0]
+            array = columns[self.groups[0]]
         else:
-            array[:] = cur.fetchall()
-        cur.close()
+            length = len(columns[self.groups[0]])
+            dtype_columns = np.result_type(self.dtype, *(column.dtype for column in columns.values()))
+            array = np.empty((length, len(self.groups)), dtype=dtype_columns)
+            for i, column in enumerate(columns.values()):
+                array[:, i] = column
         if dtype is not None and self.dtype != dtype:
             return array.astype(dtype)
         else:
@@ -146,14 +216,16 @@ class Table(AbsConn):
     def shape(self) -> Shape:
         cur = self.conn.cursor()
         slice_item, limit_txt = self.build_limit_info()
+        where_txt, params = self.build_where()
         if limit_txt == "":
-            query = "SELECT COUNT(*) FROM {table_name}".format(table_name=self.name)
-            cur.execute(query)
+            query = "SELECT COUNT(*) FROM {table_name} {where}".format(table_name=self.name, where=where_txt)
+            cur.execute(query, params)
             length = cur.fetchone()[0]
         else:
-            query = "SELECT Count(*) FROM (SELECT id FROM {table_name} LIMIT {limit} OFFSET {start}) as foo".format(
-                table_name=self.name, start=slice_item.start, limit=(abs(slice_item.stop - slice_item.start)))
-            cur.execute(query)
+            query = "SELECT Count(*) FROM (SELECT id FROM {table_name} {where} ORDER BY id LIMIT {limit} " \
+                    "OFFSET {start}) as foo".format(table_name=self.name, where=where_txt, start=slice_item.start,
+                                                    limit=(abs(slice_item.stop - slice_item.start)))
+            cur.execute(query, params)
             length = cur.fetchone()[0]
         cur.close()
         shape = OrderedDict([(group, (length,)) for group in self.groups])
@@ -167,6 +239,46 @@ class Table(AbsConn):
         cur.close()
         return last_id
 
+    def where(self, predicate) -> 'Table':
+        """Table with the rows where the predicate is true, the condition is added to the query"""
+        sql, params = predicate.to_sql(self.placeholder)
+        query_parts = self.query_parts.copy()
+        if query_parts.get("where") is not None:
+            where_sql, where_params = query_parts["where"]
+            sql = "({}) AND ({})".format(where_sql, sql)
+            params = where_params + params
+        query_parts["where"] = (sql, params)
+        return Table(self.conn, self.dtypes, name=self.name, query_parts=query_parts)
+
+    def project(self, columns: list) -> 'Table':
+        """Table with only the columns, the other columns are not queried"""
+        query_parts = self.query_parts.copy()
+        query_parts["columns"] = list(columns)
+        dtypes = merge_dtype_list([filter_dtypes(column, self.dtypes) for column in columns])
+        return Table(self.conn, dtypes, name=self.name, query_parts=query_parts)
+
+    def read_rows(self, rows: slice) -> OrderedDict:
+        """The columns of a range of rows exported with one COPY"""
+        _, params = self.build_where()
+        return self.copy_to(self.rows_query(rows), params)
+
+    def rows_query(self, rows: slice) -> str:
+        where_txt, _ = self.build_where()
+        limit_txt = "" if rows.stop is None else "LIMIT {}".format(max(rows.stop - (rows.start or 0), 0))
+        return "SELECT {columns} FROM {table_name} {where} ORDER BY id {limit} OFFSET {start}".format(
+            columns=self.format_columns(), table_name=self.name, where=where_txt, limit=limit_txt,
+            start=rows.start or 0)
+
+    def same_table(self, other) -> bool:
+        return isinstance(other, Table) and other.conn is self.conn and other.name == self.name and \
+            other.query_parts.get("where") == self.query_parts.get("where")
+
+    def build_where(self) -> tuple:
+        where = self.query_parts.get("where")
+        if where is None:
+            return "", ()
+        return "WHERE {}".format(where[0]), tuple(where[1])
+
     def format_columns(self):
         columns = self.query_parts["columns"]
         if columns is None:
@@ -204,7 +316,10 @@ class Table(AbsConn):
         return slice(start, stop), limit_txt
 
     def build_query(self) -> tuple:
+        where_txt, _ = self.build_where()
         if isinstance(self.query_parts["slice"], list):
+            if where_txt != "":
+                raise NotImplementedError("The rows of a filtered table are selected with slices")
             id_list = [index.start + 1 for index in self.query_parts["slice"]]
             query = "SELECT {columns} FROM {table_name} WHERE ID IN ({id_list}) ORDER BY {order_by}".format(
                 columns=self.format_columns(), table_name=self.name, order_by="id",
@@ -212,8 +327,8 @@ class Table(AbsConn):
             one_row = True
         else:
             _, limit_txt = self.build_limit_info()
-            query = "SELECT {columns} FROM {table_name} ORDER BY {order_by} {limit}".format(
-                columns=self.format_columns(), table_name=self.name, order_by="id",
+            query = "SELECT {columns} FROM {table_name} {where} ORDER BY {order_by} {limit}".format(
+                columns=self.format_columns(), table_name=self.name, where=where_txt, order_by="id",
                 limit=limit_txt)
             one_row = False
         return query, one_row
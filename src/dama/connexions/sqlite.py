@@ -1,4 +1,4 @@
-from dama.abc.conn import AbsConn
+from dama.abc.conn import AbsTable
 from dama.utils.core import Shape, Chunks
 import numpy as np
 from collections import OrderedDict
@@ -7,22 +7,64 @@ from dama.data.it import Iterator, BatchIterator
 from dama.utils.miscellaneous import filter_dtypes, merge_dtype_list
 
 
-class Table(AbsConn):
+def sql_values(array: np.ndarray) -> list:
+    """Python values of a column, sqlite can't bind numpy scalars"""
+    if array.dtype.kind == "M":
+        values = np.datetime_as_string(array, unit="auto").astype(object)
+        values[np.isnat(array)] = None
+        return values.tolist()
+    return array.tolist()
 
-    def __init__(self, conn, dtypes, name=None, query_parts=None):
+
+def fetch_columns(cur, columns: list, fetch_size: int) -> int:
+    """Fill the preallocated column arrays with the rows of the cursor, fetch_size rows
+    at a time. Returns the number of rows"""
+    offset = 0
+    length = len(columns[0])
+    while offset < length:
+        rows = cur.fetchmany(min(fetch_size, length - offset))
+        if len(rows) == 0:
+            break
+        end = offset + len(rows)
+        for column, values in zip(columns, zip(*rows)):
+            column[offset:end] = values
+        offset = end
+    return offset
+
+
+class Table(AbsTable):
+    """
+    The rows are the rows of the table ordered by id. A range of rows is read after the id
+    of the row before it (WHERE id > ? ORDER BY id LIMIT ?) instead of an OFFSET. The last id
+    read by every range is kept as the key of the next row, so the consecutive ranges don't
+    search their key, the others search it in the id index from the nearest known key. The
+    tables derived with the same WHERE share the keys and the count of the rows.
+    """
+    placeholder = "?"
+    fetch_size = 10000
+
+    def __init__(self, conn, dtypes, name=None, query_parts=None, keys=None):
         super(Table, self).__init__(conn, dtypes=dtypes)
         self.name = name
         if query_parts is None:
-            self.query_parts = {"columns": None, "slice": None}
+            self.query_parts = {"columns": None, "slice": None, "where": None}
         else:
             self.query_parts = query_parts
+        self.keys = {0: None} if keys is None else keys
+
+    def derive(self, dtypes, query_parts) -> 'Table':
+        if query_parts.get("where") != self.query_parts.get("where"):
+            return Table(self.conn, dtypes, name=self.name, query_parts=query_parts)
+        table = Table(self.conn, dtypes, name=self.name, query_parts=query_parts, keys=self.keys)
+        table.length_cache = getattr(self, "length_cache", None)
+        return table
 
     def __getitem__(self, item):
         query_parts = self.query_parts.copy()
         if isinstance(item, str):
             query_parts["columns"] = [item]
             dtypes = filter_dtypes(item, self.dtypes)
-            return Table(self.conn, dtypes, name=self.name, query_parts=query_parts)
+            return self.derive(dtypes, query_parts)
         elif isinstance(item, list) or isinstance(item, tuple):
             it = Iterator(item)
             if it.type_elem == int:
@@ -37,15 +79,15 @@ class Table(AbsConn):
             else:
                 dtypes = self.dtypes
             dtype = self.attrs.get("dtype", None)
-            return Table(self.conn, dtypes, name=self.name, query_parts=query_parts).to_ndarray(dtype=dtype)
+            return self.derive(dtypes, query_parts).to_ndarray(dtype=dtype)
         elif isinstance(item, int):
             query_parts["slice"] = slice(item, item + 1)
             dtype = self.attrs.get("dtype", None)
-            return Table(self.conn, self.dtypes, name=self.name, query_parts=query_parts).to_ndarray(dtype=dtype)
+            return self.derive(self.dtypes, query_parts).to_ndarray(dtype=dtype)
         elif isinstance(item, slice):
             query_parts["slice"] = item
             dtype = self.attrs.get("dtype", None)
-            return Table(self.conn, self.dtypes, name=self.name, query_parts=query_parts).to_ndarray(dtype=dtype)
+            return self.derive(self.dtypes, query_parts).to_ndarray(dtype=dtype)
 
     def __setitem__(self, item, value):
         if hasattr(value, 'batch'):
@@ -81,10 +123,7 @@ class Table(AbsConn):
         if not isinstance(data, BatchIterator):
             data = Iterator(data, dtypes=self.dtypes).batchs(chunks=chunks)
 
-        columns = "(" + ", ".join(self.groups) + ")"
-        values = "(" + "?,".join(("" for _ in self.groups)) + "?)"
-        insert_str = "INSERT INTO {name} {columns} VALUES {values}".format(
-            name=self.name, columns=columns, values=values)
+        insert_str = self.insert_query()
         cur = self.conn.cursor()
         num_groups = len(data.groups)
         for row in data:
@@ -99,6 +138,18 @@ class Table(AbsConn):
         self.conn.commit()
         cur.close()
 
+    def insert_query(self) -> str:
+        columns = "(" + ", ".join(self.groups) + ")"
+        values = "(" + "?,".join(("" for _ in self.groups)) + "?)"
+        return "INSERT INTO {name} {columns} VALUES {values}".format(name=self.name, columns=columns,
+                                                                     values=values)
+
+    def insert_columns(self, columns: list, cur) -> int:
+        """Insert the rows of the column arrays in the transaction of the cursor, the rows are
+        streamed as tuples to executemany. Returns the number of rows"""
+        cur.executemany(self.insert_query(), zip(*[sql_values(np.asarray(column)) for column in columns]))
+        return len(columns[0])
+
     def update(self, values, item):
         if isinstance(item, int):
             columns = ["{col}=?".format(col=group) for group in self.groups]
@@ -116,17 +167,22 @@ class Table(AbsConn):
         if self.dtype is None:
             return np.asarray([])
 
-        query, _ = self.build_query()
-        cur = self.conn.cursor()
-        cur.execute(query)
-        array = np.empty(self.shape, dtype=self.dtype)
+        array = np.empty(self.shape.to_tuple(), dtype=self.dtype)
         if len(self.groups) == 1:
-            for i, row in enumerate(cur):
-                array[i] = row[0]
+            columns = [array]
         else:
-            array[:] = cur.fetchall()
-        self.conn.commit()
-        cur.close()
+            columns = [array[:, i] for i in range(len(self.groups))]
+        if isinstance(self.query_parts["slice"], list):
+            query, _ = self.build_query()
+            _, params = self.build_where()
+            cur = self.conn.cursor()
+            cur.execute(query, params)
+            fetch_columns(cur, columns, self.fetch_size)
+            self.conn.commit()
+            cur.close()
+        else:
+            slice_item, _ = self.build_limit_info()
+            self.fetch_after(self.row_key(slice_item.start), columns)
         if dtype is not None and self.dtype != dtype:
             return array.astype(dtype)
         else:
@@ -137,21 +193,43 @@ class Table(AbsConn):
 
     @property
     @cache
-    def shape(self) -> Shape:
+    def length(self) -> int:
+        """The rows with the WHERE, they are counted once"""
         cur = self.conn.cursor()
-        slice_item, limit_txt = self.build_limit_info()
-        if limit_txt == "":
-            query = "SELECT COUNT(*) FROM {table_name}".format(table_name=self.name)
-            cur.execute(query)
-            length = cur.fetchone()[0]
+        where_txt, params = self.build_where()
+        query = "SELECT COUNT(*) FROM {table_name} {where}".format(table_name=self.name, where=where_txt)
+        cur.execute(query, params)
+        length = cur.fetchone()[0]
+        cur.close()
+        return length
+
+    @property
+    @cache
+    def shape(self) -> Shape:
+        """The rows of a slice are computed from the count of the rows when it's known, otherwise
+        only the ids from the nearest known key to the stop of the slice are counted"""
+        slice_item, _ = self.build_limit_info()
+        if slice_item.stop is None or getattr(self, "length_cache", None) is not None:
+            length = self.length
+            stop = length if slice_item.stop is None else min(slice_item.stop, length)
+            length = max(stop - min(slice_item.start, length), 0)
         else:
-            query = "SELECT Count(*) FROM (SELECT id FROM {table_name} LIMIT {limit} OFFSET {start})".format(
-                table_name=self.name, start=slice_item.start, limit=(abs(slice_item.stop - slice_item.start)))
-            cur.execute(query)
-            length = cur.fetchone()[0]
-        shape = OrderedDict([(group, (length,)) for group in self.groups])
+            length = self.count_range(slice_item.start, slice_item.stop)
+        return Shape(OrderedDict([(group, (length,)) for group in self.groups]))
+
+    def count_range(self, start: int, stop: int) -> int:
+        """The rows between start and stop, counted after the key of the nearest known row"""
+        if stop <= start:
+            return 0
+        known = max(known_row for known_row in list(self.keys) if known_row <= start)
+        where_txt, params = self.build_where(after=self.keys[known])
+        query = "SELECT COUNT(*) FROM (SELECT id FROM {table_name} {where} ORDER BY id LIMIT {limit})".format(
+            table_name=self.name, where=where_txt, limit=stop - known)
+        cur = self.conn.cursor()
+        cur.execute(query, params)
+        rows = cur.fetchone()[0]
         cur.close()
-        return Shape(shape)
+        return max(rows - (start - known), 0)
 
     def last_id(self) -> int:
         cur = self.conn.cursor()
@@ -167,6 +245,109 @@ class Table(AbsConn):
         cur.close()
         return id_
 
+    def where(self, predicate) -> 'Table':
+        """Table with the rows where the predicate is true, the condition is added to the query"""
+        sql, params = predicate.to_sql(self.placeholder)
+        query_parts = self.query_parts.copy()
+        if query_parts.get("where") is not None:
+            where_sql, where_params = query_parts["where"]
+            sql = "({}) AND ({})".format(where_sql, sql)
+            params = where_params + params
+        query_parts["where"] = (sql, params)
+        return self.derive(self.dtypes, query_parts)
+
+    def project(self, columns: list) -> 'Table':
+        """Table with only the columns, the other columns are not queried"""
+        query_parts = self.query_parts.copy()
+        query_parts["columns"] = list(columns)
+        dtypes = merge_dtype_list([filter_dtypes(column, self.dtypes) for column in columns])
+        return self.derive(dtypes, query_parts)
+
+    def row_key(self, row: int, step: int = None):
+        """The id of the row before row (None for the first row). It's searched in the id index
+        from the nearest row with a known key, the keys of every step rows found on the way are kept"""
+        if row not in self.keys:
+            known = max(known_row for known_row in list(self.keys) if known_row < row)
+            step = row - known if step is None else step
+            cur = self.conn.cursor()
+            while known < row:
+                limit = min(step, row - known)
+                where_txt, params = self.build_where(after=self.keys[known])
+                query = "SELECT max(id) FROM (SELECT id FROM {table_name} {where} ORDER BY id LIMIT {limit})".format(
+                    table_name=self.name, where=where_txt, limit=limit)
+                cur.execute(query, params)
+                key = cur.fetchone()[0]
+                if key is None:
+                    self.keys[row] = self.keys[known]
+                    break
+                known += limit
+                self.keys[known] = key
+            cur.close()
+        return self.keys[row]
+
+    def fetch_after(self, after, columns: list) -> tuple:
+        """Fill the column arrays with the rows after the id after. Returns the number
+        of rows and the id of the last row"""
+        where_txt, params = self.build_where(after=after)
+        query = "SELECT id,{columns} FROM {table_name} {where} ORDER BY id LIMIT {limit}".format(
+            columns=self.format_columns(), table_name=self.name, where=where_txt, limit=len(columns[0]))
+        ids = np.empty(len(columns[0]), dtype=np.int64)
+        cur = self.conn.cursor()
+        cur.execute(query, params)
+        length = fetch_columns(cur, [ids] + list(columns), self.fetch_size)
+        cur.close()
+        return length, int(ids[length - 1]) if length > 0 else after
+
+    def read_rows(self, rows: slice) -> OrderedDict:
+        """The columns of a range of rows in one query after the key of the first row,
+        the rows are copied in one array for each group"""
+        start = rows.start or 0
+        stop = self.shape.to_tuple()[0] if rows.stop is None else rows.stop
+        columns = OrderedDict((group, np.empty(max(stop - start, 0), dtype=dtype))
+                              for group, (dtype, _) in self.dtypes.fields.items())
+        length = 0
+        if stop > start:
+            # the last range can be shorter than the others, it's not used as the step of the keys
+            step = stop - start if stop < self.shape.to_tuple()[0] else None
+            length, last_id = self.fetch_after(self.row_key(start, step=step), list(columns.values()))
+            self.keys[start + length] = last_id
+        return OrderedDict((group, column[:length]) for group, column in columns.items())
+
+    def stream(self, batch_size: int):
+        """Yields the columns of every batch_size rows, the query is executed once and the
+        batches are fetched from the same cursor"""
+        where_txt, params = self.build_where()
+        query = "SELECT {columns} FROM {table_name} {where} ORDER BY id".format(
+            columns=self.format_columns(), table_name=self.name, where=where_txt)
+        cur = self.conn.cursor()
+        try:
+            cur.execute(query, params)
+            while True:
+                columns = OrderedDict((group, np.empty(batch_size, dtype=dtype))
+                                      for group, (dtype, _) in self.dtypes.fields.items())
+                length = fetch_columns(cur, list(columns.values()), batch_size)
+                if length > 0:
+                    yield OrderedDict((group, column[:length]) for group, column in columns.items())
+                if length < batch_size:
+                    break
+        finally:
+            cur.close()
+
+    def same_table(self, other) -> bool:
+        return isinstance(other, Table) and other.conn is self.conn and other.name == self.name and \
+            other.query_parts.get("where") == self.query_parts.get("where")
+
+    def build_where(self, after: int = None) -> tuple:
+        """The WHERE of the query and its params, with after only the rows with a greater id"""
+        where = self.query_parts.get("where")
+        if after is None and where is None:
+            return "", ()
+        elif after is None:
+            return "WHERE {}".format(where[0]), tuple(where[1])
+        elif where is None:
+            return "WHERE id > {}".format(self.placeholder), (after, )
+        return "WHERE id > {} AND ({})".format(self.placeholder, where[0]), (after, ) + tuple(where[1])
+
     def format_columns(self):
         columns = self.query_parts["columns"]
         if columns is None:
@@ -204,21 +385,18 @@ class Table(AbsConn):
         return slice(start, stop), limit_txt
 
     def build_query(self) -> tuple:
+        where_txt, _ = self.build_where()
         if isinstance(self.query_parts["slice"], list):
+            if where_txt != "":
+                raise NotImplementedError("The rows of a filtered table are selected with slices")
             id_list = [index.start + 1 for index in self.query_parts["slice"]]
             query = "SELECT {columns} FROM {table_name} WHERE ID IN ({id_list}) ORDER BY {order_by}".format(
                 columns=self.format_columns(), table_name=self.name, order_by="id",
                 id_list=",".join(map(str, id_list)))
             one_row = True
         else:
-            slice_item, limit_txt = self.build_limit_info()
-            if limit_txt == "":
-                query = "SELECT {columns} FROM {table_name} ORDER BY {order_by}".format(
-                    columns=self.format_columns(), table_name=self.name, order_by="id")
-            else:
-                query = "SELECT {columns} FROM {table_name} ORDER BY {order_by} LIMIT {limit} OFFSET {start}".format(
-                    columns=self.format_columns(), table_name=self.name, order_by="id", start=slice_item.start,
-                    limit=(abs(slice_item.stop - slice_item.start)))
+            query = "SELECT {columns} FROM {table_name} {where} ORDER BY {order_by}".format(
+                columns=self.format_columns(), table_name=self.name, where=where_txt, order_by="id")
             one_row = False
         return query, one_row
 
@@ -1,24 +1,31 @@
 import datetime
 import json
+import os
+import pickle
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 import numpy as np
 import pandas as pd
 import dask.array as da
-import dask.bag as db
-import dask
 from tabulate import tabulate
 from dama.abc.data import AbsData
 from dama.abc.conn import AbsConn
 from dama.data.it import Iterator, BaseIterator, BatchIterator
 from dama.utils.core import Hash, Login, Metadata, Chunks, Shape
+from dama.utils.merkle import merkle_root, chunks_digests
+from dama.utils.stats import GroupStats
+from dama.exceptions import DataDoesNotFound, SourceChanged
 from dama.abc.driver import AbsDriver
 from dama.drivers.core import Memory
 from dama.drivers.sqlite import Sqlite
 from dama.utils.logger import log_config
+from dama.utils.numeric_functions import lcm
 from dama.utils.config import get_settings
 from dama.utils.decorators import cache, clean_cache
 from dama.utils.files import get_dir_file_size
 from dama.utils.order import order_table
 from dama.connexions.core import GroupManager
+from dama.fmtypes import DEFAUL_GROUP_NAME
 from pydoc import locate
 
 
@@ -30,6 +37,7 @@ class Data(AbsData):
     def __init__(self, name: str = None, driver: AbsDriver = None, group_name: str = None,
                  chunks=None, auto_chunks=False, metadata_path: str = None):
 
+        self._attrs = None
         if driver is None:
             self.driver = Memory()
         else:
@@ -60,6 +68,7 @@ class Data(AbsData):
         self.chunksize = chunks
         self.from_ds_hash = None
         self.auto_chunks = auto_chunks
+        self.changed_sources = []
         if self.driver.path is None:
             self.driver.path = settings["data_path"]
         self.driver.build_url(self.name, group_level=self.group_name)
@@ -120,6 +129,7 @@ class Data(AbsData):
     @property
     @cache
     def data(self) -> AbsConn:
+        self.check_sources("the groups can't be read")
         return self.driver.manager(chunks=self.chunksize)
 
     @data.setter
@@ -130,6 +140,12 @@ class Data(AbsData):
     def clean_data_cache(self):
         self.data = None
 
+    def check_sources(self, action: str):
+        """Raise SourceChanged if the virtual sources changed after the concat"""
+        if len(self.changed_sources) > 0:
+            raise SourceChanged("The sources {} of {} changed after the concat, {}".format(
+                [source["name"] for source in self.changed_sources], self.url, action))
+
     @property
     def from_ds_hash(self):
         return self._get_attr('from_ds_hash')
@@ -141,16 +157,27 @@ class Data(AbsData):
 
     def open(self):
         self.driver.open()
+        self.load_attrs()
+        if self.driver.virtual_sources is not None:
+            self.changed_sources = self.driver.changed_sources()
+            if len(self.changed_sources) > 0:
+                log.warning("The sources {} of {} changed after the concat, concat them again".format(
+                    [source["name"] for source in self.changed_sources], self.url))
 
         if self.driver.mode in ["w", "a", "r+"]:
             if len(self.driver.compressor_params) > 0:
                 self.compressor_params = self.driver.compressor_params
 
         if self.auto_chunks is True and self.driver.mode in ["a", "r"]:
-            try:
-                self.chunksize = Chunks.build_from_shape(self.driver.shape, self.driver.dtypes)
-            except KeyError as e:
-                log.error(e)
+            layout = self.chunks_layout
+            if layout is not None:
+                self.chunksize = Chunks({group: tuple(chunks) for group, chunks in layout["chunks"].items()})
+            else:
+                try:
+                    self.chunksize = Chunks.build_from_shape(self.driver.shape, self.driver.dtypes,
+                                                             storage=self.storage_chunks())
+                except KeyError as e:
+                    log.error(e)
         else:
             if isinstance(self.chunksize, tuple) and self.driver.mode in ["a", "r"]:
                 groups = self.driver.groups
@@ -165,9 +192,58 @@ class Data(AbsData):
 
     def close(self):
         self.driver.close()
+        self._attrs = None
         self.data = None
 
+    def load_attrs(self):
+        """Read the attributes of the driver once, the gets are served from this snapshot
+        and the sets are written in both"""
+        attrs = self.driver.attrs
+        if attrs is None:
+            self._attrs = None
+        elif hasattr(attrs, "asdict"):
+            self._attrs = attrs.asdict()
+        else:
+            self._attrs = dict(attrs.items())
+
+    @property
+    def chunks_layout(self):
+        value = self._get_attr('chunks_layout')
+        if value is not None:
+            return json.loads(value)
+
+    @chunks_layout.setter
+    def chunks_layout(self, value):
+        if value is not None:
+            self._set_attr('chunks_layout', json.dumps(value))
+
+    def storage_chunks(self) -> dict:
+        """Chunks of the groups in the driver, None if the driver doesn't use chunks"""
+        try:
+            return {group: tuple(self.driver[group].chunks) for group in self.driver.groups}
+        except (AttributeError, TypeError, KeyError):
+            return None
+
+    def plan_chunks(self, access: str = "rows", chunk_bytes: int = None) -> Chunks:
+        """Set the chunks for the access pattern (rows or columns) aligned to the storage chunks
+        and save them as the layout of the dataset"""
+        self.chunksize = Chunks.build_from_shape(self.driver.shape, self.driver.dtypes, chunk_bytes=chunk_bytes,
+                                                 access=access, storage=self.storage_chunks())
+        self.save_layout(access=access, chunk_bytes=chunk_bytes)
+        self.clean_data_cache()
+        return self.chunksize
+
+    def save_layout(self, access: str = "rows", chunk_bytes: int = None):
+        chunks = {group: [int(size) for size in chunks] for group, chunks in self.chunksize.items()}
+        self.chunks_layout = {"access": access, "chunk_bytes": chunk_bytes, "chunks": chunks}
+
     def __getitem__(self, key):
+        if isinstance(key, str):
+            self.check_sources("the groups can't be read")
+            return self.driver.manager(chunks=self.chunksize, groups=[key])
+        elif isinstance(key, list) and len(key) > 0 and all(isinstance(group, str) for group in key):
+            self.check_sources("the groups can't be read")
+            return self.driver.manager(chunks=self.chunksize, groups=key)
         return self.data[key]
 
     def __setitem__(self, key, value):
@@ -183,8 +259,21 @@ class Data(AbsData):
         if value is not None:
             log.debug("SET attribute {name} {value}".format(name=name, value=value))
             self.driver.attrs[name] = value
+            if self._attrs is not None:
+                self._attrs[name] = value
+
+    def _del_attr(self, name):
+        if name in self.driver.attrs:
+            log.debug("DEL attribute {name}".format(name=name))
+            del self.driver.attrs[name]
+        if self._attrs is not None:
+            self._attrs.pop(name, None)
 
     def _get_attr(self, name):
+        if self._attrs is not None:
+            if name not in self._attrs:
+                log.debug("Not found attribute {} in file {}".format(name, self.url))
+            return self._attrs.get(name)
         try:
             return self.driver.attrs[name]
         except KeyError:
@@ -253,6 +342,23 @@ class Data(AbsData):
             table.append([group, shape[group], dtype])
         print(order_table(headers, table, "Group"))
 
+    @property
+    def disk_size(self) -> int:
+        """Bytes of the dataset, saved by the writers so it is not calculated again"""
+        value = self._get_attr('disk_size')
+        if value is None:
+            return get_dir_file_size(self.url)
+        return int(value)
+
+    def update_disk_size(self, base: int = 0) -> int:
+        """Save base plus the bytes written by the driver since the last update as the disk size"""
+        size = base + self.driver.written_bytes
+        self.driver.written_bytes = 0
+        if self.driver.persistent is not True:
+            return 0
+        self._set_attr('disk_size', size)
+        return size
+
     def metadata(self) -> dict:
         meta_dict = dict()
         meta_dict["hash"] = self.hash
@@ -262,7 +368,7 @@ class Data(AbsData):
         meta_dict["driver_module"] = self.driver.module_cls_name()
         meta_dict["driver_name"] = self.driver.cls_name()
         meta_dict["name"] = self.name
-        meta_dict["size"] = get_dir_file_size(self.url)
+        meta_dict["size"] = self.disk_size
         meta_dict["timestamp"] = self.timestamp
         meta_dict["author"] = self.author
         meta_dict["num_groups"] = len(self.groups)
@@ -289,17 +395,94 @@ class Data(AbsData):
                 metadata.set_schema(dtypes, unique_key=["hash", ["path", "name", "driver_name", "group_name"]])
                 metadata.insert_update_data(keys=["hash", ["path", "name", "driver_name", "group_name"]])
 
-    def calc_hash(self, with_hash: str) -> str:
+    def chunk_rows(self) -> OrderedDict:
+        """Rows of the chunks of every group, the length of the group if there are not chunks"""
+        rows = OrderedDict()
+        for group in self.groups:
+            step = self.chunksize[group][0] if self.chunksize is not None else self.shape[group][0]
+            rows[group] = max(int(step), 1)
+        return rows
+
+    def hash_rows(self) -> OrderedDict:
+        """Rows of the chunks of the saved digests, the chunk_rows if there are not saved digests"""
+        chunks_hash = self.chunks_hash
+        if chunks_hash is not None and "rows" in chunks_hash:
+            return OrderedDict((group, chunks_hash["rows"][group]) for group in self.groups)
+        return self.chunk_rows()
+
+    def chunk_slices(self, group: str, rows: int) -> list:
+        length = self.shape[group][0]
+        return [slice(init, min(init + rows, length)) for init in range(0, length, rows)]
+
+    def chunks_digests(self, with_hash: str, workers: int = None, from_row: int = 0,
+                       rows: dict = None) -> OrderedDict:
+        """Digest of every chunk of rows of every group (the chunks before from_row are skipped),
+        the chunks are hashed in parallel. The rows of the chunks are the hash_rows by default"""
+        def load_fn(group, chunk_slice):
+            return lambda: self.data[group][chunk_slice].to_ndarray()
+
+        if rows is None:
+            rows = self.hash_rows()
+        load_fns = []
+        tasks = []
+        for group in self.groups:
+            for chunk_slice in self.chunk_slices(group, rows[group]):
+                if chunk_slice.stop <= from_row:
+                    continue
+                load_fns.append(load_fn(group, chunk_slice))
+                tasks.append(group)
+        digests = OrderedDict((group, []) for group in self.groups)
+        for group, digest in zip(tasks, chunks_digests(load_fns, hash_fn=with_hash, workers=workers)):
+            digests[group].append(digest)
+        return digests
+
+    def merkle_hash(self, digests: OrderedDict, with_hash: str) -> str:
         hash_obj = Hash(hash_fn=with_hash)
         header = [getattr(self, attr) for attr in self.header_map]
         header = [attr for attr in header if attr is not None]
         hash_obj.hash.update("".join(header).encode("utf-8"))
-        for group in self.groups:
-            it = Iterator(self.data[group]).batchs(chunks=self.chunksize)
-            hash_obj.update(it.only_data())
+        for group, group_digests in digests.items():
+            hash_obj.hash.update(group.encode("utf-8"))
+            hash_obj.hash.update(bytes.fromhex(merkle_root(group_digests, hash_fn=with_hash)))
         return str(hash_obj)
 
-    def from_data(self, data, with_hash: str = "sha1", from_ds_hash: str = None, start_i: int = 0):
+    def calc_hash(self, with_hash: str) -> str:
+        return self.merkle_hash(self.chunks_digests(with_hash), with_hash)
+
+    @property
+    def chunks_hash(self):
+        value = self._get_attr('chunks_hash')
+        if value is not None:
+            return json.loads(value)
+
+    @chunks_hash.setter
+    def chunks_hash(self, value):
+        if value is not None:
+            self._set_attr('chunks_hash', json.dumps(value))
+
+    def changed_chunks(self) -> dict:
+        """Slices of the chunks that are different from the digests saved by from_data"""
+        chunks_hash = self.chunks_hash
+        if chunks_hash is None:
+            raise DataDoesNotFound("There are not chunk digests in {}".format(self.url))
+        saved = chunks_hash["groups"]
+        rows = self.hash_rows()
+        changed = OrderedDict()
+        for group, group_digests in self.chunks_digests(chunks_hash["hash_fn"], rows=rows).items():
+            saved_digests = saved.get(group, [])
+            slices = self.chunk_slices(group, rows[group])
+            diff = [chunk_slice for i, chunk_slice in enumerate(slices)
+                    if i >= len(saved_digests) or saved_digests[i] != group_digests[i]]
+            if len(diff) > 0 or len(saved_digests) != len(group_digests):
+                changed[group] = diff
+        return changed
+
+    def verify(self) -> bool:
+        return len(self.changed_chunks()) == 0
+
+    def from_data(self, data, with_hash: str = "sha1", from_ds_hash: str = None, start_i: int = 0,
+                  workers: int = 1, ordered: bool = True, atomic: bool = False):
+        self.driver.written_bytes = 0
         if isinstance(data, da.Array):
             data = GroupManager.from_da(data)
             if self.chunksize is None:
@@ -341,46 +524,225 @@ class Data(AbsData):
         self.dtypes = data.dtypes
         self.driver.set_data_shape(data.shape)
         if isinstance(data, BatchIterator) or isinstance(data, Iterator):
-            self.driver.batchs_writer(data)
+            self.driver.batchs_writer(data, workers=workers, ordered=ordered, atomic=atomic)
         elif isinstance(data, AbsConn):
             self.driver.store(data)
         else:
             raise NotImplementedError
 
         if with_hash is not None:
-            c_hash = self.calc_hash(with_hash=with_hash)
+            rows = self.chunk_rows()
+            digests = self.chunks_digests(with_hash, rows=rows)
+            c_hash = self.merkle_hash(digests, with_hash)
+            self.chunks_hash = {"hash_fn": with_hash, "rows": rows, "groups": digests}
         else:
             c_hash = None
 
         self.from_ds_hash = from_ds_hash
         self.hash = c_hash
+        if isinstance(self.chunksize, Chunks):
+            self.save_layout()
+        self.timestamp = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M UTC")
+        self.update_disk_size()
+        self.write_metadata()
+
+    def append(self, data, with_hash: str = "sha1"):
+        """
+        Add the rows of data at the end of the dataset. The groups are resized in place,
+        the new rows are written in blocks aligned to the storage chunks and only the
+        chunks after the previous end are hashed again.
+        """
+        if self.groups is None:
+            return self.from_data(data, with_hash=with_hash)
+
+        if isinstance(data, da.Array):
+            data = GroupManager.from_da(data)
+        elif isinstance(data, dict) and not isinstance(data, AbsConn):
+            shape, dtypes = Shape.get_shape_dtypes_from_dict(data)
+            data = GroupManager.convert(data, chunks=Chunks.build_from_shape(shape, dtypes))
+        if not isinstance(data, BatchIterator):
+            data = Iterator(data).batchs(chunks=self.chunksize)
+        if set(data.groups) != set(self.groups):
+            raise ValueError("The groups {} are not the groups of the dataset {}".format(data.groups, self.groups))
+
+        length = self.shape.max_length
+        disk_size = self.disk_size
+        self.driver.written_bytes = 0
+        storage_chunks = self.storage_chunks()
+        if storage_chunks is None:
+            storage_chunks = self.chunksize
+        step = lcm(max(storage_chunks[group][0], 1) for group in self.groups)
+        end = length
+        buffer = None
+        for slice_obj in data:
+            arrays = [(group, slice_obj.batch[group].to_ndarray()) for group in self.groups]
+            if buffer is not None:
+                arrays = [(group, np.concatenate((buffer[group], array))) for group, array in arrays]
+            rows = len(arrays[0][1])
+            aligned = ((end + rows) // step) * step - end
+            if aligned > 0:
+                self._write_rows(end, [(group, array[:aligned]) for group, array in arrays])
+                end += aligned
+            buffer = OrderedDict((group, array[aligned:]) for group, array in arrays)
+        if buffer is not None and len(buffer[self.groups[0]]) > 0:
+            rows = len(buffer[self.groups[0]])
+            self._write_rows(end, list(buffer.items()))
+            end += rows
+        self.clean_data_cache()
+
+        old_hash = self.hash
+        if with_hash is not None:
+            chunks_hash = self.chunks_hash
+            if chunks_hash is not None and chunks_hash["hash_fn"] == with_hash and "rows" in chunks_hash:
+                rows = self.hash_rows()
+                digests = self.chunks_digests(with_hash, from_row=length, rows=rows)
+                for group in self.groups:
+                    first = length // rows[group]
+                    digests[group] = chunks_hash["groups"][group][:first] + digests[group]
+            else:
+                rows = self.chunk_rows()
+                digests = self.chunks_digests(with_hash, rows=rows)
+            self.hash = self.merkle_hash(digests, with_hash)
+            self.chunks_hash = {"hash_fn": with_hash, "rows": rows, "groups": digests}
+        else:
+            self._del_attr('hash')
+            self._del_attr('chunks_hash')
+        self.timestamp = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M UTC")
+
+        if self.driver.persistent is True and old_hash is not None:
+            with Metadata(self.metadata_driver) as metadata:
+                timestamp = datetime.datetime.strptime(self.timestamp, '%Y-%m-%dT%H:%M UTC')
+                metadata.update_data(old_hash, {"hash": self.hash, "size": self.update_disk_size(disk_size),
+                                                "timestamp": timestamp})
+        else:
+            self.update_disk_size(disk_size)
+            self.write_metadata()
+
+    def _write_rows(self, init: int, arrays: list):
+        end = init + len(arrays[0][1])
+        self.driver.resize(end)
+        for group, array in arrays:
+            self.driver[group][init:end] = array
+            self.driver.count_bytes(array)
+
+    def from_loader(self, data_list: list, loader_fn, npartitions: int = 1, with_hash: str = "sha1",
+                    workers: int = 1, rows_per_item: int = None):
+        """
+        Call loader_fn for every item of data_list and write the rows in the dataset. The items are
+        split in npartitions, the partitions are loaded in a pool of processes (threads if loader_fn
+        can't be pickled) and each one is written as soon as it is loaded, so only the partitions
+        in flight are kept in memory. With rows_per_item the offsets are known before loading and
+        the partitions are written in any order, otherwise they are appended in order.
+        """
+        if len(data_list) == 0:
+            raise ValueError("There are not items in data_list to load")
+        size = max(int(np.ceil(len(data_list) / float(max(npartitions, 1)))), 1)
+        partitions = [(init, data_list[init:init + size]) for init in range(0, len(data_list), size)]
+        length = None if rows_per_item is None else len(data_list) * rows_per_item
+        self.driver.written_bytes = 0
+
+        end = 0
+        schema = False
+        for init, arrays in self._load_partitions(partitions, loader_fn, workers, ordered=length is None):
+            rows = len(arrays[0][1])
+            if length is None:
+                offset = end
+            else:
+                offset = init * rows_per_item
+                if rows != len(partitions[init // size][1]) * rows_per_item:
+                    raise ValueError("The partition at {} has {} rows, expected {} rows per item".format(
+                        init, rows, rows_per_item))
+            if schema is False:
+                if self._loader_schema_changed(arrays):
+                    self._require_loader_dataset(arrays, length)
+                    self.clean_data_cache()
+                elif length is not None:
+                    self.driver.resize(length)
+                schema = True
+            if length is None:
+                self._write_rows(offset, arrays)
+            else:
+                for group, array in arrays:
+                    self.driver[group][offset:offset + rows] = array
+                    self.driver.count_bytes(array)
+            end = max(end, offset + rows)
+        self.clean_data_cache()
+
+        if with_hash is not None:
+            rows = self.chunk_rows()
+            digests = self.chunks_digests(with_hash, rows=rows)
+            self.hash = self.merkle_hash(digests, with_hash)
+            self.chunks_hash = {"hash_fn": with_hash, "rows": rows, "groups": digests}
+        else:
+            self._del_attr('hash')
+            self._del_attr('chunks_hash')
+        if isinstance(self.chunksize, Chunks):
+            self.save_layout()
         self.timestamp = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M UTC")
+        self.update_disk_size()
         self.write_metadata()
 
-    def from_loader(self, data_list: list, loader_fn, npartitions: int = 1, with_hash: str = "sha1"):
-        def concat_partitions(part1: list, part2: list):
-            if not isinstance(part1, list):
-                part1 = [part1]
-            if not isinstance(part2, list):
-                part2 = [part2]
-            return GroupManager.concat(part1 + part2, axis=0)
+    @staticmethod
+    def _load_partitions(partitions: list, loader_fn, workers: int, ordered: bool = True):
+        if workers == 1:
+            for init, items in partitions:
+                yield init, load_partition(loader_fn, items)
+            return
 
-        url_bag_partition = db.from_sequence(data_list, npartitions=npartitions)
-        fold_loader = url_bag_partition.map(loader_fn).fold(binop=self.add_to_list, combine=concat_partitions,
-                                                            initial=[])
-        da_group = fold_loader.compute()
-        self.from_data(da_group, with_hash=with_hash)
+        try:
+            pickle.dumps(loader_fn)
+            executor = ProcessPoolExecutor(max_workers=workers)
+        except (pickle.PicklingError, AttributeError, TypeError):
+            log.info("loader_fn can't be pickled, the partitions are loaded in threads")
+            executor = ThreadPoolExecutor(max_workers=workers)
+
+        pending = OrderedDict()
+        with executor:
+            try:
+                for init, items in partitions:
+                    pending[executor.submit(load_partition, loader_fn, items)] = init
+                    while len(pending) >= 2 * workers:
+                        yield Data._next_partition(pending, ordered)
+                while len(pending) > 0:
+                    yield Data._next_partition(pending, ordered)
+            finally:
+                for future in pending:
+                    future.cancel()
 
     @staticmethod
-    def add_to_list(base_list, data) -> list:
-        it = Iterator(data)
-        groups = it.groups
-        if len(groups) == 1:
-            group_items = [(groups[0], data)]
+    def _next_partition(pending: OrderedDict, ordered: bool) -> tuple:
+        if ordered:
+            future = next(iter(pending))
         else:
-            group_items = [(group, data[group]) for group in groups]
-        dagroup_dict = GroupManager.convert(group_items, Chunks.build_from_shape(it.shape, it.dtypes))
-        return base_list + [dagroup_dict]
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            future = next(f for f in pending if f in done)
+        init = pending.pop(future)
+        return init, future.result()
+
+    def _loader_schema_changed(self, arrays: list) -> bool:
+        """True if the groups, dtypes or features of the loaded arrays are not the ones of the dataset"""
+        if self.groups is None:
+            return True
+        dtypes = self.dtypes
+        shape = self.shape
+        return set(group for group, _ in arrays) != set(self.groups) or \
+            any(array.dtype != dtypes[group] or array.shape[1:] != shape[group][1:] for group, array in arrays)
+
+    def _require_loader_dataset(self, arrays: list, length: int = None):
+        """The schema and shape of the loaded arrays, the previous groups of the dataset are removed"""
+        shape, dtypes = Shape.get_shape_dtypes_from_dict(OrderedDict(arrays))
+        if length is not None:
+            shape = Shape({group: (length, ) + tuple(group_shape[1:]) for group, group_shape in shape.items()})
+        if self.chunksize is None:
+            self.chunksize = Chunks.build_from_shape(shape, dtypes)
+        elif isinstance(self.chunksize, tuple):
+            self.chunksize = Chunks.build_from(self.chunksize, tuple(group for group, _ in arrays))
+        elif {group: tuple(chunks[1:]) for group, chunks in self.chunksize.items()} != \
+                {group: tuple(group_shape[1:]) for group, group_shape in shape.items()}:
+            rows = self.chunksize.length
+            self.chunksize = Chunks({group: (rows, ) + tuple(group_shape[1:]) for group, group_shape in shape.items()})
+        self.dtypes = dtypes
+        self.driver.set_data_shape(shape)
 
     def to_df(self) -> pd.DataFrame:
         return self.data.to_df()
@@ -388,7 +750,9 @@ class Data(AbsData):
     def to_ndarray(self, dtype=None) -> np.ndarray:
         return self.data.to_ndarray(dtype=dtype)
 
-    def concat(self, datasets: tuple, axis=0):
+    def concat(self, datasets: tuple, axis=0, virtual: bool = False):
+        if virtual is True:
+            return self.concat_virtual(datasets, axis=axis)
         da_groups = []
         managers = set([])
         for ds in datasets:
@@ -401,58 +765,139 @@ class Data(AbsData):
         else:
             raise NotImplementedError
 
-    def stadistics(self):
+    def concat_virtual(self, datasets: tuple, axis=0):
+        """
+        Concatenate the rows of the datasets without copying them. The sources (hash and
+        row range) are saved in the dataset and the reads are resolved by the driver,
+        materialize writes the rows in the dataset.
+        """
+        if axis != 0:
+            raise NotImplementedError
+        dtypes = datasets[0].dtypes
+        hash_fn = None
+        sources = []
+        length = 0
+        for ds in datasets:
+            if ds.dtypes != dtypes:
+                raise ValueError("The dataset {} has the dtypes {}, expected {}".format(ds.name, ds.dtypes, dtypes))
+            if ds.driver.persistent is not True or not isinstance(self.driver, type(ds.driver)) or ds.hash is None:
+                raise ValueError("The dataset {} must be saved with a hash in a {} driver".format(
+                    ds.name, self.driver.cls_name()))
+            ds_hash_fn = ds.hash.split(".", 1)[0]
+            if hash_fn is not None and ds_hash_fn != hash_fn:
+                raise ValueError("The datasets are hashed with {} and {}".format(hash_fn, ds_hash_fn))
+            hash_fn = ds_hash_fn
+            rows = ds.shape[dtypes.names[0]][0]
+            sources.append({"hash": ds.hash, "name": ds.name, "group_name": ds.group_name,
+                            "url": os.path.abspath(ds.url), "rows": [length, length + rows]})
+            length += rows
+
+        shape = Shape({group: (length, ) + tuple(datasets[0].shape[group][1:]) for group in dtypes.names})
+        if self.chunksize is None:
+            self.chunksize = Chunks.build_from_shape(shape, dtypes)
+        elif isinstance(self.chunksize, tuple):
+            self.chunksize = Chunks.build_from(self.chunksize, dtypes.names)
+        self.dtypes = dtypes
+        self.driver.written_bytes = 0
+        self.driver.set_virtual(sources, shape)
+        self.changed_sources = []
+        self.clean_data_cache()
+        self.hash = "{}.{}".format(hash_fn, merkle_root([source["hash"].split(".", 1)[1] for source in sources],
+                                                        hash_fn=hash_fn))
+        self.timestamp = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M UTC")
+        self.update_disk_size()
+        self.write_metadata()
+
+    @property
+    def virtual_sources(self) -> list:
+        return self.driver.virtual_sources
+
+    def materialize(self, with_hash: str = "sha1"):
+        """Copy the rows of the virtual sources in the dataset"""
+        if self.virtual_sources is None:
+            return
+        self.check_sources("they can't be materialized")
+        disk_size = self.disk_size
+        self.driver.written_bytes = 0
+        self.driver.materialize()
+        self.clean_data_cache()
+        old_hash = self.hash
+        if with_hash is not None:
+            rows = self.chunk_rows()
+            digests = self.chunks_digests(with_hash, rows=rows)
+            self.hash = self.merkle_hash(digests, with_hash)
+            self.chunks_hash = {"hash_fn": with_hash, "rows": rows, "groups": digests}
+        self.timestamp = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M UTC")
+        if self.driver.persistent is True and old_hash is not None:
+            with Metadata(self.metadata_driver) as metadata:
+                timestamp = datetime.datetime.strptime(self.timestamp, '%Y-%m-%dT%H:%M UTC')
+                metadata.update_data(old_hash, {"hash": self.hash, "size": self.update_disk_size(disk_size),
+                                                "timestamp": timestamp})
+        else:
+            self.update_disk_size(disk_size)
+
+    def stadistics(self, workers: int = None):
         headers = ["group", "mean", "std dev", "min", "25%", "50%", "75%", "max", "nonzero", "nonan", "unique", "dtype"]
+        cached = self.stadistics_cache
+        if cached is not None and self.hash is not None and cached["hash"] == self.hash:
+            table = cached["table"]
+        else:
+            table = self.calc_stadistics(headers, workers=workers)
+            if self.hash is not None and self.driver.mode != "r":
+                self.stadistics_cache = {"hash": self.hash, "table": table}
+
+        print("# rows {}".format(self.shape[0]))
+        return tabulate(table, headers)
+
+    def calc_stadistics(self, headers: list, workers: int = None) -> list:
+        """One pass over the batchs of all the groups, the statistics of each batch are
+        calculated in a pool of threads and merged"""
         self.chunksize = Chunks.build_from_shape(self.shape, self.dtypes)
+        numeric = {group: dtype.kind in "fiu" for group, (dtype, _) in self.dtypes.fields.items()}
+        batchs = Iterator(self.data).batchs(chunks=self.chunksize)
+
+        def batch_stats(index: int) -> dict:
+            batch = batchs[index].batch
+            return {group: GroupStats(numeric[group], quantiles=len(self.shape[group]) == 1).update(
+                batch[group].to_ndarray()) for group in self.groups}
+
+        stats = {group: GroupStats(numeric[group], quantiles=len(self.shape[group]) == 1) for group in self.groups}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for batch_stats_dict in executor.map(batch_stats, range(batchs.num_splits())):
+                for group, group_stats in batch_stats_dict.items():
+                    stats[group].merge(group_stats)
+
         table = []
         for group, (dtype, _) in self.dtypes.fields.items():
-            values = dict()
-            values["dtype"] = dtype
+            group_stats = stats[group]
+            values = dict.fromkeys(headers, "-")
             values["group"] = group
-            darray = self.data[group].da
-            if dtype == np.dtype(float) or dtype == np.dtype(int):
-                da_mean = da.around(darray.mean(), decimals=3)
-                da_std = da.around(darray.std(), decimals=3)
-                da_min = da.around(darray.min(), decimals=3)
-                da_max = da.around(darray.max(), decimals=3)
-                result = dask.compute([da_mean, da_std, da_min, da_max])[0]
-                values["mean"] = result[0] if not np.isnan(result[0]) else da.around(da.nanmean(darray), decimals=3).compute()
-                values["std dev"] = result[1] if not np.isnan(result[0]) else da.around(da.nanstd(darray), decimals=3).compute()
-                values["min"] = result[2] if not np.isnan(result[0]) else da.around(da.nanmin(darray), decimals=3).compute()
-                values["max"] = result[3] if not np.isnan(result[0]) else da.around(da.nanmax(darray), decimals=3).compute()
-                if len(self.shape[group]) == 1:
-                    da_percentile = da.around(da.percentile(darray, [25, 50, 75]), decimals=3)
-                    result = da_percentile.compute()
-                    values["25%"] = result[0]
-                    values["50%"] = result[1]
-                    values["75%"] = result[2]
-                else:
-                    values["25%"] = "-"
-                    values["50%"] = "-"
-                    values["75%"] = "-"
-                values["nonzero"] = da.count_nonzero(darray).compute()
-                values["nonan"] = da.count_nonzero(da.notnull(darray)).compute()
-                values["unique"] = "-"
+            values["dtype"] = str(dtype)
+            values["nonan"] = group_stats.nonan
+            if numeric[group]:
+                values["mean"] = round(float(group_stats.mean), 3)
+                values["std dev"] = round(float(group_stats.std), 3)
+                values["min"] = round(float(group_stats.min), 3)
+                values["max"] = round(float(group_stats.max), 3)
+                values["nonzero"] = group_stats.nonzero
+                if group_stats.sketch is not None:
+                    for column, value in zip(["25%", "50%", "75%"], group_stats.quantile([.25, .5, .75])):
+                        values[column] = round(float(value), 3)
             else:
-                values["mean"] = "-"
-                values["std dev"] = "-"
-                values["min"] = "-"
-                values["max"] = "-"
-                values["25%"] = "-"
-                values["50%"] = "-"
-                values["75%"] = "-"
-                values["nonzero"] = "-"
-                values["nonan"] = da.count_nonzero(da.notnull(darray)).compute()
-                vunique = darray.to_dask_dataframe().fillna('').nunique().compute()
-                values["unique"] = vunique
-
-            row = []
-            for column in headers:
-                row.append(values[column])
-            table.append(row)
+                values["unique"] = group_stats.distinct
+            table.append([values[column] for column in headers])
+        return table
 
-        print("# rows {}".format(self.shape[0]))
-        return tabulate(table, headers)
+    @property
+    def stadistics_cache(self):
+        value = self._get_attr('stadistics')
+        if value is not None:
+            return json.loads(value)
+
+    @stadistics_cache.setter
+    def stadistics_cache(self, value):
+        if value is not None:
+            self._set_attr('stadistics', json.dumps(value))
 
     @staticmethod
     def load(hash_hex: str, metadata_driver: AbsDriver, metadata_path: str = None, auto_chunks: bool = True) -> 'Data':
@@ -473,3 +918,21 @@ class Data(AbsData):
                 name = row[0]
                 return Data(name=name, group_name=group_name, driver=data_driver(path=path, mode="r"),
                             metadata_path=metadata_path, auto_chunks=auto_chunks)
+
+
+def loader_arrays(data) -> list:
+    """(group, array) pairs of the value returned by a loader"""
+    if isinstance(data, pd.DataFrame):
+        return [(group, data[group].values) for group in data.columns]
+    elif isinstance(data, dict):
+        return [(group, np.asarray(array)) for group, array in data.items()]
+    data = np.asarray(data)
+    if data.dtype.names is not None:
+        return [(group, data[group]) for group in data.dtype.names]
+    return [(DEFAUL_GROUP_NAME, data)]
+
+
+def load_partition(loader_fn, items: list) -> list:
+    """call loader_fn for every item and concatenate the groups, it runs in the worker process"""
+    parts = [loader_arrays(loader_fn(item)) for item in items]
+    return [(group, np.concatenate([part[i][1] for part in parts])) for i, (group, _) in enumerate(parts[0])]
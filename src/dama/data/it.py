@@ -3,11 +3,13 @@ from collections import OrderedDict
 import numpy as np
 import pandas as pd
 import types
+import operator
 import numbers
 
 from collections import defaultdict, deque
-from dama.utils.numeric_functions import max_type, num_splits, wsrj, max_dtype
-from dama.utils.seq import grouper_chunk
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from dama.utils.numeric_functions import max_type, num_splits, wsrj, wsrj_batch, max_dtype, lcm
+from dama.utils.seq import grouper_chunk, prefetch
 from dama.utils.core import Shape, Chunks
 from dama.utils.miscellaneous import isnamedtupleinstance
 from dama.utils.logger import log_config
@@ -17,10 +19,13 @@ from dama.utils.numeric_functions import nested_shape
 from dama.connexions.core import GroupManager
 from dama.fmtypes import Slice, DEFAUL_GROUP_NAME
 from dama.drivers.core import StcArray
+from dama.utils.parallel import SharedBatch, map_shared_batch
+from dama.utils.counter import ValueCounter, ApproxCounter
 
 
 log = log_config(__name__)
-__all__ = ['BatchIterator', 'BaseIterator', 'BatchGroup', 'BatchItGroup', 'Iterator']
+__all__ = ['BatchIterator', 'BaseIterator', 'BatchGroup', 'BatchItGroup', 'BatchArrayGroup', 'BatchPrefetch',
+           'BatchMap', 'BatchShuffle', 'Iterator']
 
 
 def assign_struct_array(it, type_elem, start_i, end_i, dtype, dims):
@@ -33,16 +38,24 @@ def assign_struct_array(it, type_elem, start_i, end_i, dtype, dims):
         shape = length
 
     stc_arr = np.empty(shape, dtype=dtype)
+    rows = list(it)
+    if not bulk_assign_struct_array(stc_arr, rows, type_elem):
+        row_assign_struct_array(stc_arr, rows, type_elem)
+    return stc_arr
+
+
+def row_assign_struct_array(stc_arr, rows, type_elem):
+    dtype = stc_arr.dtype
     if type_elem == np.ndarray and len(stc_arr.shape) == 1:
-        for i, row in enumerate(it):
+        for i, row in enumerate(rows):
             stc_arr[i] = tuple(row)
     elif len(dtype) == 1 and not isnamedtupleinstance(type_elem):
         group = dtype.names[0]
-        for i, row in enumerate(it):
+        for i, row in enumerate(rows):
             stc_arr[group][i] = row
     elif type_elem == list or type_elem == tuple:
         elems = defaultdict(list)
-        for row in it:
+        for row in rows:
             for i, group in enumerate(dtype.names):
                 elems[group].append(row[i])
 
@@ -50,7 +63,7 @@ def assign_struct_array(it, type_elem, start_i, end_i, dtype, dims):
             stc_arr[group] = data
     elif isnamedtupleinstance(type_elem):
         elems = defaultdict(list)
-        for row in it:
+        for row in rows:
             for i, group in enumerate(dtype.names):
                 elems[group].append(getattr(row, group))
 
@@ -58,7 +71,85 @@ def assign_struct_array(it, type_elem, start_i, end_i, dtype, dims):
             stc_arr[group] = data
     else:
         raise NotImplementedError
-    return stc_arr
+
+
+def bulk_assign_struct_array(stc_arr, rows: list, type_elem) -> bool:
+    """Fill stc_arr with whole column operations, return False if the rows
+    are not homogeneous and must be assigned row by row."""
+    if len(rows) == 0:
+        return True
+
+    try:
+        if type_elem == np.ndarray and len(stc_arr.shape) == 1:
+            return _bulk_ndarray_rows(stc_arr, rows)
+        elif len(stc_arr.dtype) == 1 and not isnamedtupleinstance(type_elem):
+            return _bulk_one_group(stc_arr, rows, type_elem)
+        elif type_elem == list or type_elem == tuple or isnamedtupleinstance(type_elem):
+            return _bulk_columns(stc_arr, rows, type_elem)
+    except (ValueError, TypeError) as e:
+        log.debug("Bulk assignment not allowed, using row assignment: {}".format(e))
+    return False
+
+
+def _is_scalar_column(rows: list) -> bool:
+    return all(issubclass(type_e, (numbers.Number, str, np.generic)) for type_e in set(map(type, rows)))
+
+
+def _stack_rows(rows: list) -> np.ndarray:
+    block = np.array(rows)
+    if block.shape[1:] != rows[0].shape:
+        raise ValueError("rows with different shapes")
+    return block
+
+
+def _bulk_ndarray_rows(stc_arr, rows: list) -> bool:
+    block = _stack_rows(rows)
+    if block.ndim != 2 or block.shape[1] != len(stc_arr.dtype):
+        return False
+    length = block.shape[0]
+    for i, group in enumerate(stc_arr.dtype.names):
+        stc_arr[group][:length] = block[:, i]
+    return True
+
+
+def _bulk_one_group(stc_arr, rows: list, type_elem) -> bool:
+    group = stc_arr.dtype.names[0]
+    column = stc_arr[group]
+    length = len(rows)
+    if type_elem == np.ndarray:
+        column[:length] = _stack_rows(rows)
+    elif column.ndim == 1 and _is_scalar_column(rows):
+        if column.dtype == np.dtype("O"):
+            column[:length] = rows
+        else:
+            column[:length] = np.fromiter(rows, dtype=column.dtype, count=length)
+    else:
+        return False
+    return True
+
+
+def _bulk_columns(stc_arr, rows: list, type_elem) -> bool:
+    groups = stc_arr.dtype.names
+    if min(map(len, rows)) < len(groups):
+        return False
+
+    fields = getattr(type_elem, '_fields', None)
+    if fields is not None and all(group in fields for group in groups):
+        index = [fields.index(group) for group in groups]
+    elif fields is None:
+        index = range(len(groups))
+    else:
+        return False
+
+    if type_elem == tuple and stc_arr.ndim == 1 and len(rows[0]) == len(groups):
+        # rows are records with the same layout of the dtype
+        stc_arr[:len(rows)] = np.array(rows, dtype=stc_arr.dtype)
+        return True
+
+    columns = list(zip(*rows))
+    for group, i in zip(groups, index):
+        stc_arr[group] = columns[i]
+    return True
 
 
 def str_array(shape, chunks, data, dtypes):
@@ -141,12 +232,10 @@ class BaseIterator(object):
                         yield elem
         elif self.type_elem == Slice:
             for data in self:
-                for elem in data.batch.to_ndarray().reshape(-1):
-                    yield elem
+                yield from data.batch.to_ndarray().reshape(-1)
         elif self.type_elem == pd.DataFrame:
             for data in self:
-                for elem in data.values.reshape(-1):
-                    yield elem
+                yield from data.values.reshape(-1)
         elif self.type_elem.__module__ == 'builtins':
             for elem in chain.from_iterable(self):
                 yield elem
@@ -155,7 +244,7 @@ class BaseIterator(object):
 
     def flat(self) -> 'Iterator':
         if self.length != np.inf:
-            length = self.length * sum(self.shape[1:])
+            length = self.length * int(np.prod(self.shape[1:]))
         else:
             length = self.length
         return Iterator(self.flatter(), dtypes=self.dtypes, length=length)
@@ -234,6 +323,7 @@ class BaseIterator(object):
 class Iterator(BaseIterator):
     def __init__(self, fn_iter, dtypes: np.dtype = None, length: int = np.inf) -> None:
         super(Iterator, self).__init__(fn_iter, dtypes=dtypes, length=length)
+        self.source = None
         if dtypes is None:
             self.mapped_dtype = False
         else:
@@ -251,14 +341,17 @@ class Iterator(BaseIterator):
             self.pushedback = fn_iter.pushedback
             self.dtypes = fn_iter.dtypes
             self.rewind = fn_iter.rewind
+            self.source = fn_iter.source
             return
         elif isinstance(fn_iter, pd.DataFrame):
             self.data = fn_iter.itertuples(index=False)
+            self.source = fn_iter
             dtypes = np.dtype(list(zip(fn_iter.columns.values, fn_iter.dtypes.values)))
             length = fn_iter.shape[0] if length == np.inf else length
             self.rewind = False
         elif isinstance(fn_iter, np.ndarray):
             self.data = iter(fn_iter)
+            self.source = fn_iter
             length = fn_iter.shape[0] if length == np.inf else length
             self.rewind = False
         elif isinstance(fn_iter, AbsData) or isinstance(fn_iter, AbsConn):
@@ -384,9 +477,35 @@ class Iterator(BaseIterator):
 
         if isinstance(self.data, AbsData) or isinstance(self.data, GroupManager):
             return BatchGroup(self, chunks=chunks, start_i=start_i)
+        elif self.source_groups() is not None:
+            return BatchArrayGroup(self, chunks=chunks, start_i=start_i)
         else:
             return BatchItGroup(self, chunks=chunks, start_i=start_i)
 
+    def source_groups(self) -> list:
+        """Return the (group, array) pairs of an untouched ndarray or DataFrame source,
+        None if the source can't be sliced by group"""
+        # the only element consumed is the one pushed back by chunk_taste
+        if self.source is None or len(self.pushedback) != 1:
+            return None
+        elif isinstance(self.source, pd.DataFrame):
+            if all(group in self.source.columns for group in self.groups):
+                return [(group, self.source[group].values) for group in self.groups]
+        elif self.source.dtype.fields is not None:
+            if all(group in self.source.dtype.fields for group in self.groups):
+                return [(group, self.source[group]) for group in self.groups]
+        elif len(self.groups) == 1:
+            return [(self.groups[0], self.source)]
+        elif self.source.ndim == 2 and self.source.shape[1] == len(self.groups):
+            return [(group, self.source[:, i]) for i, group in enumerate(self.groups)]
+
+    def flat(self) -> 'Iterator':
+        if isinstance(self.source, np.ndarray) and self.source.dtype.fields is None \
+                and self.source_groups() is not None:
+            group = self.groups[0] if len(self.groups) == 1 else DEFAUL_GROUP_NAME
+            return Iterator(self.source.reshape(-1), dtypes=np.dtype([(group, self.dtype)]))
+        return super(Iterator, self).flat()
+
     def __getitem__(self, key) -> 'Iterator':
         if isinstance(key, slice):
             if key.stop is not None:
@@ -456,28 +575,67 @@ class BatchIterator(BaseIterator):
             else:
                 yield slice_obj
 
-    def unique(self) -> dict:
-        values = defaultdict(lambda: 0)
-        group = self.groups[0]
-        for batch in self:
-            u_values, counter = np.unique(batch.batch[group].to_ndarray(), return_counts=True)
-            for k, v in dict(zip(u_values, counter)).items():
-                values[k] += v
-        return values
+    def value_counts(self, groups=None, approx: bool = False, top_k: int = 10):
+        """
+        Count the values (or the rows of several groups) of every batch. Returns a ValueCounter
+        or, if approx is True, an ApproxCounter with bounded memory.
+        """
+        if groups is None:
+            groups = [self.groups[0]]
+        elif isinstance(groups, str):
+            groups = [groups]
+        counter = ApproxCounter(top_k=top_k) if approx else ValueCounter()
+        for slice_obj in self:
+            counter.update([slice_obj.batch[group].to_ndarray() for group in groups])
+        return counter
+
+    def unique(self, groups=None) -> dict:
+        return self.value_counts(groups).to_dict()
 
     def num_splits(self) -> int:
         return num_splits(self.length, self.batch_size)
 
-    def flat(self) -> Iterator:
-        if self.length != np.inf:
-            length = self.length * sum(self.shape[1:])
+    def flat(self) -> 'BatchIterator':
+        return BatchFlat(self)
+
+    def sample(self, length: int, col: str = None, weight_fn=None, random_state=None) -> Iterator:
+        items = wsrj_batch(self.weights_batchs(col, weight_fn), length, random_state=random_state)
+        if items is None:
+            return Iterator([], dtypes=self.dtypes)
+        chunks = Chunks({group: self.chunksize[group] for group in items})
+        return Iterator(GroupManager.convert(items, chunks=chunks))
+
+    def weights_batchs(self, col: str = None, weight_fn=None):
+        """Yields the batchs as (load_fn, length, weights) for wsrj_batch. weight_fn receives
+        the array of the col group (the first group if col is None)"""
+        if col is not None and weight_fn is None:
+            groups = [col]
         else:
-            length = self.length
-        return Iterator(self.flatter(), dtypes=self.dtypes, length=length)
+            groups = self.groups
 
-    def sample(self, length: int, col: str = None, weight_fn=None) -> Iterator:
-        data = self.clean_batchs()
-        return Iterator(wsrj(self.weights_gen(data, col, weight_fn), length), dtypes=self.dtypes, length=length)
+        for slice_obj in self:
+            batch = slice_obj.batch
+            length = batch.shape[0]
+
+            def load_fn(batch=batch):
+                return OrderedDict((group, batch[group].to_ndarray()) for group in groups)
+
+            if weight_fn is None:
+                weights = None
+            else:
+                values = batch[self.groups[0] if col is None else col].to_ndarray()
+                weights = self.apply_weight_fn(weight_fn, values)
+            yield load_fn, length, weights
+
+    @staticmethod
+    def apply_weight_fn(weight_fn, values: np.ndarray) -> np.ndarray:
+        try:
+            weights = weight_fn(values)
+        except (TypeError, ValueError):
+            weights = None
+        if weights is None or np.ndim(weights) == 0:
+            weights = np.fromiter(map(weight_fn, values), dtype=float, count=len(values))
+        return weights
 
     def __next__(self):
         return next(self._it)
@@ -555,22 +713,142 @@ class BatchIterator(BaseIterator):
         return BatchIterator.from_batchs(self.to_iter(),  dtypes=self.dtypes, from_batch_size=self.batch_size,
                                          length=self.length)
 
+    def prefetch(self, size: int = 2) -> 'BatchIterator':
+        return BatchPrefetch(self, size=size)
+
+    def window(self, win_size: int = 2, stride: int = 1, dilation: int = 1) -> 'BatchIterator':
+        return BatchWindow(self, win_size=win_size, stride=stride, dilation=dilation)
+
+    def map(self, fn, workers: int = 1, ordered: bool = True) -> 'BatchIterator':
+        return BatchMap(self, fn, workers=workers, ordered=ordered)
+
 
 class BatchGroup(BatchIterator):
     type_elem = Slice
 
+    def __init__(self, it: Iterator, chunks: Chunks = None, static: bool = False, start_i: int = 0):
+        self.base = 0
+        self.offset = 0
+        self.stop = None
+        self.position = 0
+        super(BatchGroup, self).__init__(it, chunks=chunks, static=static, start_i=start_i)
+
     def batch_from_it(self, shape=None):
-        init = 0
-        end = self.batch_size
-        while True:
+        init = self.offset
+        end = init + self.batch_size
+        self.position = init
+        # the offset of seek is only for this pass, the next passes start at base
+        self.offset = self.base
+        while self.stop is None or init < self.stop:
+            if self.stop is not None:
+                end = min(end, self.stop)
             batch = self.data.data[init:end]  # Always return a Manager
             if batch.size > 0:
-                yield Slice(batch=batch, slice=slice(init, end))
+                self.position = init + batch.size
+                yield Slice(batch=batch, slice=slice(init - self.base, end - self.base))
                 init = end
                 end += self.batch_size
             else:
                 break
 
+    def __getitem__(self, key):
+        """An int returns the batch at that index, a slice returns the rows
+        between start and stop as a new iterator (its slices start at 0),
+        the previous rows are not read"""
+        if isinstance(key, slice):
+            if key.step not in (None, 1):
+                raise NotImplementedError("The rows of the batchs can't be sliced with a step")
+            start, stop, _ = key.indices(int(min(self.length, self.manager.size - self.base)))
+            stop = max(stop, start)
+            it = self._copy()
+            it.base = self.base + start
+            it.offset = it.base
+            it.stop = self.base + stop
+            it.shape = self.shape.change_length(stop - start)
+            return it
+        try:
+            index = operator.index(key)
+        except TypeError:
+            raise TypeError("The batchs are indexed by int or slice, not {}".format(type(key).__name__))
+        if index < 0:
+            index += self.num_splits()
+        init = self.base + index * self.batch_size
+        end = init + self.batch_size
+        if self.stop is not None:
+            end = min(end, self.stop)
+        if index < 0 or init >= end:
+            raise IndexError("batch index {} out of range".format(key))
+        batch = self.data.data[init:end]
+        if batch.size == 0:
+            raise IndexError("batch index {} out of range".format(key))
+        return Slice(batch=batch, slice=slice(init - self.base, end - self.base))
+
+    def _copy(self) -> 'BatchGroup':
+        it = BatchGroup(self.data, chunks=self.chunksize, start_i=self.start_i)
+        it.base = self.base
+        it.offset = self.offset
+        it.stop = self.stop
+        it.shape = self.shape
+        return it
+
+    def seek(self, batch_index: int) -> 'BatchGroup':
+        """the next iteration starts at the batch batch_index, the later ones start at the first batch"""
+        return self.seek_row(operator.index(batch_index) * self.batch_size)
+
+    def seek_row(self, row: int) -> 'BatchGroup':
+        """the next iteration starts at the row, the later ones start at the first row"""
+        self.offset = self.base + row
+        self.position = self.offset
+        self._it = self.run()
+        return self
+
+    @property
+    def cursor(self) -> dict:
+        """Position of the next row to read, it can be saved as json and passed to resume"""
+        return {"row": int(self.position - self.base), "batch_size": int(self.batch_size)}
+
+    def resume(self, cursor: dict) -> 'BatchGroup':
+        if cursor["batch_size"] != self.batch_size:
+            raise ValueError("The cursor was saved with batch size {}, the iterator has {}".format(
+                cursor["batch_size"], self.batch_size))
+        return self.seek_row(cursor["row"])
+
+    @property
+    def manager(self) -> GroupManager:
+        if isinstance(self.data.data, AbsData):
+            return self.data.data.data
+        return self.data.data
+
+    def storage_rows(self) -> int:
+        """Rows of the storage chunks of the driver, the lcm of the rows of the groups so every
+        block of rows is aligned to the chunks of all the groups. None if the data is not a Data
+        or its driver doesn't use chunks"""
+        if not isinstance(self.data.data, AbsData):
+            return None
+        storage_chunks = self.data.data.storage_chunks()
+        if storage_chunks is None:
+            return None
+        return lcm(max(storage_chunks[group][0], 1) for group in self.manager.groups)
+
+    def chunk_slices(self) -> list:
+        """Rows of every storage chunk between base and stop. Without storage chunks
+        the boundaries of the dask chunks of all groups are merged"""
+        manager = self.manager
+        end = min(self.base + self.length, manager.size)
+        bounds = {self.base, end}
+        step = self.storage_rows()
+        if step is not None:
+            bounds.update(range((self.base // step + 1) * step, end, step))
+        else:
+            for group in manager.groups:
+                bounds.update(int(bound) for bound in np.cumsum(manager.conn[group].chunks[0])
+                              if self.base < bound < end)
+        bounds = sorted(bounds)
+        return [slice(init, end) for init, end in zip(bounds, bounds[1:])]
+
+    def shuffle(self, buffer_chunks: int = 4, seed: int = None) -> 'BatchIterator':
+        return BatchShuffle(self, buffer_chunks=buffer_chunks, seed=seed)
+
 
 class BatchItGroup(BatchIterator):
     type_elem = Slice
@@ -580,3 +858,266 @@ class BatchItGroup(BatchIterator):
             driver = StcArray(conn=stc_array)
             manager = driver.manager(self.chunksize)
             yield Slice(batch=manager, slice=slice(start_i+self.start_i, end_i+self.start_i))
+
+
+class BatchArrayGroup(BatchIterator):
+    """Batches built from views of an in memory ndarray or DataFrame, without
+    iterating over the rows"""
+    type_elem = Slice
+
+    def batch_from_it(self, shape=None):
+        groups = self.data.source_groups()
+        init = 0
+        end = self.batch_size
+        while init < self.length:
+            end = min(end, self.length)
+            batch = []
+            for group, array in groups:
+                dtype = self.dtypes.fields[group][0]
+                view = array[init:end]
+                if view.dtype != dtype:
+                    view = view.astype(dtype)
+                batch.append((group, view))
+            manager = GroupManager.convert(batch, chunks=self.chunksize)
+            yield Slice(batch=manager, slice=slice(init+self.start_i, end+self.start_i))
+            init = end
+            end += self.batch_size
+
+
+class BatchFlat(BatchIterator):
+    """Every batch is reshaped to one dimension, the groups of a batch are joined
+    like in to_ndarray"""
+    type_elem = Slice
+
+    def __init__(self, it: BatchIterator):
+        super(BatchFlat, self).__init__(it, chunks=it.chunksize, start_i=it.start_i)
+        self.features = int(np.prod(it.shape.to_tuple()[1:]))
+        group = it.groups[0] if len(it.groups) == 1 else DEFAUL_GROUP_NAME
+        self.dtypes = np.dtype([(group, it.dtype)])
+        self.shape = Shape({group: (it.length * self.features, )})
+        self.chunksize = Chunks({group: (it.batch_size * self.features, )})
+        self.batch_size = self.chunksize.length
+        self.start_i = it.start_i * self.features
+
+    def batch_from_it(self, shape=None):
+        group = self.groups[0]
+        init = self.start_i
+        for slice_obj in self.data:
+            batch = slice_obj.batch if isinstance(slice_obj, Slice) else slice_obj
+            if isinstance(batch, AbsConn):
+                array = batch.to_ndarray()
+            else:
+                array = np.asarray(batch)
+            array = array.reshape(-1)
+            end = init + len(array)
+            manager = GroupManager.convert([(group, array)], chunks=self.chunksize)
+            yield Slice(batch=manager, slice=slice(init, end))
+            init = end
+
+
+class BatchWindow(BatchIterator):
+    """
+    Sliding windows of win_size rows of every group, the windows start every stride rows
+    and take one row of each dilation. Each batch returns an array of shape
+    (n_windows, win_size, ...) made with strides, the last rows of a batch are carried
+    to the next one.
+    """
+    type_elem = Slice
+
+    def __init__(self, it: BatchIterator, win_size: int = 2, stride: int = 1, dilation: int = 1):
+        if win_size < 1 or stride < 1 or dilation < 1:
+            raise ValueError("win_size, stride and dilation must be greater than 0")
+        super(BatchWindow, self).__init__(it, chunks=it.chunksize, start_i=0)
+        self.win_size = win_size
+        self.stride = stride
+        self.dilation = dilation
+        self.span = (win_size - 1) * dilation + 1
+        if it.length == np.inf:
+            length = np.inf
+        elif it.length < self.span:
+            length = 0
+        else:
+            length = (it.length - self.span) // stride + 1
+        windows = max(it.batch_size // stride, 1)
+        shape = OrderedDict()
+        chunks = Chunks()
+        for group in it.groups:
+            features = tuple(it.shape[group][1:])
+            shape[group] = (length, win_size) + features
+            chunks[group] = (windows, win_size) + features
+        self.shape = Shape(shape)
+        self.chunksize = chunks
+        self.batch_size = windows
+
+    def windows(self, array: np.ndarray, n_windows: int) -> np.ndarray:
+        array = np.ascontiguousarray(array[:(n_windows - 1) * self.stride + self.span])
+        row_stride = array.strides[0]
+        view = np.lib.stride_tricks.as_strided(
+            array, shape=(n_windows, self.win_size) + array.shape[1:],
+            strides=(row_stride * self.stride, row_stride * self.dilation) + array.strides[1:], writeable=False)
+        return np.ascontiguousarray(view)
+
+    def available(self, length: int) -> int:
+        if length < self.span:
+            return 0
+        return (length - self.span) // self.stride + 1
+
+    def batch_from_it(self, shape=None):
+        buffer = None
+        init = 0
+        skip = 0
+        for slice_obj in self.data:
+            batch = slice_obj.batch if isinstance(slice_obj, Slice) else slice_obj
+            if isinstance(batch, AbsConn):
+                arrays = [(group, batch[group].to_ndarray()) for group in self.groups]
+            else:
+                arrays = [(self.groups[0], np.asarray(batch))]
+            if buffer is not None:
+                arrays = [(group, np.concatenate((buffer[group], array))) for group, array in arrays]
+
+            # the rows before the next window (stride > span) are not needed
+            drop = min(skip, len(arrays[0][1]))
+            skip -= drop
+            arrays = [(group, array[drop:]) for group, array in arrays]
+            while self.available(len(arrays[0][1])) >= self.batch_size:
+                windows = [(group, self.windows(array, self.batch_size)) for group, array in arrays]
+                manager = GroupManager.convert(windows, chunks=self.chunksize)
+                yield Slice(batch=manager, slice=slice(init, init + self.batch_size))
+                init += self.batch_size
+                step = self.batch_size * self.stride
+                skip = max(step - len(arrays[0][1]), 0)
+                arrays = [(group, array[step:]) for group, array in arrays]
+            buffer = dict(arrays)
+
+        if buffer is not None:
+            n_windows = self.available(len(list(buffer.values())[0]))
+            if n_windows > 0:
+                windows = [(group, self.windows(array, n_windows)) for group, array in buffer.items()]
+                manager = GroupManager.convert(windows, chunks=self.chunksize)
+                yield Slice(batch=manager, slice=slice(init, init + n_windows))
+
+
+class BatchPrefetch(BatchIterator):
+    """Reads the batches of a BatchIterator in a background thread, keeping up to
+    size batches ready in order"""
+    type_elem = Slice
+
+    def __init__(self, it: BatchIterator, size: int = 2):
+        self.size = size
+        super(BatchPrefetch, self).__init__(it, chunks=it.chunksize, start_i=it.start_i)
+        self.type_elem = it.type_elem
+
+    def batch_from_it(self, shape=None):
+        return prefetch(self.data, self.size)
+
+
+class BatchMap(BatchIterator):
+    """
+    Applies fn to each batch in a pool of processes. fn receives a dict of group arrays
+    and returns the transformed groups with the same shape and dtype (or an array if
+    there is only one group), it must be pickable. The arrays are moved through shared
+    memory. With ordered=False the batches are returned as soon as they are processed.
+    """
+    type_elem = Slice
+
+    def __init__(self, it: BatchIterator, fn, workers: int = 1, ordered: bool = True):
+        self.fn = fn
+        self.workers = workers
+        self.ordered = ordered
+        super(BatchMap, self).__init__(it, chunks=it.chunksize, start_i=it.start_i)
+
+    def batch_from_it(self, shape=None):
+        max_pending = 2 * self.workers
+        pending = OrderedDict()
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            try:
+                for slice_obj in self.data:
+                    arrays = OrderedDict((group, slice_obj.batch[group].to_ndarray())
+                                         for group in slice_obj.batch.groups)
+                    shared_batch = SharedBatch.from_arrays(arrays)
+                    future = executor.submit(map_shared_batch, self.fn, shared_batch.specs)
+                    pending[future] = (slice_obj.slice, shared_batch)
+                    while len(pending) >= max_pending:
+                        yield self._next_done(pending)
+                while len(pending) > 0:
+                    yield self._next_done(pending)
+            finally:
+                for future in pending:
+                    future.cancel()
+                wait(pending)
+                for _, shared_batch in pending.values():
+                    shared_batch.close()
+                    shared_batch.unlink()
+
+    def _next_done(self, pending: OrderedDict) -> Slice:
+        if self.ordered:
+            future = next(iter(pending))
+        else:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            future = next(f for f in pending if f in done)
+        slice_item, shared_batch = pending.pop(future)
+        try:
+            arrays = shared_batch.to_arrays(future.result())
+        finally:
+            shared_batch.close()
+            shared_batch.unlink()
+        manager = GroupManager.convert(arrays, chunks=self.chunksize)
+        return Slice(batch=manager, slice=slice_item)
+
+
+class BatchShuffle(BatchIterator):
+    """
+    Shuffled batches of a BatchGroup. Each epoch reads the storage chunks in a random
+    order and shuffles the rows of buffer_chunks chunks in memory, so the reads
+    are sequential inside each chunk. With a seed the epochs are reproducible.
+    """
+    type_elem = Slice
+
+    def __init__(self, it: BatchGroup, buffer_chunks: int = 4, seed: int = None):
+        self.buffer_chunks = buffer_chunks
+        self.seed = seed
+        self.epoch = 0
+        super(BatchShuffle, self).__init__(it, chunks=it.chunksize, start_i=it.start_i)
+
+    def random_state(self) -> np.random.RandomState:
+        if self.seed is None:
+            return np.random.RandomState()
+        return np.random.RandomState(self.seed + self.epoch)
+
+    def batch_from_it(self, shape=None):
+        manager = self.data.manager
+        chunk_slices = self.data.chunk_slices()
+        random_state = self.random_state()
+        self.epoch += 1
+        order = random_state.permutation(len(chunk_slices))
+        init = 0
+        buffer = None
+        for i in range(0, len(order), self.buffer_chunks):
+            arrays = [self._read(manager, chunk_slices[j]) for j in order[i:i + self.buffer_chunks]]
+            if buffer is not None:
+                arrays.insert(0, buffer)
+            buffer = OrderedDict((group, np.concatenate([array[group] for array in arrays]))
+                                 for group in manager.groups)
+            index = random_state.permutation(self._length(buffer))
+            buffer = OrderedDict((group, array[index]) for group, array in buffer.items())
+            while self._length(buffer) >= self.batch_size:
+                yield self._slice(buffer, init, self.batch_size)
+                buffer = OrderedDict((group, array[self.batch_size:]) for group, array in buffer.items())
+                init += self.batch_size
+
+        if buffer is not None and self._length(buffer) > 0:
+            yield self._slice(buffer, init, self._length(buffer))
+
+    @staticmethod
+    def _read(manager: GroupManager, chunk_slice: slice) -> OrderedDict:
+        batch = manager[chunk_slice]
+        return OrderedDict((group, batch.conn[group].compute()) for group in batch.groups)
+
+    @staticmethod
+    def _length(arrays: OrderedDict) -> int:
+        return len(next(iter(arrays.values())))
+
+    def _slice(self, buffer: OrderedDict, init: int, length: int) -> Slice:
+        batch = OrderedDict((group, array[:length]) for group, array in buffer.items())
+        manager = GroupManager.convert(batch, chunks=self.chunksize)
+        return Slice(batch=manager, slice=slice(init + self.start_i, init + length + self.start_i))
@@ -1,7 +1,13 @@
 import zarr
 import h5py
 import numpy as np
+import json
 import os
+import zlib
+
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
 
 from numcodecs import MsgPack
 from dama.abc.driver import AbsDriver
@@ -13,7 +19,80 @@ from dama.utils.decorators import cache
 
 
 log = log_config(__name__)
-__all__ = ['HDF5', 'Zarr', 'Memory', 'List', 'StcArray']
+__all__ = ['HDF5', 'Zarr', 'Memory', 'List', 'StcArray', 'MemMap']
+
+
+def compress_chunks(array: np.ndarray, start: int, chunks: tuple, dtype: np.dtype, level: int = None) -> list:
+    """Split the array in HDF5 chunks and return the (offset, bytes) of every chunk,
+    the edge chunks are padded to the chunk shape"""
+    blocks = []
+    ranges = [range(0, dim, size) for dim, size in zip(array.shape[1:], chunks[1:])]
+    for row in range(0, len(array), chunks[0]):
+        for offset in product(*ranges):
+            offset = (row, ) + offset
+            block = array[tuple(slice(init, init + size) for init, size in zip(offset, chunks))]
+            if block.shape != chunks:
+                padded = np.zeros(chunks, dtype=dtype)
+                padded[tuple(slice(0, size) for size in block.shape)] = block
+                block = padded
+            data = np.ascontiguousarray(block, dtype=dtype).tobytes()
+            if level is not None:
+                data = zlib.compress(data, level)
+            blocks.append(((start + row, ) + offset[1:], data))
+    return blocks
+
+
+class VirtualArray(object):
+    """
+    Rows of several arrays read as one array. The rows of a selection are resolved
+    with the offsets of the arrays and read from each one. With lengths only the first
+    rows of each array are read, the rows added after are not part of the array.
+    """
+    def __init__(self, arrays: list, lengths: list = None):
+        if lengths is None:
+            lengths = [array.shape[0] for array in arrays]
+        self.arrays = arrays
+        self.offsets = np.cumsum([0] + list(lengths))
+        self.shape = (int(self.offsets[-1]), ) + tuple(arrays[0].shape[1:])
+        self.dtype = arrays[0].dtype
+        self.ndim = len(self.shape)
+        self.chunks = arrays[0].chunks
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, item):
+        if not isinstance(item, tuple):
+            item = (item, )
+        rows, rest = item[0], item[1:]
+        if isinstance(rows, (int, np.integer)):
+            row = rows + self.shape[0] if rows < 0 else rows
+            i = np.searchsorted(self.offsets, row, side="right") - 1
+            if row < 0 or i >= len(self.arrays):
+                raise IndexError("index {} is out of bounds with size {}".format(rows, self.shape[0]))
+            return self.arrays[i][(row - self.offsets[i], ) + rest]
+        elif isinstance(rows, slice) and rows.step in (None, 1):
+            start, stop, _ = rows.indices(self.shape[0])
+            parts = []
+            for i, array in enumerate(self.arrays):
+                init, end = max(start, self.offsets[i]), min(stop, self.offsets[i + 1])
+                if init < end:
+                    parts.append(array[(slice(init - self.offsets[i], end - self.offsets[i]), ) + rest])
+            if len(parts) == 0:
+                return self.arrays[0][(slice(0, 0), ) + rest]
+            return np.concatenate(parts) if len(parts) > 1 else parts[0]
+        else:
+            index = np.arange(self.shape[0])[rows]
+            sources = np.searchsorted(self.offsets, index, side="right") - 1
+            parts = []
+            for i in np.unique(sources):
+                local = index[sources == i] - self.offsets[i]
+                block = self.arrays[i][(slice(local.min(), local.max() + 1), ) + rest]
+                parts.append((sources == i, block[local - local.min()]))
+            result = np.empty((len(index), ) + parts[0][1].shape[1:], dtype=parts[0][1].dtype)
+            for mask, values in parts:
+                result[mask] = values
+            return result
 
 
 class HDF5(AbsDriver):
@@ -32,10 +111,11 @@ class HDF5(AbsDriver):
     def __contains__(self, item):
         return item in self.conn
 
-    def manager(self, chunks: Chunks):
+    def manager(self, chunks: Chunks, groups: list = None):
         # self.chunksize = chunks
-        groups = [(group, self[group]) for group in self.groups]
-        return GroupManager.convert(groups, chunks=chunks)
+        if groups is None:
+            groups = self.groups
+        return GroupManager.convert([(group, self[group]) for group in groups], chunks=chunks)
 
     def open(self):
         if self.conn is None:
@@ -53,8 +133,9 @@ class HDF5(AbsDriver):
         elif dtype == np.dtype("datetime64[ns]"):
             dtype = np.dtype("int8")
 
+        maxshape = (None, ) + tuple(shape[1:]) if level in (self.data_tag, self.staging_tag) else None
         self.conn[level].require_dataset(group, shape, dtype=dtype, chunks=True, exact=True,
-                                         **self.compressor_params)
+                                         maxshape=maxshape, **self.compressor_params)
 
     def destroy(self):
         rm(self.url)
@@ -65,6 +146,7 @@ class HDF5(AbsDriver):
     def set_schema(self, dtypes: np.dtype, idx: list = None, unique_key: str = None):
         if self.metadata_tag in self.conn:
             log.debug("Rewriting dtypes")
+            self.drop_schema(dtypes)
 
         self.conn.require_group(self.metadata_tag)
         self.require_dataset(self.metadata_tag, "dtypes", (len(dtypes), 2), dtype=np.dtype('object'))
@@ -78,10 +160,78 @@ class HDF5(AbsDriver):
             for group, (dtype, _) in dtypes.fields.items():
                 self.require_dataset(self.data_tag, group, shape[group], dtype)
 
+    def resize(self, length: int):
+        for group in self.groups:
+            self[group].resize(length, axis=0)
+
+    def source_attrs(self, url: str) -> dict:
+        with h5py.File(url, mode="r") as f:
+            return dict(f.attrs.items())
+
+    def set_virtual(self, sources: list, shape: Shape):
+        """The groups are HDF5 virtual datasets mapped to the data of each source file"""
+        self.attrs["virtual_sources"] = json.dumps(sources)
+        data = self.conn.require_group(self.data_tag)
+        for group, (dtype, _) in self.dtypes.fields.items():
+            if dtype == np.dtype("O") or dtype.type == np.str_:
+                dtype = h5py.special_dtype(vlen=str)
+            layout = h5py.VirtualLayout(shape=tuple(shape[group]), dtype=dtype)
+            for source in sources:
+                init, end = source["rows"]
+                source_shape = (end - init, ) + tuple(shape[group][1:])
+                layout[init:end] = h5py.VirtualSource(source["url"], "{}/{}".format(self.data_tag, group),
+                                                      shape=source_shape)
+            if group in data:
+                del data[group]
+            data.create_virtual_dataset(group, layout)
+
+    def write_chunks(self, tasks, level: str, workers: int = 1, ordered: bool = True):
+        """
+        HDF5 has one writer. The chunks are compressed in a pool of threads (zlib releases
+        the GIL) and written in order with write_direct_chunk, the tasks that can't be
+        written as whole chunks are written with the normal selection.
+        """
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for group, item, array in tasks:
+                dset = self.conn[level][group]
+                if not self.direct_chunks(dset, item):
+                    while len(pending) > 0:
+                        self.written_bytes += self.write_direct(*pending.popleft())
+                    dset[item] = array
+                    self.count_bytes(array)
+                    continue
+                while len(pending) >= 2 * workers:
+                    self.written_bytes += self.write_direct(*pending.popleft())
+                level_opts = dset.compression_opts if dset.compression == "gzip" else None
+                future = executor.submit(compress_chunks, array, item.start, dset.chunks, dset.dtype, level_opts)
+                pending.append((dset, future))
+            while len(pending) > 0:
+                self.written_bytes += self.write_direct(*pending.popleft())
+
+    @staticmethod
+    def direct_chunks(dset, item: slice) -> bool:
+        if dset.chunks is None or dset.dtype.hasobject or dset.dtype.kind in "SUV":
+            return False
+        if dset.compression not in (None, "gzip") or dset.shuffle or dset.fletcher32 or dset.scaleoffset:
+            return False
+        step = dset.chunks[0]
+        return item.start % step == 0 and (item.stop % step == 0 or item.stop >= dset.shape[0])
+
+    @staticmethod
+    def write_direct(dset, future) -> int:
+        """Write the compressed chunks, returns their bytes"""
+        nbytes = 0
+        for offset, data in future.result():
+            dset.id.write_direct_chunk(offset, data)
+            nbytes += len(data)
+        return nbytes
+
     @property
     def dtypes(self) -> np.dtype:
         if self.metadata_tag in self.conn:
             dtypes = self.conn[self.metadata_tag]["dtypes"]
+            dtypes = [[value.decode("utf-8") if isinstance(value, bytes) else value for value in row] for row in dtypes]
             return np.dtype([(col, np.dtype(dtype)) for col, dtype in dtypes])
 
     def spaces(self) -> list:
@@ -112,19 +262,37 @@ class Zarr(AbsDriver):
     insert_by_rows = False
 
     def __getitem__(self, item):
+        if isinstance(item, str) and not (self.data_tag in self.conn and item in self.conn[self.data_tag]):
+            virtual_sources = self.virtual_sources
+            if virtual_sources is not None:
+                lengths = [end - init for init, end in (source["rows"] for source in virtual_sources)]
+                return VirtualArray([store[self.data_tag][item] for store in self.virtual_stores], lengths=lengths)
         return self.conn[self.data_tag][item]
 
+    @property
+    @cache
+    def virtual_sources(self) -> list:
+        """The sources saved in the attrs, they are read once while the store is open"""
+        return super(Zarr, self).virtual_sources
+
+    @property
+    @cache
+    def virtual_stores(self) -> list:
+        """The stores of the virtual sources, they are opened once"""
+        return [zarr.open(source["url"], mode="r") for source in self.virtual_sources]
+
     def __setitem__(self, key, value):
         self.conn[self.data_tag][key] = value
 
     def __contains__(self, item):
         return item in self.conn
 
-    def manager(self, chunks: Chunks):
+    def manager(self, chunks: Chunks, groups: list = None):
         # self.chunksize = chunks
-        if self.groups is not None:
-            groups = [(group, self[group]) for group in self.groups]
-            return GroupManager.convert(groups, chunks=chunks)
+        if groups is None:
+            groups = self.groups
+        if groups is not None:
+            return GroupManager.convert([(group, self[group]) for group in groups], chunks=chunks)
 
     def open(self):
         if self.conn is None:
@@ -135,6 +303,8 @@ class Zarr(AbsDriver):
     def close(self):
         self.conn = None
         self.attrs = None
+        self.virtual_sources_cache = None
+        self.virtual_stores_cache = None
 
     def require_dataset(self, level: str, group: str, shape: tuple, dtype: np.dtype) -> None:
         if dtype == np.dtype("O"):
@@ -157,6 +327,7 @@ class Zarr(AbsDriver):
     def set_schema(self, dtypes: np.dtype, idx: list = None, unique_key=None):
         if self.metadata_tag in self.conn:
             log.debug("Rewriting dtypes")
+            self.drop_schema(dtypes)
         self.conn.require_group(self.metadata_tag)
         self.require_dataset(self.metadata_tag, "dtypes", (len(dtypes), 2), dtype=np.dtype('object'))
         for i, (group, (dtype, _)) in enumerate(dtypes.fields.items()):
@@ -169,6 +340,26 @@ class Zarr(AbsDriver):
             for group, (dtype, _) in dtypes.fields.items():
                 self.require_dataset(self.data_tag, group, shape[group], dtype)
 
+    def resize(self, length: int):
+        for group in self.groups:
+            self[group].resize((length, ) + self[group].shape[1:])
+
+    def set_virtual(self, sources: list, shape: Shape):
+        """The groups are views of the data of each source, only the sources are saved"""
+        if self.data_tag in self.conn:
+            del self.conn[self.data_tag]
+        self.attrs["virtual_sources"] = json.dumps(sources)
+        self.virtual_sources_cache = None
+        self.virtual_stores_cache = None
+
+    def source_attrs(self, url: str) -> dict:
+        return zarr.open(url, mode="r").attrs.asdict()
+
+    def materialize(self):
+        super(Zarr, self).materialize()
+        self.virtual_sources_cache = None
+        self.virtual_stores_cache = None
+
     @property
     def dtypes(self) -> np.dtype:
         if self.metadata_tag in self.conn:
@@ -225,9 +416,10 @@ class StcArray(AbsDriver):
     def __contains__(self, item):
         return item in self.conn
 
-    def manager(self, chunks: Chunks) -> 'AbsConn':
-        groups = [(group, self[group]) for group in self.groups]
-        return GroupManager.convert(groups, chunks=chunks)
+    def manager(self, chunks: Chunks, groups: list = None) -> 'AbsConn':
+        if groups is None:
+            groups = self.groups
+        return GroupManager.convert([(group, self[group]) for group in groups], chunks=chunks)
 
     def absconn(self) -> 'AbsConn':
         pass
@@ -277,6 +469,209 @@ class StcArray(AbsDriver):
     #    return Shape(_shape)
 
 
+class JsonAttrs(dict):
+    """Attributes saved in a json file, every change is written to the file"""
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                super(JsonAttrs, self).__init__(json.load(f))
+        else:
+            super(JsonAttrs, self).__init__()
+
+    def __setitem__(self, key, value):
+        super(JsonAttrs, self).__setitem__(key, value)
+        self.save()
+
+    def __delitem__(self, key):
+        super(JsonAttrs, self).__delitem__(key)
+        self.save()
+
+    def asdict(self) -> dict:
+        return dict(self)
+
+    def save(self):
+        tmp_path = "{}.tmp".format(self.path)
+        with open(tmp_path, "w") as f:
+            json.dump(self, f)
+        os.replace(tmp_path, self.path)
+
+
+class MemMap(AbsDriver):
+    """
+    Each group is a raw .npy file opened with np.memmap, the dtypes and the attributes are
+    saved in json files. The groups are read as views of the mapped pages, without copies
+    or decompression, and the processes that open the same files share the page cache.
+    """
+    persistent = True
+    ext = "mmap"
+    data_tag = "data"
+    metadata_tag = "metadata"
+    insert_by_rows = False
+
+    def __getitem__(self, item):
+        return self.conn[self.data_tag][item]
+
+    def __setitem__(self, key, value):
+        self.conn[self.data_tag][key][...] = value
+
+    def __contains__(self, item):
+        return item in self.conn
+
+    def manager(self, chunks: Chunks, groups: list = None):
+        if groups is None:
+            groups = self.groups
+        if groups is not None:
+            return GroupManager.convert([(group, self[group]) for group in groups], chunks=chunks)
+
+    def group_path(self, level: str, group: str) -> str:
+        return os.path.join(self.url, level, "{}.npy".format(group))
+
+    def open(self):
+        if self.conn is None:
+            if self.mode == "w" and self.exists():
+                rm(self.url)
+            os.makedirs(os.path.join(self.url, self.data_tag), exist_ok=True)
+            self.attrs = JsonAttrs(os.path.join(self.url, "attrs.json"))
+            self.conn = {self.data_tag: OrderedDict()}
+            mmap_mode = "r" if self.mode == "r" else "r+"
+            dtypes = self.dtypes
+            if dtypes is not None:
+                for group in dtypes.names:
+                    path = self.group_path(self.data_tag, group)
+                    if os.path.exists(path):
+                        self.conn[self.data_tag][group] = np.load(path, mmap_mode=mmap_mode)
+        return self
+
+    def close(self):
+        if self.conn is not None:
+            for arrays in self.conn.values():
+                for array in arrays.values():
+                    if array.mode != "r":
+                        array.flush()
+        self.conn = None
+        self.attrs = None
+
+    def require_dataset(self, level: str, group: str, shape: tuple, dtype: np.dtype) -> None:
+        if dtype.hasobject:
+            raise ValueError("The group {} has the dtype {}, MemMap needs fixed size dtypes".format(group, dtype))
+        arrays = self.conn.setdefault(level, OrderedDict())
+        array = arrays.get(group)
+        if array is not None and array.shape == tuple(shape) and array.dtype == dtype:
+            return
+        os.makedirs(os.path.join(self.url, level), exist_ok=True)
+        arrays[group] = np.lib.format.open_memmap(self.group_path(level, group), mode="w+", dtype=dtype,
+                                                  shape=tuple(shape))
+
+    def destroy(self):
+        rm(self.url)
+
+    def exists(self):
+        return os.path.exists(self.url)
+
+    def set_schema(self, dtypes: np.dtype, idx: list = None, unique_key=None):
+        with open(os.path.join(self.url, "{}.json".format(self.metadata_tag)), "w") as f:
+            json.dump({"dtypes": [(group, dtype.str) for group, (dtype, _) in dtypes.fields.items()]}, f)
+
+    def set_data_shape(self, shape):
+        dtypes = self.dtypes
+        if dtypes is not None:
+            for group, (dtype, _) in dtypes.fields.items():
+                self.require_dataset(self.data_tag, group, shape[group], dtype)
+
+    def resize(self, length: int):
+        """The .npy files can't grow in place, the rows are copied to a new map"""
+        for group in self.groups:
+            array = self[group]
+            if array.shape[0] == length:
+                continue
+            path = self.group_path(self.data_tag, group)
+            tmp_path = "{}.tmp".format(path)
+            resized = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=array.dtype,
+                                                shape=(length, ) + array.shape[1:])
+            rows = min(length, array.shape[0])
+            resized[:rows] = array[:rows]
+            resized.flush()
+            del resized
+            self.conn[self.data_tag][group] = None
+            del array
+            os.replace(tmp_path, path)
+            self.conn[self.data_tag][group] = np.load(path, mmap_mode="r+")
+
+    def chunks_writer(self, data, workers: int = 1, ordered: bool = True, atomic: bool = False):
+        """The batchs are copied to the maps in a pool of threads, the maps don't have chunks
+        so the batchs are not re-sliced. With atomic the files replace the data when all are written"""
+        level = self.staging_tag if atomic else self.data_tag
+        if atomic:
+            self.require_stage()
+
+        def write(smx):
+            for group in smx.batch.groups:
+                self.conn[level][group][smx.slice] = smx.batch[group].to_ndarray()
+
+        pending = OrderedDict()
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for smx in data:
+                    while len(pending) >= 2 * workers:
+                        self._next_done(pending, ordered)
+                    pending[executor.submit(write, smx)] = None
+                    for group in smx.batch.groups:
+                        self.count_bytes(smx.batch.conn[group])
+                while len(pending) > 0:
+                    self._next_done(pending, ordered)
+        except Exception:
+            if atomic:
+                self.drop_stage()
+            raise
+        if atomic:
+            self.commit_stage()
+
+    def require_stage(self):
+        for group, (dtype, _) in self.dtypes.fields.items():
+            self.require_dataset(self.staging_tag, group, self[group].shape, dtype)
+
+    def commit_stage(self):
+        for group, array in self.conn.pop(self.staging_tag, {}).items():
+            array.flush()
+            del array
+            self.conn[self.data_tag][group] = None
+            os.replace(self.group_path(self.staging_tag, group), self.group_path(self.data_tag, group))
+            self.conn[self.data_tag][group] = np.load(self.group_path(self.data_tag, group), mmap_mode="r+")
+        self.drop_stage()
+
+    def drop_stage(self):
+        self.conn.pop(self.staging_tag, None)
+        if os.path.exists(os.path.join(self.url, self.staging_tag)):
+            rm(os.path.join(self.url, self.staging_tag))
+
+    @property
+    def dtypes(self) -> np.dtype:
+        path = os.path.join(self.url, "{}.json".format(self.metadata_tag))
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                dtypes = json.load(f)["dtypes"]
+            return np.dtype([(group, np.dtype(dtype)) for group, dtype in dtypes])
+
+    @property
+    def shape(self) -> Shape:
+        shape = {}
+        for group in self.groups:
+            shape[group] = self[group].shape
+        return Shape(shape)
+
+    def spaces(self) -> list:
+        if self.dtypes is None:
+            return [self.data_tag]
+        return [self.data_tag, self.metadata_tag]
+
+    def cast(self, value):
+        return value
+
+    def absconn(self) -> 'AbsConn':
+        pass
+
+
 class List(AbsDriver):
 
     def __init__(self, *args, dtypes=None, **kwargs):
@@ -289,7 +684,7 @@ class List(AbsDriver):
     def __setitem__(self, item, value):
         self.absconn[item] = value
 
-    def manager(self, chunks: Chunks):
+    def manager(self, chunks: Chunks, groups: list = None):
         group = list(chunks.keys())[0]
         groups = [(group, self.conn)]
         return GroupManager.convert(groups, chunks=chunks)
@@ -28,7 +28,9 @@ class CSV(AbsDriver):
     def absconn(self):
         pass
 
-    def manager(self, chunks: Chunks) -> AbsConn:
+    def manager(self, chunks: Chunks, groups: list = None) -> AbsConn:
+        if groups is not None:
+            return DaskDfConn(self.conn[list(groups)])
         return DaskDfConn(self.conn)
 
     def open(self):
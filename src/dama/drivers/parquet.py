@@ -0,0 +1,170 @@
+import json
+import numpy as np
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from dama.abc.driver import AbsDriver
+from dama.connexions.core import GroupManager
+from dama.connexions.parquet import Table, arrow_schema, to_arrow
+from dama.drivers.core import JsonAttrs
+from dama.utils.core import Chunks, Shape
+from dama.utils.files import rm
+from dama.utils.logger import log_config
+from tqdm import tqdm
+
+log = log_config(__name__)
+__all__ = ['Parquet']
+
+
+class Parquet(AbsDriver):
+    """
+    The groups are the columns of a parquet file, every batch is written as a row group so the
+    row groups are aligned to the chunks and keep the min/max/null count statistics of the columns.
+    The groups with more than one dimension are columns of fixed size lists.
+    """
+    persistent = True
+    ext = "parquet"
+    data_tag = "data"
+    metadata_tag = "metadata"
+    insert_by_rows = True
+    codecs = ("snappy", "gzip", "brotli", "lz4", "zstd")
+
+    def __getitem__(self, item):
+        return self.absconn[item]
+
+    def __setitem__(self, key, value):
+        raise NotImplementedError("The parquet files are written by row groups with batchs_writer")
+
+    def __contains__(self, item):
+        return item == self.data_tag and os.path.exists(self.data_path)
+
+    @property
+    def data_path(self) -> str:
+        return os.path.join(self.url, "{}.parquet".format(self.data_tag))
+
+    @property
+    def metadata_path(self) -> str:
+        return os.path.join(self.url, "{}.json".format(self.metadata_tag))
+
+    def manager(self, chunks: Chunks, groups: list = None):
+        """One read of a row group for each block of rows, only the columns of the groups are read"""
+        if self.conn is None:
+            return None
+        table = self.absconn
+        if groups is not None:
+            table = table.project(groups)
+        return GroupManager.convert_table(table, chunks=chunks)
+
+    @property
+    def absconn(self) -> Table:
+        return Table(self.conn, self.dtypes, self.shapes, path=self.data_path)
+
+    def open(self):
+        if self.conn is None:
+            if self.mode == "w" and self.exists():
+                rm(self.url)
+            os.makedirs(self.url, exist_ok=True)
+            self.attrs = JsonAttrs(os.path.join(self.url, "attrs.json"))
+            self.conn = self.open_file()
+        return self
+
+    def open_file(self):
+        if os.path.exists(self.data_path):
+            return pq.ParquetFile(self.data_path, memory_map=True)
+
+    def close(self):
+        self.conn = None
+        self.attrs = None
+
+    def require_dataset(self, level: str, group: str, shape: tuple, dtype: np.dtype) -> None:
+        pass
+
+    def destroy(self):
+        rm(self.url)
+
+    def exists(self):
+        return os.path.exists(self.url)
+
+    def read_metadata(self) -> dict:
+        if os.path.exists(self.metadata_path):
+            with open(self.metadata_path, "r") as f:
+                return json.load(f)
+        return {"dtypes": None, "shapes": {}}
+
+    def write_metadata(self, metadata: dict):
+        with open(self.metadata_path, "w") as f:
+            json.dump(metadata, f)
+
+    def set_schema(self, dtypes: np.dtype, idx: list = None, unique_key=None):
+        metadata = self.read_metadata()
+        metadata["dtypes"] = [(group, dtype.str) for group, (dtype, _) in dtypes.fields.items()]
+        self.write_metadata(metadata)
+
+    def set_data_shape(self, shape):
+        metadata = self.read_metadata()
+        metadata["shapes"] = {group: list(shape[group][1:]) for group in shape.groups()}
+        self.write_metadata(metadata)
+
+    @property
+    def writer_params(self) -> dict:
+        params = {"write_statistics": True}
+        if self.compressor is not None and self.compressor.codec_id in self.codecs:
+            params["compression"] = self.compressor.codec_id
+            if getattr(self.compressor, "level", None) is not None:
+                params["compression_level"] = self.compressor.level
+        elif self.compressor is not None:
+            log.info("The codec {} is not supported by parquet, using snappy".format(self.compressor.codec_id))
+        return params
+
+    def batchs_writer(self, data, workers: int = 1, ordered: bool = True, atomic: bool = False):
+        """
+        Every batch is a row group of a new file that replaces the data file when all the batchs
+        are written, so the writes are always atomic. The row groups are appended in order,
+        workers and ordered are not used.
+        """
+        schema = arrow_schema(self.dtypes, self.shapes)
+        tmp_path = "{}.tmp".format(self.data_path)
+        self.conn = None
+        try:
+            with pq.ParquetWriter(tmp_path, schema, **self.writer_params) as writer:
+                for smx in tqdm(data, total=data.num_splits()):
+                    columns = [to_arrow(np.asarray(smx.batch[group].to_ndarray())) for group in self.groups]
+                    table = pa.Table.from_arrays(columns, schema=schema)
+                    writer.write_table(table, row_group_size=max(table.num_rows, 1))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            self.conn = self.open_file()
+            raise
+        self.written_bytes += os.path.getsize(tmp_path)
+        os.replace(tmp_path, self.data_path)
+        self.conn = self.open_file()
+
+    def statistics(self) -> list:
+        """(rows, {group: (min, max, null count)}) of every row group"""
+        return self.absconn.statistics
+
+    @property
+    def dtypes(self) -> np.dtype:
+        dtypes = self.read_metadata()["dtypes"]
+        if dtypes is not None:
+            return np.dtype([(group, np.dtype(dtype)) for group, dtype in dtypes])
+
+    @property
+    def shapes(self) -> dict:
+        return {group: tuple(shape) for group, shape in self.read_metadata()["shapes"].items()}
+
+    @property
+    def shape(self) -> Shape:
+        if self.conn is None:
+            return Shape({group: (0, ) + self.shapes.get(group, ()) for group in self.groups})
+        return self.absconn.shape
+
+    def spaces(self) -> list:
+        if self.dtypes is None:
+            return [self.data_tag]
+        return [self.data_tag, self.metadata_tag]
+
+    def cast(self, value):
+        return value
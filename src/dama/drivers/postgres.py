@@ -9,6 +9,7 @@ from dama.abc.conn import AbsConn
 import numpy as np
 import psycopg2
 from collections import OrderedDict
+from tqdm import tqdm
 
 
 log = log_config(__name__)
@@ -32,8 +33,11 @@ class Postgres(AbsDriver):
     #    return self.exists()
 
     def open(self):
-        self.conn = psycopg2.connect(database=self.login.resource, user=self.login.username,
-                                     host=self.login.host, port=self.login.port)
+        if self.login.url is not None:
+            self.conn = psycopg2.connect(self.login.url)
+        else:
+            self.conn = psycopg2.connect(database=self.login.resource, user=self.login.username,
+                                         host=self.login.host, port=self.login.port)
         self.conn.autocommit = False
         self.data_tag = self.login.table
         self.attrs = {}
@@ -46,10 +50,20 @@ class Postgres(AbsDriver):
         self.conn.close()
         self.attrs = None
 
-    def manager(self, chunks: Chunks) -> AbsConn:
-        # self.chunksize = chunks
-        groups = [(group, self[group]) for group in self.groups]
-        return GroupManager.convert(groups, chunks=chunks)
+    def batchs_writer(self, data, workers: int = 1, ordered: bool = True, atomic: bool = False):
+        """All the batchs are loaded with one COPY, the batchs are encoded as csv one by one"""
+        if getattr(data, 'batch_size', 0) > 0:
+            self.absconn.copy_from(tqdm(data, total=data.num_splits()))
+            self.conn.commit()
+        else:
+            super(Postgres, self).batchs_writer(data, workers=workers, ordered=ordered, atomic=atomic)
+
+    def manager(self, chunks: Chunks, groups: list = None) -> AbsConn:
+        """One query for each block of rows reads the columns of the groups"""
+        table = self.absconn
+        if groups is not None:
+            table = table.project(groups)
+        return GroupManager.convert_table(table, chunks=chunks)
 
     @property
     def absconn(self) -> AbsConn:
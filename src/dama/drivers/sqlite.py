@@ -6,6 +6,7 @@ from dama.utils.decorators import cache
 from dama.utils.core import Chunks, Shape
 from dama.connexions.core import GroupManager
 from collections import OrderedDict
+from tqdm import tqdm
 import numpy as np
 import sqlite3
 
@@ -13,21 +14,43 @@ log = log_config(__name__)
 
 
 class Sqlite(AbsDriver):
+    """
+    With bulk the batchs are inserted from the column arrays of the groups, the last row id
+    is kept in memory and the rows are committed every transaction_rows. journal_mode (e.g. WAL),
+    synchronous (e.g. OFF or NORMAL) and cache_size are set as pragmas when the connexion is opened.
+    """
     persistent = True
     ext = 'sqlite3'
     insert_by_rows = True
 
+    def __init__(self, *args, bulk: bool = False, journal_mode: str = None, synchronous: str = None,
+                 cache_size: int = None, transaction_rows: int = 100000, **kwargs):
+        super(Sqlite, self).__init__(*args, **kwargs)
+        self.bulk = bulk
+        self.pragmas = OrderedDict([("journal_mode", journal_mode), ("synchronous", synchronous),
+                                    ("cache_size", cache_size)])
+        self.transaction_rows = transaction_rows
+        self.last_id = None
+
     def __getitem__(self, item):
         return self.absconn[item]
 
     def __setitem__(self, key, value):
-        self.absconn[key] = value
+        if self.bulk is True and isinstance(key, slice) and hasattr(value, 'batch') and \
+                key.start >= self.require_last_id():
+            self.bulk_insert([value])
+        else:
+            self.absconn[key] = value
 
     def __contains__(self, item):
         return self.exists()
 
     def open(self):
         self.conn = sqlite3.connect(self.url, check_same_thread=False)
+        for pragma, value in self.pragmas.items():
+            if value is not None:
+                self.conn.execute("PRAGMA {}={}".format(pragma, value))
+        self.last_id = None
         self.attrs = {}
         if self.mode == "w":
             self.destroy()
@@ -36,11 +59,58 @@ class Sqlite(AbsDriver):
     def close(self):
         self.conn.close()
         self.attrs = None
+        self.last_id = None
+
+    def batchs_writer(self, data, workers: int = 1, ordered: bool = True, atomic: bool = False):
+        if self.bulk is True and getattr(data, 'batch_size', 0) > 0:
+            self.bulk_insert(tqdm(data, total=data.num_splits()))
+        else:
+            super(Sqlite, self).batchs_writer(data, workers=workers, ordered=ordered, atomic=atomic)
+
+    def require_last_id(self) -> int:
+        if self.last_id is None:
+            self.last_id = self.absconn.last_id()
+        return self.last_id
+
+    def bulk_insert(self, batchs):
+        """Insert the batchs at the end of the table, a transaction is committed every
+        transaction_rows rows"""
+        table = self.absconn
+        self.require_last_id()
+        cur = self.conn.cursor()
+        rows = 0
+        try:
+            for smx in batchs:
+                columns = [smx.batch[group].to_ndarray() for group in table.groups]
+                batch_rows = table.insert_columns(columns, cur)
+                for column in columns:
+                    self.count_bytes(column)
+                self.last_id += batch_rows
+                rows += batch_rows
+                if rows >= self.transaction_rows:
+                    self.conn.commit()
+                    rows = 0
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            self.last_id = None
+            raise
+        finally:
+            cur.close()
+
+    def manager(self, chunks: Chunks, groups: list = None):
+        """One query for each block of rows reads the columns of the groups"""
+        table = self.absconn
+        if groups is not None:
+            table = table.project(groups)
+        return GroupManager.convert_table(table, chunks=chunks)
 
-    def manager(self, chunks: Chunks):
-        # self.chunksize = chunks
-        groups = [(group, self[group]) for group in self.groups]
-        return GroupManager.convert(groups, chunks=chunks)
+    def stream(self, batch_size: int, groups: list = None):
+        """Yields the columns of the groups of every batch_size rows from one open cursor"""
+        table = self.absconn
+        if groups is not None:
+            table = table.project(groups)
+        return table.stream(batch_size)
 
     @property
     def absconn(self):
@@ -53,6 +123,7 @@ class Sqlite(AbsDriver):
         return result is not None
 
     def destroy(self):
+        self.last_id = None
         cur = self.conn.cursor()
         try:
             cur.execute("DROP TABLE {name}".format(name= self.login.table))
@@ -3,4 +3,8 @@ class DataDoesNotFound(Exception):
 
 
 class NotChunksFound(Exception):
+    pass
+
+
+class SourceChanged(Exception):
     pass
\ No newline at end of file
@@ -36,10 +36,17 @@ class MLModel:
         return self.fit_fn(*args, **kwargs)
 
     def predict(self, data: AbsConn, output_format_fn=None, output=None, batch_size: int = 258):
+        if isinstance(data, BatchIterator):
+            batch_size = data.batch_size
+            length = data.length
+        else:
+            length = data.size
+
         def _it(data):
             data = self.input_transform(data)
             if batch_size > 0:
-                data = Iterator(data).batchs(chunks=(batch_size, ))
+                if not isinstance(data, BatchIterator):
+                    data = Iterator(data).batchs(chunks=(batch_size, ))
                 for slice_obj in data:
                     batch = slice_obj.batch.to_ndarray()
                     predict = self.predictors(batch)
@@ -50,10 +57,10 @@ class MLModel:
                     predict = self.predictors(batch)
                     yield output_format_fn(predict, output=output)[0]
         if batch_size > 0:
-            return BatchIterator.from_batchs(_it(data), dtypes=data.dtypes, length=data.size,
+            return BatchIterator.from_batchs(_it(data), dtypes=data.dtypes, length=length,
                                              from_batch_size=batch_size, to_slice=True)
         else:
-            return Iterator(_it(data), length=data.size)
+            return Iterator(_it(data), length=length)
 
     def load(self, path):
         return self.load_fn(path)
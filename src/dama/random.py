@@ -1,9 +1,9 @@
 import numpy as np
-from dama.data.it import Iterator
+from dama.data.it import BatchIterator
 
 
 def sampling_size(sampling, stream):
-    if isinstance(sampling, Iterator):
+    if isinstance(stream, BatchIterator):
         counter = stream.unique()
     else:
         u_values, counter = np.unique(stream, return_counts=True)
@@ -5,11 +5,13 @@ import sqlite3
 from collections import OrderedDict
 from dama.utils.decorators import cache
 from dama.utils.logger import log_config
-from dama.utils.numeric_functions import calc_chunks
+from dama.utils.numeric_functions import calc_chunks, plan_chunks, CHUNK_BYTES
+from dama.utils.config import get_settings
 from dask.base import normalize_token
 
 
 log = log_config(__name__)
+settings = get_settings("vars")
 __all__ = ['Hash', 'Shape', 'Chunks', 'Login', 'Metadata']
 
 
@@ -141,9 +143,15 @@ class Chunks(dict):
             return chunks
 
     @staticmethod
-    def build_from_shape(shape: Shape, dtypes: np.dtype, memory_allowed=.9) -> 'Chunks':
-        chunks_dict = calc_chunks(shape, dtypes, memory_allowed=memory_allowed)
-        return Chunks(chunks_dict)
+    def build_from_shape(shape: Shape, dtypes: np.dtype, memory_allowed: float = None, chunk_bytes: int = None,
+                         access: str = "rows", storage: dict = None) -> 'Chunks':
+        """Chunks planned from the bytes per chunk (chunk_bytes in the vars settings),
+        if memory_allowed is given the chunks are calculated from the free memory"""
+        if memory_allowed is not None:
+            return Chunks(calc_chunks(shape, dtypes, memory_allowed=memory_allowed))
+        if chunk_bytes is None:
+            chunk_bytes = int(settings.get("chunk_bytes", CHUNK_BYTES))
+        return Chunks(plan_chunks(shape, dtypes, chunk_bytes=chunk_bytes, access=access, storage=storage))
 
     @property
     def length(self) -> int:
@@ -240,6 +248,11 @@ class Metadata(dict):
     def invalid(self, hash_hex: str):
         self.query("UPDATE {} SET is_valid=? WHERE hash = ?".format(self.name), (False, hash_hex,))
 
+    def update_data(self, hash_hex: str, values: dict):
+        columns = ", ".join("{}=?".format(column) for column in values.keys())
+        self.query("UPDATE {} SET {} WHERE hash = ?".format(self.name, columns),
+                   tuple(values.values()) + (hash_hex, ))
+
     def exists(self, hash_hex: str) -> bool:
         result = self.query("SELECT id FROM {} WHERE hash = ?".format(self.name), (hash_hex, ))
         return len(result) > 0
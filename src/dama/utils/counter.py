@@ -0,0 +1,161 @@
+import numpy as np
+import pandas as pd
+
+
+__all__ = ['ValueCounter', 'ApproxCounter', 'HyperLogLog', 'row_keys', 'hash_keys']
+
+
+def row_keys(arrays: list) -> np.ndarray:
+    """
+    Build a 1d array of keys from the group arrays of a batch. One group is flattened,
+    several groups are joined in a structured array (one field per group). Strings are
+    stored as objects, so the keys of different batchs have the same dtype.
+    """
+    columns = []
+    for array in arrays:
+        array = np.asarray(array)
+        if array.dtype.kind in "US":
+            array = array.astype(object)
+        columns.append(array)
+
+    if len(columns) == 1:
+        return columns[0].reshape(-1)
+
+    keys = np.empty(len(columns[0]), dtype=[("f{}".format(i), c.dtype) for i, c in enumerate(columns)])
+    for i, column in enumerate(columns):
+        keys["f{}".format(i)] = column
+    return keys
+
+
+def hash_keys(arrays: list) -> np.ndarray:
+    """64 bits hash of every row of the group arrays"""
+    if len(arrays) == 1:
+        return pd.util.hash_array(np.asarray(arrays[0]).reshape(-1))
+    df = pd.DataFrame({i: np.asarray(array) for i, array in enumerate(arrays)})
+    return pd.util.hash_pandas_object(df, index=False).values
+
+
+def _key(value):
+    if isinstance(value, np.void):
+        return value.item()
+    return value
+
+
+class ValueCounter(object):
+    """
+    Exact streaming counter of values. The values are kept sorted and every batch
+    is merged with searchsorted, the counts are summed with whole array operations.
+    """
+    def __init__(self):
+        self.values = None
+        self.counts = np.empty(0, dtype=np.int64)
+
+    def update(self, arrays: list):
+        values, counts = np.unique(row_keys(arrays), return_counts=True)
+        self.merge(values, counts)
+
+    def merge(self, values: np.ndarray, counts: np.ndarray):
+        """merge sorted unique values and their counts"""
+        if self.values is None:
+            self.values = values
+            self.counts = counts.astype(np.int64)
+            return
+        elif len(values) == 0:
+            return
+
+        index = np.searchsorted(self.values, values)
+        found = index < len(self.values)
+        found[found] = self.values[index[found]] == values[found]
+        np.add.at(self.counts, index[found], counts[found])
+        new = ~found
+        if new.any():
+            self.values = np.insert(self.values, index[new], values[new])
+            self.counts = np.insert(self.counts, index[new], counts[new])
+
+    @property
+    def distinct(self) -> int:
+        return 0 if self.values is None else len(self.values)
+
+    @property
+    def total(self) -> int:
+        return int(self.counts.sum())
+
+    def most_common(self, n: int = None) -> list:
+        if self.values is None:
+            return []
+        order = np.argsort(self.counts, kind="mergesort")[::-1]
+        if n is not None:
+            order = order[:n]
+        return [(_key(self.values[i]), int(self.counts[i])) for i in order]
+
+    def to_dict(self) -> dict:
+        if self.values is None:
+            return {}
+        return {_key(value): count for value, count in zip(self.values, self.counts)}
+
+
+class HyperLogLog(object):
+    """Distinct count estimation with 2**precision registers"""
+    def __init__(self, precision: int = 14):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = np.zeros(self.m, dtype=np.uint8)
+
+    def update(self, hashes: np.ndarray):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        bits = 64 - self.precision
+        index = (hashes >> np.uint64(bits)).astype(np.int64)
+        rest = hashes & np.uint64((1 << bits) - 1)
+        # the exponent of frexp is the bit length, the rests have less than 53 bits
+        _, bit_length = np.frexp(rest.astype(np.float64))
+        rank = (bits - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other: 'HyperLogLog'):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self) -> int:
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.power(2., -self.registers.astype(np.float64)))
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * m and zeros > 0:
+            estimate = m * np.log(m / float(zeros))
+        return int(round(estimate))
+
+
+class ApproxCounter(object):
+    """
+    Bounded memory counter. The distinct values are estimated with HyperLogLog and the
+    heavy hitters are tracked with a mergeable Misra-Gries summary of capacity values,
+    the counts are underestimated at most by total / (capacity + 1).
+    """
+    def __init__(self, top_k: int = 10, capacity: int = None, precision: int = 14):
+        self.top_k = top_k
+        self.capacity = capacity if capacity is not None else max(10 * top_k, 1000)
+        self.hll = HyperLogLog(precision=precision)
+        self.heavy = ValueCounter()
+        self.total = 0
+
+    def update(self, arrays: list):
+        keys = row_keys(arrays)
+        values, counts = np.unique(keys, return_counts=True)
+        self.hll.update(hash_keys(arrays))
+        self.heavy.merge(values, counts)
+        self.total += len(keys)
+        if self.heavy.distinct > self.capacity:
+            counts = self.heavy.counts
+            cut = np.partition(counts, len(counts) - self.capacity - 1)[len(counts) - self.capacity - 1]
+            keep = counts > cut
+            self.heavy.values = self.heavy.values[keep]
+            self.heavy.counts = counts[keep] - cut
+
+    @property
+    def distinct(self) -> int:
+        return self.hll.count()
+
+    def most_common(self, n: int = None) -> list:
+        return self.heavy.most_common(self.top_k if n is None else n)
+
+    def to_dict(self) -> dict:
+        return dict(self.most_common())
@@ -0,0 +1,53 @@
+import hashlib
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+
+__all__ = ['chunk_digest', 'merkle_root', 'chunks_digests']
+
+LEAF = b'\x00'
+NODE = b'\x01'
+
+
+def chunk_digest(array: np.ndarray, hash_fn: str = 'sha1') -> str:
+    """Digest of the raw buffer of a chunk, the dtype and shape are hashed as a header.
+    Object arrays don't have a buffer, their values are hashed as text"""
+    array = np.asarray(array)
+    hash_obj = getattr(hashlib, hash_fn)()
+    hash_obj.update(LEAF)
+    hash_obj.update("{}{}".format(array.dtype.str, array.shape).encode("utf-8"))
+    if array.dtype.hasobject:
+        array = array.astype(np.str_)
+    hash_obj.update(np.ascontiguousarray(array).view(np.uint8))
+    return hash_obj.hexdigest()
+
+
+def merkle_root(digests: list, hash_fn: str = 'sha1') -> str:
+    """Combine the digests by pairs until there is one, an odd digest goes up unchanged"""
+    if len(digests) == 0:
+        return getattr(hashlib, hash_fn)(NODE).hexdigest()
+    level = list(digests)
+    while len(level) > 1:
+        next_level = []
+        for i in range(0, len(level) - 1, 2):
+            hash_obj = getattr(hashlib, hash_fn)()
+            hash_obj.update(NODE)
+            hash_obj.update(bytes.fromhex(level[i]))
+            hash_obj.update(bytes.fromhex(level[i + 1]))
+            next_level.append(hash_obj.hexdigest())
+        if len(level) % 2 == 1:
+            next_level.append(level[-1])
+        level = next_level
+    return level[0]
+
+
+def chunks_digests(load_fns: list, hash_fn: str = 'sha1', workers: int = None) -> list:
+    """Call every load_fn and hash the returned chunk, hashlib releases the GIL
+    so the chunks are read and hashed in a pool of threads"""
+    def digest(load_fn):
+        return chunk_digest(load_fn(), hash_fn=hash_fn)
+
+    if workers == 1 or len(load_fns) < 2:
+        return [digest(load_fn) for load_fn in load_fns]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(digest, load_fns))
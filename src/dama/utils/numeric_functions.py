@@ -4,7 +4,7 @@ from collections import defaultdict
 import psutil
 import operator as op
 from functools import reduce
-from math import floor, ceil
+from math import floor, ceil, gcd
 
 
 def pearsoncc(x, y):
@@ -200,6 +200,10 @@ def num_splits(length: int, batch_size: int) -> int:
         return 1
 
 
+def lcm(numbers) -> int:
+    return reduce(lambda a, b: a * b // gcd(a, b), (int(number) for number in numbers), 1)
+
+
 def wsr(stream, k):
     heap = []
 
@@ -251,6 +255,92 @@ def wsrj(stream, k):
         yield hq.heappop(reservoir)[1]
 
 
+def wsrj_batch(batchs, k: int, random_state: np.random.RandomState = None):
+    """
+    :type batchs: iterator
+    :param batchs: yields tuples (load_fn, length, weights), load_fn returns a dict of
+    arrays with the batch's items and weights is an array of positive weights
+    or None for uniform weights.
+
+    :type k: int
+    :param k: reservoir size
+
+    weighted reservoir sampling with exponential jumps over batchs. While many items
+    of a batch can enter the reservoir, the keys of the batch are generated at once and
+    merged with argpartition, otherwise the sampler jumps over the cumulative weights
+    and the batchs without items to sample are not loaded. Returns a dict of arrays
+    with the sampled items in stream order or None if the stream is empty.
+    """
+    if k <= 0:
+        return None
+    rnd = np.random if random_state is None else random_state
+    keys = np.empty(0, dtype=float)  # exponential keys E/w, the reservoir keeps the k smallest
+    index = np.empty(0, dtype=int)
+    items = None
+    heap = None
+    skip = None
+    offset = 0
+    for load_fn, length, weights in batchs:
+        if weights is None:
+            weights = np.ones(length, dtype=float)
+        else:
+            weights = np.asarray(weights, dtype=float)
+        total = weights.sum()
+        threshold = keys.max() if len(keys) == k else np.inf
+        if len(keys) < k or threshold * total > length / 8.:
+            batch_keys = rnd.standard_exponential(length) / weights
+            candidates = np.flatnonzero(batch_keys < threshold)
+            if len(candidates) > 0:
+                batch_items = load_fn()
+                keys = np.concatenate([keys, batch_keys[candidates]])
+                index = np.concatenate([index, candidates + offset])
+                new_items = {group: array[candidates] for group, array in batch_items.items()}
+                if items is None:
+                    items = new_items
+                else:
+                    items = {group: np.concatenate([items[group], new_items[group]]) for group in items}
+                if len(keys) > k:
+                    top = np.argpartition(keys, k - 1)[:k]
+                    keys = keys[top]
+                    index = index[top]
+                    items = {group: array[top] for group, array in items.items()}
+            heap = None
+            skip = None
+        else:
+            if skip is None:
+                skip = rnd.standard_exponential() / threshold
+            if skip >= total:
+                skip -= total
+            else:
+                if heap is None:
+                    heap = list(zip(-keys, range(k)))
+                    hq.heapify(heap)
+                batch_items = load_fn()
+                cum_weights = np.cumsum(weights)
+                base = 0.
+                while True:
+                    i = int(np.searchsorted(cum_weights, base + skip))
+                    if i >= length:
+                        skip = base + skip - total
+                        break
+                    weight = weights[i]
+                    key = -np.log(1 - rnd.uniform() * (1 - np.exp(-weight * threshold))) / weight
+                    slot = heap[0][1]
+                    hq.heapreplace(heap, (-key, slot))
+                    keys[slot] = key
+                    index[slot] = i + offset
+                    for group, array in items.items():
+                        array[slot] = batch_items[group][i]
+                    threshold = -heap[0][0]
+                    base = cum_weights[i]
+                    skip = rnd.standard_exponential() / threshold
+        offset += length
+
+    if items is not None:
+        order = np.argsort(index)
+        return {group: array[order] for group, array in items.items()}
+
+
 def nested_shape(chunk, dtypes):
     shapes = {}
     if len(chunk) == len(dtypes):
@@ -282,6 +372,46 @@ def nested_shape_aux(x) -> list:
         return []
 
 
+CHUNK_BYTES = 16 * 2**20
+OBJECT_ITEMSIZE = 64
+
+
+def plan_chunks(shape, dtypes, chunk_bytes: int = CHUNK_BYTES, access: str = "rows", storage: dict = None) -> dict:
+    """
+    Deterministic chunks of about chunk_bytes for every group. With access "rows" the chunks
+    have whole rows and all the groups use the same number of rows, with "columns" the second
+    dim is split in single columns so a column projection only reads its chunks. If the storage
+    chunks are given the chunks are rounded to multiples of them.
+    """
+    if access not in ("rows", "columns"):
+        raise ValueError("access must be rows or columns, not {}".format(access))
+
+    sizes = {}
+    for group, (dtype, _) in dtypes.fields.items():
+        features = list(shape[group][1:])
+        if access == "columns" and len(features) > 0:
+            features[0] = 1
+        itemsize = OBJECT_ITEMSIZE if dtype.hasobject else max(dtype.itemsize, 1)
+        row_bytes = itemsize * int(np.prod(features))
+        sizes[group] = (max(chunk_bytes // max(row_bytes, 1), 1), features)
+    if access == "rows" and len(sizes) > 0:
+        common_rows = min(rows for rows, _ in sizes.values())
+        sizes = {group: (common_rows, features) for group, (_, features) in sizes.items()}
+
+    chunks = {}
+    for group, (rows, features) in sizes.items():
+        if storage is not None and storage.get(group) is not None:
+            storage_chunks = storage[group]
+            rows = max(rows // storage_chunks[0], 1) * storage_chunks[0]
+            features = [max(size // s_size, 1) * s_size for size, s_size in zip(features, storage_chunks[1:])]
+        length = shape[group][0]
+        if length != np.inf:
+            rows = min(rows, int(length))
+        features = [min(size, dim) for size, dim in zip(features, shape[group][1:])]
+        chunks[group] = tuple([rows] + features)
+    return chunks
+
+
 def calc_chunks(shape, dtypes, memory_allowed=1, adj_factor=0.095):
     free_memory = psutil.virtual_memory().free / len(shape.groups())
     chunks = {}
@@ -0,0 +1,106 @@
+import numpy as np
+from collections import OrderedDict
+from multiprocessing import shared_memory
+
+
+__all__ = ['SharedBatch', 'map_shared_batch']
+
+
+class SharedBatch(object):
+    """
+    Group arrays of a batch stored in shared memory blocks. The specs describe
+    each block and can be sent to another process without pickling the data,
+    object arrays can't be shared and travel inside the specs.
+    """
+    def __init__(self, specs: list):
+        self.specs = specs
+        self.blocks = OrderedDict()
+        for group, name, _, _, _ in specs:
+            if name is not None:
+                self.blocks[group] = shared_memory.SharedMemory(name=name)
+
+    @classmethod
+    def from_arrays(cls, arrays: dict) -> 'SharedBatch':
+        specs = []
+        blocks = OrderedDict()
+        for group, array in arrays.items():
+            array = np.asarray(array)
+            if array.dtype.hasobject:
+                specs.append((group, None, array.shape, array.dtype.str, array))
+            else:
+                block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+                blocks[group] = block
+                specs.append((group, block.name, array.shape, array.dtype.str, None))
+        shared_batch = cls.__new__(cls)
+        shared_batch.specs = specs
+        shared_batch.blocks = blocks
+        return shared_batch
+
+    @property
+    def arrays(self) -> OrderedDict:
+        arrays = OrderedDict()
+        for group, name, shape, dtype, payload in self.specs:
+            if name is None:
+                arrays[group] = payload
+            else:
+                arrays[group] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=self.blocks[group].buf)
+        return arrays
+
+    def update(self, arrays: dict) -> dict:
+        """write the arrays in the shared blocks, return the object arrays that
+        must be sent back by value"""
+        objects = {}
+        shared_arrays = self.arrays
+        for group, name, shape, dtype, _ in self.specs:
+            array = np.asarray(arrays[group])
+            if array.shape != tuple(shape) or array.dtype != np.dtype(dtype):
+                raise ValueError("The group {} changed from {} {} to {} {}".format(
+                    group, tuple(shape), np.dtype(dtype), array.shape, array.dtype))
+            if name is None:
+                objects[group] = array
+            elif not np.shares_memory(array, shared_arrays[group]):
+                shared_arrays[group][...] = array
+        return objects
+
+    def to_arrays(self, objects: dict = None) -> OrderedDict:
+        arrays = OrderedDict()
+        for group, array in self.arrays.items():
+            if objects is not None and group in objects:
+                arrays[group] = objects[group]
+            else:
+                arrays[group] = np.array(array, copy=True)
+        return arrays
+
+    def close(self):
+        for block in self.blocks.values():
+            try:
+                block.close()
+            except BufferError:
+                # views of the block are still alive (e.g. in a traceback), the
+                # mapping is released when they are collected
+                pass
+
+    def unlink(self):
+        for block in self.blocks.values():
+            block.unlink()
+
+
+def _apply(fn, shared_batch: SharedBatch) -> dict:
+    arrays = shared_batch.arrays
+    result = fn(arrays)
+    if not isinstance(result, dict):
+        if len(arrays) > 1:
+            raise ValueError("fn must return a dict of groups, the batch has {} groups".format(len(arrays)))
+        result = {list(arrays.keys())[0]: result}
+    return shared_batch.update(result)
+
+
+def map_shared_batch(fn, specs: list) -> dict:
+    """apply fn to the arrays of a SharedBatch and write the result in place,
+    this function runs in the worker process"""
+    shared_batch = SharedBatch(specs)
+    try:
+        return _apply(fn, shared_batch)
+    finally:
+        shared_batch.close()
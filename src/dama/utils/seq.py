@@ -1,4 +1,6 @@
 from itertools import islice, chain
+import queue
+import threading
 
 
 def grouper_chunk(n, iterable):
@@ -11,3 +13,43 @@ def grouper_chunk(n, iterable):
         except StopIteration:
             return
         yield chain((first_el,), chunk)
+
+
+def _put(buffer: queue.Queue, item, stop: threading.Event, timeout: float = .1) -> bool:
+    while not stop.is_set():
+        try:
+            buffer.put(item, timeout=timeout)
+        except queue.Full:
+            continue
+        return True
+    return False
+
+
+def prefetch(iterable, size: int = 1):
+    "prefetch(it, 2) --> the elems of it, read in a background thread that keeps up to 2 elems ready"
+    buffer = queue.Queue(maxsize=max(size, 1))
+    stop = threading.Event()
+
+    def worker():
+        try:
+            for elem in iterable:
+                if not _put(buffer, ("elem", elem), stop):
+                    return
+        except BaseException as e:
+            _put(buffer, ("error", e), stop)
+        else:
+            _put(buffer, ("end", None), stop)
+
+    thread = threading.Thread(target=worker, name="prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            kind, value = buffer.get()
+            if kind == "end":
+                break
+            elif kind == "error":
+                raise value
+            yield value
+    finally:
+        stop.set()
+        thread.join()
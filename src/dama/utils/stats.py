@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+from dama.utils.counter import HyperLogLog, hash_keys
+
+
+__all__ = ['QuantileSketch', 'GroupStats']
+
+
+class QuantileSketch(object):
+    """
+    Mergeable quantile sketch (KLL compactors). Every level keeps at most k sorted values,
+    when a level is full one of each two values goes to the next level with twice the weight.
+    """
+    def __init__(self, k: int = 512, seed: int = 0):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self.random_state = np.random.RandomState(seed)
+
+    def update(self, values: np.ndarray):
+        values = np.asarray(values, dtype=np.float64).reshape(-1)
+        values = values[~np.isnan(values)]
+        self.levels[0] = np.concatenate((self.levels[0], values))
+        self.compress()
+
+    def merge(self, other: 'QuantileSketch'):
+        for level, values in enumerate(other.levels):
+            if level < len(self.levels):
+                self.levels[level] = np.concatenate((self.levels[level], values))
+            else:
+                self.levels.append(values.copy())
+        self.compress()
+
+    def compress(self):
+        level = 0
+        while level < len(self.levels):
+            values = self.levels[level]
+            if len(values) > self.k:
+                values = np.sort(values)
+                keep = values[len(values) - len(values) % 2:]
+                offset = self.random_state.randint(2)
+                promoted = values[offset:len(values) - len(keep):2]
+                self.levels[level] = keep
+                if level + 1 == len(self.levels):
+                    self.levels.append(promoted)
+                else:
+                    self.levels[level + 1] = np.concatenate((self.levels[level + 1], promoted))
+            level += 1
+
+    @property
+    def count(self) -> int:
+        return int(sum(len(values) << level for level, values in enumerate(self.levels)))
+
+    def quantile(self, q: list) -> np.ndarray:
+        values = np.concatenate(self.levels)
+        if len(values) == 0:
+            return np.full(len(q), np.nan)
+        weights = np.concatenate([np.full(len(values), 2 ** level, dtype=np.float64)
+                                  for level, values in enumerate(self.levels)])
+        order = np.argsort(values, kind="mergesort")
+        cum_weights = np.cumsum(weights[order])
+        index = np.searchsorted(cum_weights, np.asarray(q) * cum_weights[-1], side="left")
+        return values[order][np.minimum(index, len(values) - 1)]
+
+
+class GroupStats(object):
+    """
+    Statistics of a group that can be computed by chunks and merged: moments (Chan et al.),
+    min/max, non zero and non nan counts, quantiles for 1d numeric groups and the distinct
+    values of the other groups.
+    """
+    def __init__(self, numeric: bool, quantiles: bool = True):
+        self.numeric = numeric
+        self.count = 0
+        self.nonan = 0
+        self.nonzero = 0
+        self.n = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self.min = np.nan
+        self.max = np.nan
+        self.sketch = QuantileSketch() if numeric and quantiles else None
+        self.hll = None if numeric else HyperLogLog()
+
+    def update(self, array: np.ndarray) -> 'GroupStats':
+        array = np.asarray(array)
+        self.count += array.size
+        if self.numeric:
+            values = array.astype(np.float64, copy=False).reshape(-1)
+            notnan = values[~np.isnan(values)]
+            self.nonan += len(notnan)
+            self.nonzero += int(np.count_nonzero(values))
+            if len(notnan) > 0:
+                other = GroupStats(numeric=True, quantiles=False)
+                other.n = len(notnan)
+                other.mean = float(notnan.mean())
+                other.m2 = float(((notnan - other.mean) ** 2).sum())
+                other.min = float(notnan.min())
+                other.max = float(notnan.max())
+                self.merge_moments(other)
+            if self.sketch is not None:
+                self.sketch.update(notnan)
+        else:
+            values = array.reshape(-1)
+            nulls = pd.isnull(values)
+            self.nonan += int(len(values) - nulls.sum())
+            if nulls.any():
+                values = values.copy()
+                values[nulls] = ''
+            self.hll.update(hash_keys([values]))
+        return self
+
+    def merge_moments(self, other: 'GroupStats'):
+        n = self.n + other.n
+        if n == 0:
+            return
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self.m2 += other.m2 + delta ** 2 * self.n * other.n / n
+        self.n = n
+        self.min = np.nanmin([self.min, other.min])
+        self.max = np.nanmax([self.max, other.max])
+
+    def merge(self, other: 'GroupStats') -> 'GroupStats':
+        self.count += other.count
+        self.nonan += other.nonan
+        self.nonzero += other.nonzero
+        if self.numeric:
+            self.merge_moments(other)
+            if self.sketch is not None and other.sketch is not None:
+                self.sketch.merge(other.sketch)
+        else:
+            self.hll.merge(other.hll)
+        return self
+
+    @property
+    def std(self) -> float:
+        return np.sqrt(self.m2 / self.n) if self.n > 0 else np.nan
+
+    def quantile(self, q: list) -> np.ndarray:
+        return self.sketch.quantile(q)
+
+    @property
+    def distinct(self) -> int:
+        return self.hll.count()
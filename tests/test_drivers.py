@@ -2,14 +2,17 @@ import unittest
 import numpy as np
 import pandas as pd
 import os
-from dama.drivers.core import Memory, HDF5, Zarr
+from dama.drivers.core import Memory, HDF5, Zarr, MemMap
 from dama.utils.core import Shape, Login, Chunks
 from dama.drivers.postgres import Postgres
 from dama.drivers.sqlite import Sqlite
 from dama.drivers.csv import CSV
-from dama.utils.files import build_path
+from dama.utils.files import build_path, rm
 from dama.utils.files import check_or_create_path_dir
 from dama.data.ds import Data
+from dama.data.it import Iterator
+from dama.connexions.core import GroupManager
+from dama.fmtypes import DEFAUL_GROUP_NAME
 
 
 TMP_PATH = check_or_create_path_dir(os.path.dirname(os.path.abspath(__file__)), 'dama_data_test')
@@ -96,9 +99,81 @@ class TestDriver(unittest.TestCase):
                 self.assertEqual(self.driver["c2"].dtype, np.dtype("datetime64[ns]"))
 
 
+class TestChunksWriter(unittest.TestCase):
+    def test_zarr_workers(self):
+        x = np.random.rand(1000, 3)
+        y = np.arange(1000)
+        for atomic in (False, True):
+            with Data(name="test", driver=Zarr(path=TMP_PATH), metadata_path=TMP_PATH) as data:
+                data.from_data({"x": x, "y": y}, with_hash=None)
+                batchs = Iterator(data).batchs(chunks=(37, ))
+                with Data(name="test_w", driver=Zarr(path=TMP_PATH), metadata_path=TMP_PATH) as data_w:
+                    data_w.from_data(batchs, workers=4, ordered=False, atomic=atomic)
+                    self.assertEqual((data_w["x"].to_ndarray() == x).all(), True)
+                    self.assertEqual((data_w["y"].to_ndarray() == y).all(), True)
+                    self.assertEqual(data_w.driver.spaces(), ["data", "metadata"])
+                    data_w.destroy()
+                data.destroy()
+
+    def test_hdf5_direct_chunks(self):
+        from numcodecs import GZip
+        x = np.random.rand(1000, 7)
+        driver = HDF5(path=TMP_PATH, compressor=GZip(level=5), mode="w")
+        driver.build_url("test_chunks")
+        with driver:
+            driver.conn.require_group(driver.data_tag)
+            driver.conn[driver.data_tag].create_dataset(DEFAUL_GROUP_NAME, (1000, 7), dtype=x.dtype, chunks=(64, 4),
+                                                        maxshape=(None, 7), **driver.compressor_params)
+            tasks = driver.chunk_tasks(Iterator(x).batchs(chunks=(37, )))
+            driver.write_chunks(tasks, driver.data_tag, workers=4)
+            self.assertEqual((driver[DEFAUL_GROUP_NAME][:] == x).all(), True)
+            driver.destroy()
+
+    def test_hdf5_atomic_append(self):
+        x = np.random.rand(100, 3)
+        with Data(name="test", driver=Zarr(path=TMP_PATH), metadata_path=TMP_PATH) as data:
+            data.from_data({"x": x[:50]}, with_hash=None)
+            batchs = Iterator(data).batchs(chunks=(10, ))
+            with Data(name="test_w", driver=HDF5(path=TMP_PATH), chunks=Chunks({"x": (10, 3)}),
+                      metadata_path=TMP_PATH) as data_w:
+                data_w.from_data(batchs, workers=2, atomic=True)
+                data_w.append({"x": x[50:]})
+                self.assertEqual((data_w["x"].to_ndarray() == x).all(), True)
+                self.assertEqual(data_w.hash, data_w.calc_hash(with_hash="sha1"))
+                data_w.destroy()
+            data.destroy()
+
+
+class TestMemMap(unittest.TestCase):
+    def test_zero_copy(self):
+        x = np.random.rand(100, 3)
+        y = np.arange(100)
+        chunks = Chunks({"x": (10, 3), "y": (10, )})
+        with Data(name="test_mmap", driver=MemMap(path=TMP_PATH, mode="w"), metadata_path=TMP_PATH,
+                  chunks=chunks) as data:
+            data.from_data({"x": x, "y": y})
+            self.assertEqual((data["x"].to_ndarray() == x).all(), True)
+            self.assertEqual(np.shares_memory(data["x"].to_ndarray(), data.driver["x"]), True)
+            self.assertEqual(np.shares_memory(data["x"][10:20].to_ndarray(), data.driver["x"]), True)
+            for batch in Iterator(data).batchs(chunks=(25, )):
+                self.assertEqual(np.shares_memory(batch.batch["y"].to_ndarray(), data.driver["y"]), True)
+            data.append({"x": x[:5], "y": y[:5]})
+            self.assertEqual((data["y"].to_ndarray()[100:] == y[:5]).all(), True)
+            hash_hex = data.hash
+
+        with Data(name="test_mmap", driver=MemMap(path=TMP_PATH, mode="r"), metadata_path=TMP_PATH,
+                  auto_chunks=True) as data:
+            self.assertEqual(data.shape["x"], (105, 3))
+            self.assertEqual(data.shape["y"], (105, ))
+            self.assertEqual(data.hash, hash_hex)
+            self.assertEqual(data.verify(), True)
+            data.destroy()
+
+
 class TestGroupManager(unittest.TestCase):
 
     def setUp(self):
+        self.urls = []
         self.driver = Memory()
 
         with self.driver:
@@ -109,6 +184,10 @@ class TestGroupManager(unittest.TestCase):
             self.driver["c1"][0:10] = cast(array_c1)
             self.driver["c2"][0:10] = cast(array_c2)
 
+    def tearDown(self):
+        for url in self.urls:
+            rm(url)
+
     def test_rename(self):
         with self.driver:
             manager = self.driver.manager(chunks)
@@ -170,6 +249,111 @@ class TestGroupManager(unittest.TestCase):
             self.assertEqual((data.data["c0"].to_ndarray() == array_c0 + 1).all(), True)
 
 
+    def test_filter(self):
+        with self.driver:
+            manager = self.driver.manager(chunks)
+            filtered = manager[(manager["c0"] > 2) & (manager["c1"] < 9)]
+            self.assertEqual(filtered["c0"].to_ndarray().tolist(), [3, 4, 5, 6, 7])
+            self.assertEqual(filtered.chunksize["c0"], (5, ))
+            filtered = manager[~(manager["c0"] > 2)]
+            self.assertEqual(filtered["c1"].to_ndarray().tolist(), [1., 2., 3.])
+
+    def test_compress_chunks(self):
+        x = np.random.rand(100, 3)
+        y = np.arange(100)
+        manager = GroupManager.convert({"x": x, "y": y}, chunks=Chunks({"x": (30, 3), "y": (20, )}))
+        self.assertEqual((manager["y"] > 49).sum().compute(), 50)
+        filtered = manager.compress(manager.conn["y"] % 7 == 0)
+        self.assertEqual(filtered.conn["x"].chunks[0], (5, 4, 4, 2))
+        self.assertEqual(filtered.conn["y"].chunks[0], (3, 3, 3, 3, 3))
+        self.assertEqual((filtered["x"].to_ndarray() == x[y % 7 == 0]).all(), True)
+        self.assertEqual((filtered["y"].to_ndarray() == y[y % 7 == 0]).all(), True)
+
+    def test_filter_series(self):
+        y = pd.Series(np.arange(20))
+        manager = GroupManager.convert({"y": y}, chunks=Chunks({"y": (5, )}))
+        self.assertEqual(len(manager.sources), 0)
+        filtered = manager[manager["y"] > 15]
+        self.assertEqual(filtered["y"].to_ndarray().tolist(), [16, 17, 18, 19])
+
+    def test_filter_sql(self):
+        driver = Sqlite(path=TMP_PATH, login=Login(table="test_filter"), mode="w")
+        driver.build_url("test_filter")
+        self.urls.append(driver.url)
+        with driver:
+            driver.set_schema(np.dtype([("c0", int), ("c1", float)]))
+            driver.absconn.insert(np.concatenate((array_c0.reshape(-1, 1), array_c1.reshape(-1, 1)), axis=1))
+            manager = driver.manager(chunks)
+            predicate = (manager["c0"] > 2) & (manager["c1"] < 9)
+            self.assertEqual(predicate.to_sql("?"), ("(c0 > ?) AND (c1 < ?)", (2, 9)))
+            filtered = manager[predicate]
+            self.assertEqual(filtered.sources["c0"].query_parts["where"], predicate.to_sql("?"))
+            self.assertEqual(filtered.shape["c0"], (5, ))
+            self.assertEqual(filtered["c0"].to_ndarray().tolist(), [3, 4, 5, 6, 7])
+            driver.destroy()
+
+    def test_projection_sql(self):
+        driver = Sqlite(path=TMP_PATH, login=Login(table="test_projection"), mode="w")
+        driver.build_url("test_projection")
+        self.urls.append(driver.url)
+        with driver:
+            driver.set_schema(np.dtype([("c0", int), ("c1", float)]))
+            driver.absconn.insert(np.concatenate((array_c0.reshape(-1, 1), array_c1.reshape(-1, 1)), axis=1))
+            queries = []
+            driver.conn.set_trace_callback(queries.append)
+            manager = driver.manager(Chunks({"c0": (4, ), "c1": (4, )}), groups=["c1"])
+            self.assertEqual(manager.groups, ("c1", ))
+            self.assertEqual((manager.to_ndarray() == array_c1).all(), True)
+            selects = [query for query in queries if query.startswith("SELECT id,c")]
+            self.assertEqual(len(selects), 3)
+            self.assertEqual(all(query.startswith("SELECT id,c1 FROM") for query in selects), True)
+            driver.destroy()
+
+    def test_keyset_sql(self):
+        driver = Sqlite(path=TMP_PATH, login=Login(table="test_keyset"), mode="w")
+        driver.build_url("test_keyset")
+        self.urls.append(driver.url)
+        with driver:
+            driver.set_schema(np.dtype([("c0", int), ("c1", float)]))
+            driver.absconn.insert(np.concatenate((array_c0.reshape(-1, 1), array_c1.reshape(-1, 1)), axis=1))
+            driver.conn.execute("DELETE FROM test_keyset WHERE c0 IN (2, 5)")
+            queries = []
+            driver.conn.set_trace_callback(queries.append)
+            manager = driver.manager(Chunks({"c0": (3, ), "c1": (3, )}))
+            c0 = np.asarray([0, 1, 3, 4, 6, 7, 8, 9])
+            self.assertEqual((manager["c0"].to_ndarray() == c0).all(), True)
+            self.assertEqual("SELECT id,c0,c1 FROM test_keyset WHERE id > 8 ORDER BY id LIMIT 2" in queries, True)
+            self.assertEqual(any("OFFSET" in query for query in queries), False)
+            del queries[:]
+            self.assertEqual((driver.absconn[3:6] == np.asarray([[4, 5], [6, 7], [7, 8]])).all(), True)
+            self.assertEqual(any(query.startswith("SELECT COUNT(*) FROM test_keyset") for query in queries), False)
+            self.assertEqual(driver.absconn[6:20].shape, (2, 2))
+            del queries[:]
+            batchs = list(driver.stream(3, groups=["c0"]))
+            self.assertEqual([batch["c0"].tolist() for batch in batchs], [[0, 1, 3], [4, 6, 7], [8, 9]])
+            self.assertEqual(len([query for query in queries if query.startswith("SELECT c0 FROM")]), 1)
+            driver.conn.execute("INSERT INTO test_keyset (c0, c1) VALUES (10, 11)")
+            self.assertEqual(driver.manager(Chunks({"c0": (3, ), "c1": (3, )})).shape["c0"], (9, ))
+            driver.destroy()
+
+    def test_bulk_sql(self):
+        driver = Sqlite(path=TMP_PATH, login=Login(table="test_bulk"), mode="w", bulk=True, journal_mode="WAL",
+                        synchronous="OFF", transaction_rows=4)
+        with Data(name="test_bulk", driver=driver, metadata_path=TMP_PATH,
+                  chunks=Chunks({"c0": (3, ), "c1": (3, ), "c2": (3, )})) as data:
+            self.urls.append(driver.url)
+            queries = []
+            driver.conn.set_trace_callback(queries.append)
+            data.from_data({"c0": array_c0, "c1": array_c1, "c2": array_c2}, with_hash=None)
+            self.assertEqual(driver.last_id, 10)
+            self.assertEqual(len([query for query in queries if query.startswith("SELECT max(id)")]), 1)
+            self.assertEqual(driver.conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+            self.assertEqual((data["c0"].to_ndarray() == array_c0).all(), True)
+            self.assertEqual((data["c1"].to_ndarray() == array_c1).all(), True)
+            self.assertEqual((data["c2"].to_ndarray() == array_c2).all(), True)
+            data.destroy()
+
+
 class TestDriverCSV(unittest.TestCase):
     def setUp(self):
         self.array = np.asarray([
@@ -2,6 +2,7 @@ import unittest
 import numpy as np
 import pandas as pd
 from io import StringIO
+from collections import OrderedDict
 import os
 from dama.data.ds import Data
 from dama.data.it import Iterator
@@ -14,6 +15,7 @@ from dama.fmtypes import DEFAUL_GROUP_NAME
 from dama.utils.files import check_or_create_path_dir
 from dama.utils.core import Chunks
 from dama.utils.core import Metadata, Login
+from dama.exceptions import SourceChanged
 from dama.utils.config import get_settings
 from dama.utils.miscellaneous import to_libsvm
 import psycopg2
@@ -24,15 +26,23 @@ try:
     driver = Postgres(login=Login(username="alejandro", resource="ml", host="/var/run/postgresql/", port=5432))
     driver.open()
     driver.close()
+    psql_server = True
 except (ImportError, psycopg2.OperationalError):
     from dama.drivers.core import Memory as Postgres
+    psql_server = False
 
 
 settings = get_settings("vars")
+PSQL_DSN = os.environ.get("DAMA_POSTGRES_DSN")
 TMP_PATH = check_or_create_path_dir(os.path.dirname(os.path.abspath(__file__)), 'dama_data_test')
 np.random.seed(0)
 
 
+def range_loader(item):
+    init = int(item) * 10
+    return pd.DataFrame({"a": np.arange(init, init + 10), "b": np.arange(init, init + 10) * .5})
+
+
 class TestDataset(unittest.TestCase):
     def setUp(self):
         num_features = 10
@@ -206,8 +216,117 @@ class TestDataset(unittest.TestCase):
     def test_hash(self):
         with Data(name="test0", chunks=(20, )) as data:
             data.from_data(np.ones(100))
-            self.assertEqual(data.hash, "sha1.27274efa700ba3dd5808d7abe8066dd506956538")
-            self.assertEqual(data.calc_hash(with_hash='md5'), "md5.b12a9d5e5979b7978932fba4392bfb3c")
+            self.assertEqual(data.hash, "sha1.772ecfce4d9e577483ef14b0d331ac2cedaa38a5")
+            self.assertEqual(data.calc_hash(with_hash='md5'), "md5.fdfe85ad8b9c1c94fa702ebcaeb28acb")
+            data.destroy()
+
+    def test_changed_chunks(self):
+        with Data(name="test0", driver=Zarr(path=TMP_PATH), chunks=(20, ), metadata_path=TMP_PATH) as data:
+            data.from_data({"x": np.ones(100), "y": np.arange(100)})
+            self.assertEqual(len(data.chunks_hash["groups"]["x"]), 5)
+            self.assertEqual(data.verify(), True)
+            data.driver["y"][45] = -1
+            data.clean_data_cache()
+            self.assertEqual(data.changed_chunks(), {"y": [slice(40, 60)]})
+            self.assertEqual(data.verify(), False)
+            self.assertNotEqual(data.calc_hash(with_hash="sha1"), data.hash)
+            data.destroy()
+
+    def test_hash_other_chunks(self):
+        with Data(name="test0", driver=Zarr(path=TMP_PATH), chunks=(20, ), metadata_path=TMP_PATH) as data:
+            data.from_data({"x": np.ones(100), "y": np.arange(100)})
+            hash_hex = data.hash
+
+        with Data(name="test0", driver=Zarr(path=TMP_PATH, mode="r"), chunks=(30, ),
+                  metadata_path=TMP_PATH) as data:
+            self.assertEqual(data.chunks_hash["rows"], {"x": 20, "y": 20})
+            self.assertEqual(data.verify(), True)
+            self.assertEqual(data.calc_hash(with_hash="sha1"), hash_hex)
+            data.destroy()
+
+    def test_append(self):
+        x = np.arange(100)
+        y = np.random.rand(100, 3)
+        chunks = Chunks({"x": (10, ), "y": (10, 3)})
+        with Data(name="test0", driver=Zarr(path=TMP_PATH), chunks=chunks, metadata_path=TMP_PATH) as data:
+            data.from_data({"x": x[:35], "y": y[:35]})
+            data.append({"x": x[35:62], "y": y[35:62]})
+            data.append({"x": x[62:], "y": y[62:]})
+            self.assertEqual(data.shape, (100, 4))
+            self.assertEqual((data["x"].to_ndarray() == x).all(), True)
+            self.assertEqual((data["y"].to_ndarray() == y).all(), True)
+            self.assertEqual(data.hash, data.calc_hash(with_hash="sha1"))
+            with Metadata(data.metadata_driver) as metadata:
+                self.assertEqual(metadata.exists(data.hash), True)
+            with self.assertRaises(ValueError):
+                data.append({"z": x})
+            data.destroy()
+
+    def test_append_without_hash(self):
+        x = np.arange(100)
+        with Data(name="test0", driver=Zarr(path=TMP_PATH), chunks=(10, ), metadata_path=TMP_PATH) as data:
+            data.from_data({"x": x[:50]})
+            old_hash = data.hash
+            data.append({"x": x[50:]}, with_hash=None)
+            self.assertEqual(data.hash, None)
+            self.assertEqual(data.chunks_hash, None)
+            with Metadata(data.metadata_driver) as metadata:
+                self.assertEqual(metadata.exists(old_hash), False)
+
+        with Data(name="test0", driver=Zarr(path=TMP_PATH, mode="r"), metadata_path=TMP_PATH,
+                  auto_chunks=True) as data:
+            self.assertEqual(data.hash, None)
+            self.assertEqual((data["x"].to_ndarray() == x).all(), True)
+            data.destroy()
+
+    def test_append_other_chunks(self):
+        x = np.arange(100)
+        y = np.random.rand(100, 3)
+        with Data(name="test0", driver=Zarr(path=TMP_PATH), chunks=Chunks({"x": (6, ), "y": (4, 3)}),
+                  metadata_path=TMP_PATH) as data:
+            data.from_data({"x": x[:35], "y": y[:35]})
+
+        with Data(name="test0", driver=Zarr(path=TMP_PATH), chunks=Chunks({"x": (30, ), "y": (30, 3)}),
+                  metadata_path=TMP_PATH) as data:
+            data.append({"x": x[35:], "y": y[35:]})
+            self.assertEqual((data["x"].to_ndarray() == x).all(), True)
+            self.assertEqual((data["y"].to_ndarray() == y).all(), True)
+            self.assertEqual(data.chunks_hash["rows"], {"x": 6, "y": 4})
+            self.assertEqual(data.hash, data.calc_hash(with_hash="sha1"))
+            self.assertEqual(data.verify(), True)
+            data.destroy()
+
+    def test_chunks_layout(self):
+        with Data(name="test0", driver=Zarr(path=TMP_PATH), chunks=(20, ), metadata_path=TMP_PATH) as data:
+            data.from_data(np.ones(100))
+            self.assertEqual(data.chunks_layout["chunks"], {DEFAUL_GROUP_NAME: [20]})
+
+        with Data(name="test0", driver=Zarr(path=TMP_PATH, mode="r"), auto_chunks=True,
+                  metadata_path=TMP_PATH) as data:
+            self.assertEqual(data.chunksize, {DEFAUL_GROUP_NAME: (20, )})
+
+        with Data(name="test0", driver=Zarr(path=TMP_PATH), metadata_path=TMP_PATH) as data:
+            chunks = data.plan_chunks(access="columns", chunk_bytes=80)
+            self.assertEqual(chunks[DEFAUL_GROUP_NAME][0] % data.driver[DEFAUL_GROUP_NAME].chunks[0], 0)
+            self.assertEqual(data.chunks_layout["access"], "columns")
+            data.destroy()
+
+    def test_stadistics(self):
+        x = np.arange(100, dtype=float)
+        x[::10] = np.nan
+        s = np.array(["a", "b", None, "c"] * 25, dtype=object)
+        with Data(name="test0", driver=Zarr(path=TMP_PATH), chunks=(20, ), metadata_path=TMP_PATH) as data:
+            data.from_data({"x": x, "s": s})
+            table = data.stadistics()
+            self.assertEqual(data.stadistics_cache["hash"], data.hash)
+            x_row, s_row = data.stadistics_cache["table"]
+            self.assertEqual(x_row[:2], ["x", round(np.nanmean(x), 3)])
+            self.assertEqual(x_row[2], round(np.nanstd(x), 3))
+            self.assertEqual(x_row[3], 1.0)
+            self.assertEqual(x_row[7], 99.0)
+            self.assertEqual(x_row[8:10], [100, 90])
+            self.assertEqual(s_row[9:11], [75, 4])
+            self.assertEqual(data.stadistics(), table)
             data.destroy()
 
     def test_empty_hash(self):
@@ -440,6 +559,37 @@ class TestDataset(unittest.TestCase):
             data.from_loader(urls, loader_fn, npartitions=3)
             self.assertEqual(data[:10].to_df().shape, (10, 2))
 
+    def test_from_loader_workers(self):
+        urls = [str(i) for i in range(7)]
+        with Data(name="test_loader", driver=Zarr(mode="w", path=TMP_PATH), metadata_path=TMP_PATH,
+                  chunks=(8,)) as data:
+            data.from_loader(urls, range_loader, npartitions=4, workers=2)
+            self.assertEqual(data.shape["a"], (70,))
+            self.assertEqual(data["a"].to_ndarray().tolist(), list(range(70)))
+            hash_value = data.hash
+            data.from_loader(urls, range_loader, npartitions=4, workers=2, rows_per_item=10)
+            self.assertEqual(data["b"].to_ndarray().tolist(), (np.arange(70) * .5).tolist())
+            self.assertEqual(data.hash, hash_value)
+            data.destroy()
+
+    def test_from_loader_schema(self):
+        urls = [str(i) for i in range(3)]
+        with Data(name="test_loader", driver=Zarr(mode="w", path=TMP_PATH), metadata_path=TMP_PATH,
+                  chunks=(8,)) as data:
+            data.from_data({"x": np.ones(50)})
+            data.from_loader(urls, range_loader)
+            self.assertEqual(data.groups, ("a", "b"))
+            self.assertEqual(data.shape["a"], (30,))
+            self.assertEqual(data["a"].to_ndarray().tolist(), list(range(30)))
+            data.from_loader(urls, lambda item: pd.DataFrame({"a": np.arange(10) + .5, "b": np.arange(10)}),
+                             rows_per_item=10)
+            self.assertEqual(data.dtypes["a"], np.dtype(float))
+            self.assertEqual(data["a"].to_ndarray()[:2].tolist(), [.5, 1.5])
+            self.assertEqual(data.hash, data.calc_hash(with_hash="sha1"))
+            with self.assertRaises(ValueError):
+                data.from_loader([], range_loader)
+            data.destroy()
+
 
 class TestDataZarr(unittest.TestCase):
     def setUp(self):
@@ -455,6 +605,90 @@ class TestDataZarr(unittest.TestCase):
             self.assertCountEqual(data.to_ndarray(), array)
             data.destroy()
 
+    def test_concat_virtual(self):
+        with Data(name="test_v0", driver=Zarr(mode="w", path=TMP_PATH), metadata_path=TMP_PATH,
+                  chunks=(4, 2)) as data0, \
+             Data(name="test_v1", driver=Zarr(mode="w", path=TMP_PATH), metadata_path=TMP_PATH,
+                  chunks=(4, 2)) as data1, \
+             Data(name="test_virtual", driver=Zarr(mode="w", path=TMP_PATH), metadata_path=TMP_PATH,
+                  chunks=(3, 2)) as data_c:
+            array0 = np.random.rand(10, 2)
+            array1 = np.random.rand(7, 2)
+            data0.from_data(array0)
+            data1.from_data(array1)
+            data_c.concat((data0, data1), axis=0, virtual=True)
+            self.assertFalse(os.path.exists(os.path.join(data_c.url, "data")))
+            self.assertEqual([source["rows"] for source in data_c.virtual_sources], [[0, 10], [10, 17]])
+            array = np.concatenate((array0, array1))
+            self.assertEqual(data_c.shape[DEFAUL_GROUP_NAME], (17, 2))
+            self.assertTrue((data_c.to_ndarray() == array).all())
+            self.assertTrue((data_c[8:12].to_ndarray() == array[8:12]).all())
+            data_c.materialize()
+            self.assertEqual(data_c.virtual_sources, None)
+            data0.destroy()
+            data1.destroy()
+            self.assertTrue((data_c.to_ndarray() == array).all())
+            data_c.destroy()
+
+    def test_concat_virtual_changed(self):
+        with Data(name="test_v0", driver=Zarr(mode="w", path=TMP_PATH), metadata_path=TMP_PATH,
+                  chunks=(4, 2)) as data0, \
+             Data(name="test_v1", driver=Zarr(mode="w", path=TMP_PATH), metadata_path=TMP_PATH,
+                  chunks=(4, 2)) as data1, \
+             Data(name="test_virtual", driver=Zarr(mode="w", path=TMP_PATH), metadata_path=TMP_PATH,
+                  chunks=(3, 2)) as data_c:
+            data0.from_data(np.random.rand(10, 2))
+            data1.from_data(np.random.rand(7, 2))
+            data_c.concat((data0, data1), axis=0, virtual=True)
+            stores = data_c.driver.virtual_stores
+            data_c[:5].to_ndarray()
+            self.assertIs(data_c.driver.virtual_stores, stores)
+            data0.append(np.random.rand(3, 2))
+
+        with Data(name="test_virtual", driver=Zarr(mode="r", path=TMP_PATH), metadata_path=TMP_PATH,
+                  chunks=(3, 2)) as data_c:
+            self.assertEqual([source["name"] for source in data_c.changed_sources], ["test_v0"])
+            with self.assertRaises(SourceChanged):
+                data_c.to_ndarray()
+            with self.assertRaises(SourceChanged):
+                data_c[DEFAUL_GROUP_NAME]
+            with self.assertRaises(SourceChanged):
+                data_c[[DEFAUL_GROUP_NAME]]
+            with self.assertRaises(SourceChanged):
+                data_c.materialize()
+            self.assertEqual(data_c.driver[DEFAUL_GROUP_NAME].shape, (17, 2))
+            data_c.destroy()
+
+        for name in ("test_v0", "test_v1"):
+            with Data(name=name, driver=Zarr(mode="r", path=TMP_PATH), metadata_path=TMP_PATH) as data:
+                data.destroy()
+
+    def test_attrs_snapshot(self):
+        with Data(name="test_snapshot", driver=Zarr(mode="w", path=TMP_PATH), metadata_path=TMP_PATH,
+                  chunks=(5, )) as data:
+            data.from_data(np.arange(20))
+            data.author = "author0"
+            data.driver.attrs["author"] = "author1"
+            self.assertEqual(data.author, "author0")
+            size = data.disk_size
+            self.assertEqual(data.driver.attrs["disk_size"], size)
+            self.assertEqual(data.metadata()["size"], size)
+
+        with Data(name="test_snapshot", driver=Zarr(mode="r", path=TMP_PATH), metadata_path=TMP_PATH) as data:
+            self.assertEqual(data.author, "author1")
+            self.assertEqual(data.disk_size, size)
+            data.destroy()
+
+    def test_disk_size_written(self):
+        with Data(name="test_disk_size", driver=Zarr(mode="w", path=TMP_PATH), metadata_path=TMP_PATH,
+                  chunks=(5, )) as data:
+            data.from_data(np.arange(20))
+            self.assertEqual(data.disk_size, np.arange(20).nbytes)
+            data.append(np.arange(10))
+            self.assertEqual(data.disk_size, np.arange(30).nbytes)
+            self.assertEqual(data.driver.written_bytes, 0)
+            data.destroy()
+
     def test_load(self):
         with Data(name="test_load", driver=Zarr(mode="w", path=TMP_PATH), metadata_path=TMP_PATH, chunks=(5, )) as data:
             array = [1, 2, 3, 4, 5]
@@ -532,6 +766,58 @@ class TestPsqlDriver(unittest.TestCase):
             self.assertEqual((data["y"].to_ndarray(dtype=np.dtype("int8")) == y.astype("int8")).all(), True)
             data.destroy()
 
+    @unittest.skipUnless(psql_server, "the postgres server is not available")
+    def test_copy(self):
+        a = np.arange(10)
+        b = np.random.rand(10)
+        b[3] = np.nan
+        c = np.asarray(["x,y", 'q"z', None, "", "e", "f", "g", "h", "i", "j"], dtype=object)
+        with Data(name="test_copy", driver=Postgres(login=self.login, mode="w"), metadata_path=TMP_PATH,
+                  chunks=(4, )) as data:
+            data.from_data({"a": a, "b": b, "c": c})
+            self.assertEqual((data["a"].to_ndarray() == a).all(), True)
+            self.assertEqual(np.allclose(data["b"].to_ndarray(), b, equal_nan=True), True)
+            self.assertEqual(data["c"].to_ndarray().tolist(), c.tolist())
+            self.assertEqual(data["a"][2:5].to_ndarray().tolist(), [2, 3, 4])
+            data.destroy()
+
+    def test_csv_null(self):
+        from dama.connexions.postgres import csv_rows, csv_columns
+        columns = OrderedDict([("a", np.asarray([1.5, np.nan, 3.])),
+                               ("b", np.asarray(["", None, "x"], dtype=object))])
+        text = StringIO(csv_rows(columns))
+        columns = csv_columns(text, np.dtype([("a", float), ("b", object)]))
+        self.assertEqual(np.allclose(columns["a"], [1.5, np.nan, 3.], equal_nan=True), True)
+        self.assertEqual(columns["b"].tolist(), ["", None, "x"])
+
+    def test_csv_null_int(self):
+        from dama.connexions.postgres import csv_columns
+        text = StringIO("1,t\n\\N,\\N\n3,f\n")
+        columns = csv_columns(text, np.dtype([("a", int), ("b", bool)]))
+        self.assertEqual(np.allclose(columns["a"], [1., np.nan, 3.], equal_nan=True), True)
+        self.assertEqual(columns["b"].tolist(), [True, None, False])
+        text = StringIO("1,t\n2,f\n")
+        columns = csv_columns(text, np.dtype([("a", int), ("b", bool)]))
+        self.assertEqual(columns["a"].dtype, np.dtype(int))
+        self.assertEqual(columns["b"].dtype, np.dtype(bool))
+
+    @unittest.skipUnless(PSQL_DSN, "DAMA_POSTGRES_DSN is not set")
+    def test_copy_null_int(self):
+        from dama.drivers.postgres import Postgres as PsqlDriver
+        login = Login(url=PSQL_DSN, table="test_null_int")
+        with Data(name="test_null_int", driver=PsqlDriver(login=login, mode="w"), metadata_path=TMP_PATH,
+                  chunks=(4, )) as data:
+            data.from_data({"a": np.arange(10), "b": np.arange(10) * .5}, with_hash=None)
+            cur = data.driver.conn.cursor()
+            cur.execute("UPDATE test_null_int SET a = NULL WHERE a = 3")
+            data.driver.conn.commit()
+            cur.close()
+            a = data["a"].to_ndarray()
+            self.assertEqual(np.isnan(a[3]), True)
+            self.assertEqual(a[[0, 1, 2, 4]].tolist(), [0, 1, 2, 4])
+            self.assertEqual(data[["a", "b"]].to_ndarray().shape, (10, 2))
+            data.destroy()
+
     def test_iter(self):
         df = pd.DataFrame({"a": [1, 2, 3, 4, 5], "b": ['a', 'b', 'c', 'd', 'e']})
         with Data(name="test_iter_psql", driver=Postgres(login=self.login), metadata_path=TMP_PATH, chunks=(5, )) as data:
@@ -8,6 +8,8 @@ from dama.utils.numeric_functions import index_if_type_row, index_if_type_col
 from dama.utils.numeric_functions import features2rows
 from dama.utils.numeric_functions import max_type
 from dama.utils.numeric_functions import nested_shape
+from dama.utils.numeric_functions import wsrj_batch
+from dama.utils.stats import GroupStats
 
 
 class TestNumericFn(unittest.TestCase):
@@ -96,6 +98,33 @@ class TestNumericFn(unittest.TestCase):
         else:
             self.assertEqual(1, 0)
 
+    def test_wsrj_batch(self):
+        def batchs(array, weights, batch_size):
+            for i in range(0, len(array), batch_size):
+                values = array[i:i + batch_size]
+                yield (lambda v=values: {"x": v}), len(values), weights[i:i + batch_size]
+
+        array = np.arange(1000)
+        weights = np.where(array % 2 == 0, 1., 99.)
+        items = wsrj_batch(batchs(array, weights, 30), 100, random_state=np.random.RandomState(1))
+        self.assertEqual(len(np.unique(items["x"])), 100)
+        self.assertEqual((np.sort(items["x"]) == items["x"]).all(), True)
+        self.assertEqual(np.count_nonzero(items["x"] % 2) > 90, True)
+        self.assertEqual(wsrj_batch(batchs(array[:0], weights, 30), 10), None)
+
+    def test_group_stats(self):
+        x = np.random.RandomState(0).randn(100000)
+        stats = GroupStats(numeric=True)
+        for chunk in np.array_split(x, 7):
+            stats.merge(GroupStats(numeric=True).update(chunk))
+        self.assertAlmostEqual(stats.mean, x.mean())
+        self.assertAlmostEqual(stats.std, x.std())
+        self.assertEqual(stats.sketch.count, len(x))
+        q25, q50, q75 = stats.quantile([.25, .5, .75])
+        self.assertEqual(np.abs(np.mean(x < q25) - .25) < .01, True)
+        self.assertEqual(np.abs(np.mean(x < q50) - .5) < .01, True)
+        self.assertEqual(np.abs(np.mean(x < q75) - .75) < .01, True)
+
 
 def count_values(data, y, v):
     true_values = len([e for e in data[:, y] == v if e])
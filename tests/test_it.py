@@ -3,15 +3,21 @@ import numpy as np
 import pandas as pd
 import datetime
 import collections
+import json
 
-from dama.data.it import Iterator, BatchIterator, Slice
+from dama.data.it import Iterator, BatchIterator, BatchArrayGroup, BatchItGroup, Slice
 from dama.data.ds import Data
 from dama.connexions.core import GroupManager
 from dama.fmtypes import DEFAUL_GROUP_NAME
 from dama.utils.core import Chunks
-from dama.utils.seq import grouper_chunk
+from dama.utils.seq import grouper_chunk, prefetch
 from dama.connexions.core import ListConn
 import numbers
+import threading
+
+def add_one(batch):
+    return {group: array + 1 for group, array in batch.items()}
+
 
 def stream():
     i = 0
@@ -77,6 +83,12 @@ class TestIteratorIter(unittest.TestCase):
         for i, e in enumerate(it.flat()):
             self.assertEqual(e, flat_array[i])
 
+    def test_flat_list(self):
+        it = Iterator([[0, 1], [2, 3], [4, 5]])
+        self.assertEqual(list(it.flat()), [0, 1, 2, 3, 4, 5])
+        it = Iterator(((i, i + 1) for i in range(3)))
+        self.assertEqual(list(it.flat()), [0, 1, 1, 2, 2, 3])
+
     def test_it_attrs(self):
         it = Iterator(stream())
         self.assertEqual(it.dtype, int)
@@ -297,6 +309,21 @@ class TestIteratorBatch(unittest.TestCase):
         self.assertEqual(counter[6], 1)
         self.assertEqual(counter[8], 1)
 
+    def test_value_counts(self):
+        x = np.array([1, 2, 2, 3, 1, 2, 3, 3, 3, 1])
+        y = np.array(["a", "b", "b", "a", "a", "b", "a", "cccc", "a", "a"], dtype=object)
+        with Data(name="test") as data:
+            data.from_data({"x": x, "y": y})
+            batchs = Iterator(data).batchs(chunks=(3, ))
+            counter = batchs.value_counts(["x", "y"])
+            self.assertEqual(counter.to_dict(), {(1, "a"): 3, (2, "b"): 3, (3, "a"): 3, (3, "cccc"): 1})
+            self.assertEqual(counter.total, 10)
+            self.assertEqual(batchs.unique("y"), {"a": 6, "b": 3, "cccc": 1})
+            approx = batchs.value_counts("x", approx=True, top_k=2)
+            self.assertEqual(approx.distinct, 3)
+            self.assertEqual(approx.most_common(), [(3, 4), (2, 3)])
+            data.destroy()
+
     def test_buffer(self):
         v = list(range(100))
         it = Iterator(v)
@@ -321,9 +348,25 @@ class TestIteratorBatch(unittest.TestCase):
         array[:, 0] = np.arange(0, 20)
         array[:, 1] = np.arange(0, 20) + 1
         it = Iterator(array).batchs(chunks=(3, 2))
-        flat_array = array.reshape(-1)
-        for i, e in enumerate(it.flat()):
-            self.assertEqual(e, flat_array[i])
+        flat_it = it.flat()
+        self.assertEqual(flat_it.shape.to_tuple(), (40, ))
+        self.assertEqual(flat_it.batch_size, 6)
+        batchs = [slice_obj.batch.to_ndarray() for slice_obj in flat_it]
+        self.assertEqual(len(batchs), 7)
+        self.assertEqual((np.concatenate(batchs) == array.reshape(-1)).all(), True)
+
+    def test_flat_batch_dim(self):
+        array = np.arange(0, 60).reshape(5, 3, 4)
+        with Data(name="test") as data:
+            data.from_data({"x": array})
+            flat_it = Iterator(data).batchs(chunks=(2, )).flat()
+            self.assertEqual(flat_it.groups, ("x", ))
+            self.assertEqual(flat_it.length, 60)
+            slices = [(slice_obj.slice.start, slice_obj.slice.stop) for slice_obj in flat_it]
+            self.assertEqual(slices, [(0, 24), (24, 48), (48, 60)])
+            flat_array = np.concatenate([slice_obj.batch["x"].to_ndarray() for slice_obj in flat_it])
+            self.assertEqual((flat_array == array.reshape(-1)).all(), True)
+            data.destroy()
 
     def test_clean_batchs(self):
         it = Iterator(((i, 'X', 'Z') for i in range(20))).batchs(chunks=(2, 3))
@@ -341,6 +384,74 @@ class TestIteratorBatch(unittest.TestCase):
             samples.append(e)
         self.assertEqual((samples == array[:5]).all(), False)
 
+    def test_bulk_assign_rows(self):
+        rows = [(i, i * .5, str(i)) for i in range(10)]
+        dtypes = np.dtype([("a", np.dtype(int)), ("b", np.dtype(float)), ("c", np.dtype(object))])
+        it = Iterator(rows, dtypes=dtypes).batchs(chunks=(4, ))
+        for smx in it:
+            self.assertEqual((smx.batch["a"].to_ndarray() == np.arange(10)[smx.slice]).all(), True)
+            self.assertEqual((smx.batch["b"].to_ndarray() == (np.arange(10) * .5)[smx.slice]).all(), True)
+            self.assertEqual(list(smx.batch["c"].to_ndarray()), [str(i) for i in range(10)][smx.slice])
+
+    def test_bulk_assign_namedtuple(self):
+        Row = collections.namedtuple("Row", "b a")
+        rows = [Row(b=i + 1, a=i) for i in range(10)]
+        dtypes = np.dtype([("a", np.dtype(int)), ("b", np.dtype(int))])
+        it = Iterator(rows, dtypes=dtypes).batchs(chunks=(5, ))
+        for smx in it:
+            self.assertEqual((smx.batch["a"].to_ndarray() == np.arange(10)[smx.slice]).all(), True)
+            self.assertEqual((smx.batch["b"].to_ndarray() == np.arange(1, 11)[smx.slice]).all(), True)
+
+    def test_bulk_assign_irregular(self):
+        from dama.data.it import assign_struct_array
+        dtype = np.dtype([(DEFAUL_GROUP_NAME, np.dtype("object"))])
+        rows = [1, 'xxx', [1], [[2, 3]]]
+        stc_arr = assign_struct_array(iter(rows), int, 0, 4, dtype, 1)
+        self.assertEqual(stc_arr[DEFAUL_GROUP_NAME][2], [1])
+        self.assertEqual(stc_arr[DEFAUL_GROUP_NAME][3], [[2, 3]])
+
+    def test_array_batchs(self):
+        array = np.random.rand(10, 2)
+        dtypes = np.dtype([(DEFAUL_GROUP_NAME, np.dtype("float")), ("g1", np.dtype("float"))])
+        it = Iterator(array, dtypes=dtypes).batchs(chunks=(3, ))
+        self.assertEqual(isinstance(it, BatchArrayGroup), True)
+        slices = []
+        for slice_obj in it:
+            slices.append(slice_obj.slice)
+            self.assertEqual((slice_obj.batch["g1"].to_ndarray() == array[slice_obj.slice, 1]).all(), True)
+        self.assertEqual(slices, [slice(0, 3), slice(3, 6), slice(6, 9), slice(9, 10)])
+
+    def test_df_array_batchs(self):
+        df = pd.DataFrame({"x": np.arange(0, 10), "y": np.arange(10, 20).astype(float)})
+        it = Iterator(df).batchs(chunks=(4, ), start_i=10)
+        self.assertEqual(isinstance(it, BatchArrayGroup), True)
+        for _ in range(2):
+            for slice_obj in it:
+                data_slice = slice(slice_obj.slice.start - 10, slice_obj.slice.stop - 10)
+                self.assertEqual((slice_obj.batch["x"].to_ndarray() == df["x"].values[data_slice]).all(), True)
+                self.assertEqual((slice_obj.batch["y"].to_ndarray() == df["y"].values[data_slice]).all(), True)
+
+    def test_array_batchs_consumed(self):
+        array = np.arange(10)
+        it = Iterator(array)
+        next(it)
+        b_it = it.batchs(chunks=(3, ))
+        self.assertEqual(isinstance(b_it, BatchItGroup), True)
+
+    def test_sample_batch_weight(self):
+        array = np.zeros((2000, 2))
+        array[:, 0] = np.arange(2000)
+        array[:, 1] = np.arange(2000) % 2
+        dtypes = np.dtype([("x", np.dtype(float)), ("y", np.dtype(float))])
+        it = Iterator(array, dtypes=dtypes).batchs(chunks=(100, ))
+        samples_it = it.sample(50, col="y", weight_fn=lambda y: y * 98 + 1)
+        self.assertEqual(isinstance(samples_it, Iterator), True)
+        with Data(name="test") as data:
+            data.from_data(samples_it)
+            self.assertEqual(data.shape, (50, 2))
+            self.assertEqual(np.count_nonzero(data["y"].to_ndarray()) > 40, True)
+            self.assertEqual(len(np.unique(data["x"].to_ndarray())), 50)
+
     def test_one_elem(self):
         data = [[1, 2, 'a', 's'], [2, 3, 'c', 'e']]
         dtypes = np.dtype([("a", int), ("b", int), ("c", str), ("s", str)])
@@ -511,6 +622,124 @@ class TestIteratorFromData(unittest.TestCase):
             for e in it:
                 self.assertEqual((e.batch.to_ndarray() == x[e.slice]).all(), True)
 
+    def test_seek(self):
+        array = np.arange(0, 20)
+        with Data(name="test") as data:
+            data.from_data({"x": array})
+            batchs = Iterator(data).batchs(chunks=(3, ))
+            self.assertEqual((batchs[2].batch["x"].to_ndarray() == array[6:9]).all(), True)
+            self.assertEqual((batchs[-1].batch["x"].to_ndarray() == array[18:]).all(), True)
+            slices = [(s.slice.start, s.slice.stop) for s in batchs.seek(5)]
+            self.assertEqual(slices, [(15, 18), (18, 21)])
+            sub_batchs = Iterator(data).batchs(chunks=(3, ))[4:11]
+            self.assertEqual(sub_batchs.length, 7)
+            rows = np.concatenate([s.batch["x"].to_ndarray() for s in sub_batchs])
+            self.assertEqual((rows == array[4:11]).all(), True)
+            data.destroy()
+
+    def test_seek_one_pass(self):
+        array = np.arange(0, 20)
+        with Data(name="test") as data:
+            data.from_data({"x": array})
+            batchs = Iterator(data).batchs(chunks=(3, )).seek(5)
+            self.assertEqual([s.slice.start for s in batchs], [15, 18])
+            self.assertEqual([s.slice.start for s in batchs], list(range(0, 20, 3)))
+            cycle = Iterator(data).batchs(chunks=(5, )).seek(3).cycle()
+            rows = np.concatenate([s.batch["x"].to_ndarray() for s in cycle[:10]])
+            self.assertEqual(rows.tolist(), list(range(15, 20)) + list(range(0, 5)))
+            data.destroy()
+
+    def test_batchs_getitem_keys(self):
+        array = np.arange(0, 20)
+        with Data(name="test") as data:
+            data.from_data({"x": array})
+            batchs = Iterator(data).batchs(chunks=(3, ))
+            self.assertEqual((batchs[np.int64(2)].batch["x"].to_ndarray() == array[6:9]).all(), True)
+            sub_batchs = batchs[-7:-2]
+            self.assertEqual(sub_batchs.length, 5)
+            rows = np.concatenate([s.batch["x"].to_ndarray() for s in sub_batchs])
+            self.assertEqual((rows == array[-7:-2]).all(), True)
+            self.assertEqual(batchs[15:5].length, 0)
+            self.assertEqual(list(batchs[15:5]), [])
+            with self.assertRaises(TypeError):
+                batchs["x"]
+            with self.assertRaises(IndexError):
+                batchs[7]
+            data.destroy()
+
+    def test_resume(self):
+        array = np.arange(0, 20)
+        with Data(name="test") as data:
+            data.from_data({"x": array})
+            batchs = Iterator(data).batchs(chunks=(4, ))
+            for i, slice_obj in enumerate(batchs):
+                if i == 1:
+                    cursor = json.loads(json.dumps(batchs.cursor))
+                    break
+            self.assertEqual(cursor["row"], 8)
+            resumed = Iterator(data).batchs(chunks=(4, )).resume(cursor)
+            rows = np.concatenate([s.batch["x"].to_ndarray() for s in resumed])
+            self.assertEqual((rows == array[8:]).all(), True)
+            with self.assertRaises(ValueError):
+                Iterator(data).batchs(chunks=(5, )).resume(cursor)
+            data.destroy()
+
+    def test_window_batch(self):
+        x = np.arange(0, 40).reshape(20, 2)
+        with Data(name="test") as data:
+            data.from_data({"x": x, "y": np.arange(0, 20)})
+            windows = Iterator(data).batchs(chunks=(3, )).window(3, stride=2, dilation=2)
+            self.assertEqual(windows.shape["x"], (8, 3, 2))
+            self.assertEqual(windows.shape["y"], (8, 3))
+            y = np.concatenate([slice_obj.batch["y"].to_ndarray() for slice_obj in windows])
+            self.assertEqual(y.tolist(), [[i, i + 2, i + 4] for i in range(0, 16, 2)])
+            x_windows = np.concatenate([slice_obj.batch["x"].to_ndarray() for slice_obj in windows])
+            self.assertEqual((x_windows[1] == x[2:7:2]).all(), True)
+            data.destroy()
+
+    def test_shuffle(self):
+        x = np.arange(100)
+        with Data(name="test", chunks=(10, )) as data:
+            data.from_data(x)
+            it = Iterator(data).batchs(chunks=(7, ))
+            self.assertEqual(it.chunk_slices(), [slice(0, 100)])
+            shuffle_it = it.shuffle(buffer_chunks=3, seed=1)
+            epochs = []
+            for _ in range(2):
+                batchs = [e.batch.to_ndarray() for e in shuffle_it]
+                self.assertEqual([len(batch) for batch in batchs], [7] * 14 + [2])
+                epochs.append(np.concatenate(batchs))
+            self.assertEqual((np.sort(epochs[0]) == x).all(), True)
+            self.assertEqual((epochs[0] == x).all(), False)
+            self.assertEqual((epochs[0] == epochs[1]).all(), False)
+            seed_epoch = np.concatenate([e.batch.to_ndarray() for e in it.shuffle(buffer_chunks=3, seed=1)])
+            self.assertEqual((seed_epoch == epochs[0]).all(), True)
+
+    def test_shuffle_slice(self):
+        x = np.arange(100)
+        with Data(name="test", chunks=(10, )) as data:
+            data.from_data(x)
+            it = Iterator(data).batchs(chunks=(7, ))[55:80]
+            self.assertEqual(it.chunk_slices(), [slice(55, 80)])
+            batchs = [e.batch.to_ndarray() for e in it.shuffle(seed=1)]
+            self.assertEqual([len(batch) for batch in batchs], [7] * 3 + [4])
+            self.assertEqual((np.sort(np.concatenate(batchs)) == x[55:80]).all(), True)
+
+    def test_shuffle_storage_chunks(self):
+        x = np.random.rand(60000, 3)
+        y = np.arange(60000)
+        with Data(name="test", chunks=Chunks({"x": (1000, 3), "y": (1000, )})) as data:
+            data.from_data({"x": x, "y": y})
+            step = data.storage_chunks()["y"][0]
+            self.assertEqual(step > 1000, True)
+            it = Iterator(data).batchs(chunks=(100, ))
+            self.assertEqual(it.storage_rows(), step)
+            self.assertEqual(it.chunk_slices()[0], slice(0, step))
+            it = it[step - 10:step + 10]
+            self.assertEqual(it.chunk_slices(), [slice(step - 10, step), slice(step, step + 10)])
+            batchs = [e.batch.to_ndarray() for e in it.shuffle(seed=1)]
+            self.assertEqual(sorted(np.concatenate(batchs)[:, 3].tolist()), y[step - 10:step + 10].tolist())
+
 
 class TestIteratorLoop(unittest.TestCase):
     def test_cycle_it(self):
@@ -565,6 +794,47 @@ class TestIteratorLoop(unittest.TestCase):
         self.assertEqual(it.shape["x"], (100, 3))
         self.assertEqual(it.shape["y"], (100, 3))
 
+    def test_prefetch(self):
+        array = np.arange(0, 100)
+        it = Iterator(array).batchs(chunks=(7, )).prefetch(3)
+        self.assertEqual(it.batch_size, 7)
+        self.assertEqual(it.num_splits(), 15)
+        for _ in range(2):
+            elems = [slice_obj.batch.to_ndarray() for slice_obj in it]
+            self.assertEqual((np.concatenate(elems) == array).all(), True)
+
+    def test_prefetch_error(self):
+        def _it():
+            for i in range(10):
+                if i == 5:
+                    raise ValueError("bad row")
+                yield i
+        it = BatchIterator.from_batchs(_it(), dtypes=np.dtype([("x", np.dtype(int))]), from_batch_size=1,
+                                       length=10)
+        with self.assertRaises(ValueError):
+            for _ in it.prefetch(2):
+                pass
+
+    def test_map(self):
+        df = pd.DataFrame({"x": np.arange(0, 20), "y": np.arange(0, 20) * .5})
+        it = Iterator(df).batchs(chunks=(3, )).map(add_one, workers=2)
+        self.assertEqual(it.dtypes, np.dtype([("x", np.dtype(int)), ("y", np.dtype(float))]))
+        self.assertEqual(it.shape, (20, 2))
+        self.assertEqual(it.batch_size, 3)
+        init = 0
+        for slice_obj in it:
+            self.assertEqual(slice_obj.slice.start, init)
+            self.assertEqual((slice_obj.batch["x"].to_ndarray() == df["x"].values[slice_obj.slice] + 1).all(), True)
+            self.assertEqual((slice_obj.batch["y"].to_ndarray() == df["y"].values[slice_obj.slice] + 1).all(), True)
+            init = slice_obj.slice.stop
+
+    def test_map_unordered(self):
+        array = np.arange(0, 20)
+        it = Iterator(array).batchs(chunks=(3, )).map(add_one, workers=2, ordered=False)
+        with Data(name="test") as data:
+            data.from_data(it)
+            self.assertEqual((data.to_ndarray() == array + 1).all(), True)
+
 
 def chunk_sizes(seq):
     return [len(list(row)) for row in seq]
@@ -593,3 +863,12 @@ class TestSeq(unittest.TestCase):
     def test_grouper_chunk_7(self):
         seq = grouper_chunk(7, self.X)
         self.assertEqual(chunk_sizes(seq), [7, 3])
+
+    def test_prefetch_order(self):
+        self.assertEqual(list(prefetch(range(100), 4)), list(range(100)))
+
+    def test_prefetch_close(self):
+        seq = prefetch(range(1000), 2)
+        self.assertEqual(next(seq), 0)
+        seq.close()
+        self.assertEqual([t for t in threading.enumerate() if t.name == "prefetch"], [])
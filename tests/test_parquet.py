@@ -0,0 +1,58 @@
+import unittest
+import numpy as np
+import os
+from dama.data.ds import Data
+from dama.utils.core import Chunks
+from dama.utils.files import check_or_create_path_dir
+
+
+TMP_PATH = check_or_create_path_dir(os.path.dirname(os.path.abspath(__file__)), 'dama_data_test')
+
+
+try:
+    from dama.drivers.parquet import Parquet
+except ImportError:
+    Parquet = None
+
+
+@unittest.skipIf(Parquet is None, "pyarrow is not installed")
+class TestParquet(unittest.TestCase):
+    def setUp(self):
+        self.x = np.random.rand(100, 3)
+        self.y = np.arange(100)
+        self.chunks = Chunks({"x": (10, 3), "y": (10, )})
+
+    def test_row_groups(self):
+        with Data(name="test_parquet", driver=Parquet(path=TMP_PATH, mode="w"), metadata_path=TMP_PATH,
+                  chunks=self.chunks) as data:
+            data.from_data({"x": self.x, "y": self.y})
+            statistics = data.driver.statistics()
+            self.assertEqual([rows for rows, _ in statistics], [10] * 10)
+            self.assertEqual(statistics[3][1]["y"], (30, 39, 0))
+            self.assertEqual((data["x"].to_ndarray() == self.x).all(), True)
+            self.assertEqual((data[15:35]["y"].to_ndarray() == self.y[15:35]).all(), True)
+            hash_hex = data.hash
+
+        with Data(name="test_parquet", driver=Parquet(path=TMP_PATH, mode="r"), metadata_path=TMP_PATH,
+                  auto_chunks=True) as data:
+            self.assertEqual(data.hash, hash_hex)
+            self.assertEqual(data.shape["x"], (100, 3))
+            data.destroy()
+
+    def test_filter(self):
+        with Data(name="test_parquet", driver=Parquet(path=TMP_PATH, mode="w"), metadata_path=TMP_PATH,
+                  chunks=self.chunks) as data:
+            data.from_data({"x": self.x, "y": self.y})
+            predicate = (data.data["y"] >= 42) & (data.data["y"] < 57)
+            table = data.data.sources["y"].where(predicate)
+            self.assertEqual([i for i, _ in table.selection], [4, 5])
+            filtered = data.data[predicate]
+            self.assertEqual((filtered["y"].to_ndarray() == self.y[42:57]).all(), True)
+            self.assertEqual((filtered["x"].to_ndarray() == self.x[42:57]).all(), True)
+            filtered = data.data[~(data.data["y"] < 95)]
+            self.assertEqual((filtered["y"].to_ndarray() == self.y[95:]).all(), True)
+            data.destroy()
+
+
+if __name__ == '__main__':
+    unittest.main()
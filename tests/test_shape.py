@@ -60,3 +60,16 @@ class TestChunks(unittest.TestCase):
         chunks = Chunks.build_from_shape(shape, dtypes, memory_allowed=.0001)
         for s, c in zip(shape.values(), chunks.values()):
             self.assertEqual(s >= c, True)
+
+    def test_plan_chunks(self):
+        dtypes = np.dtype([("x", np.dtype("float64")), ("y", np.dtype("int8"))])
+        shape = Shape({"x": (1000, 10), "y": (1000, )})
+        chunks = Chunks.build_from_shape(shape, dtypes, chunk_bytes=800)
+        self.assertEqual(chunks, {"x": (10, 10), "y": (10, )})
+        self.assertEqual(chunks, Chunks.build_from_shape(shape, dtypes, chunk_bytes=800))
+        chunks = Chunks.build_from_shape(shape, dtypes, chunk_bytes=800, access="columns")
+        self.assertEqual(chunks, {"x": (100, 1), "y": (800, )})
+        chunks = Chunks.build_from_shape(shape, dtypes, chunk_bytes=800, storage={"x": (4, 10), "y": (3, )})
+        self.assertEqual(chunks, {"x": (8, 10), "y": (9, )})
+        chunks = Chunks.build_from_shape(shape, dtypes, chunk_bytes=2**30)
+        self.assertEqual(chunks, {"x": (1000, 10), "y": (1000, )})